@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+
+# Defaults for the admission and degradation controller
+MAX_IN_FLIGHT = 8  # Max transcription requests in flight per node
+MAX_CONNECTIONS = 200  # Max concurrent WebSocket connections per node
+# Features shed under pressure, in order, with the load factor at which each is shed.
+# Load factor = (in-flight + waiting requests) / MAX_IN_FLIGHT
+SHED_ORDER = [
+    ("long", 0.75),  # Skip the 'long' re-transcription first
+    ("summary", 1.0),  # Then skip automatic summaries
+    ("merge_short", 1.5),  # Then merge short segments into fewer requests
+]
+RECOVERY_MARGIN = 0.25  # Load factor must drop this far below a threshold before a feature is restored
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_connections=MAX_CONNECTIONS,
+                 shed_order=SHED_ORDER, recovery_margin=RECOVERY_MARGIN):
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.shed_order = list(shed_order)
+        self.recovery_margin = recovery_margin
+        self.in_flight = 0  # Transcription requests currently sent to a backend
+        self.waiting = 0  # Transcription requests waiting for a free slot
+        self.connections = 0  # Connections currently admitted
+        self.shed_level = 0  # Number of features from shed_order currently shed
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.listeners = set()  # Callbacks notified when the degradation state changes
+        # Counters for observing the controller under load
+        self.stats = {
+            "rejected_connections": 0,
+            "shed": {feature: 0 for feature, _ in self.shed_order},
+            "max_load_factor": 0.0,
+        }
+
+    # Current load relative to the in-flight cap
+    def load_factor(self):
+        return (self.in_flight + self.waiting) / self.max_in_flight
+
+    @property
+    def degraded(self):
+        return self.shed_level > 0
+
+    # Admit a new connection, returns False when the node is at its connection cap
+    def try_connect(self):
+        if self.connections >= self.max_connections:
+            self.stats["rejected_connections"] += 1
+            return False
+        self.connections += 1
+        return True
+
+    def disconnect(self):
+        self.connections = max(0, self.connections - 1)
+
+    # Check if a feature is currently being shed, counting each shed occurrence
+    def should_shed(self, feature):
+        for level, (name, _) in enumerate(self.shed_order):
+            if name == feature:
+                if level < self.shed_level:
+                    self.stats["shed"][feature] += 1
+                    return True
+                return False
+        return False
+
+    # Register a callback called with the controller whenever degraded state changes
+    def add_listener(self, callback):
+        self.listeners.add(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.discard(callback)
+
+    # Recompute the shed level from the current load, with hysteresis on the way down
+    def update(self):
+        load = self.load_factor()
+        self.stats["max_load_factor"] = max(self.stats["max_load_factor"], load)
+        level = self.shed_level
+        while level < len(self.shed_order) and load >= self.shed_order[level][1]:
+            level += 1
+        while level > 0 and load < self.shed_order[level - 1][1] - self.recovery_margin:
+            level -= 1
+        if level != self.shed_level:
+            self.shed_level = level
+            for callback in list(self.listeners):
+                callback(self)
+
+    # Acquire an in-flight slot for a transcription request
+    async def acquire(self):
+        self.waiting += 1
+        self.update()
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.update()
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+        self.update()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    # Build the notice sent to clients when degradation state changes
+    def status_message(self):
+        shed = [feature for feature, _ in self.shed_order[:self.shed_level]]
+        return json.dumps({
+            "status": "degraded" if self.degraded else "normal",
+            "shed": shed,
+            "timestamp": time.time(),
+        })
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "connections": self.connections,
+            "load_factor": round(self.load_factor(), 3),
+            "shed_level": self.shed_level,
+            **self.stats,
+        }
@@ -1,17 +1,27 @@
 import asyncio
 import websockets
 import aiohttp # type: ignore
-import ipaddress
 import json
+import logging
 import ssl
 import datetime
 import time
 import os
+import uuid
 import io
 import wave
-import webrtcvad # type: ignore
-from openai_client import generate_response
+from summarizer import SessionSummaries, SummaryEngine
+from admission_control import AdmissionController
+from connection_admission import ConnectionAdmission, forwarded_client_ip
+from shm_transport import ShmTranscriptionClient
+from work_queue import QueueTranscriptionClient
+from transcript_store import TranscriptStore, viewer_token
 from pathlib import Path
+from structured_logging import setup_logging
+from diagnostics import LoopLagMonitor, install_profiler_signal
+from session_capture import open_capture
+from vad_tuner import VadTuner, totals_snapshot
+from session_hub import SessionHub
 import boto3
 from botocore.exceptions import NoCredentialsError
 
@@ -32,21 +42,81 @@ MIN_SPEECH_LENGTH = SAMPLE_RATE * BYTES_PER_SAMPLE  # Minimum speech length in b
 PHRASE_TIMEOUT_MS = 300  # Timeout after speech ends, in ms
 FRAME_DURATION_MS = 30  # Duration of an audio frame in ms
 FRAME_SIZE = (SAMPLE_RATE * FRAME_DURATION_MS * BYTES_PER_SAMPLE * CHANNEL_WIDTH) // 1000  # Size of an audio frame in bytes
+TRANSCRIBE_URL = 'http://localhost:8001/transcribe'  # Transcription backend (or stub_transcribe.py)
+# 'shm' for a co-located worker, 'queue' for workers pulling from the local work queue, 'http' for remote
+TRANSCRIBE_TRANSPORT = os.environ.get("TRANSCRIBE_TRANSPORT", "shm")
+STATS_INTERVAL = 60  # Seconds between logs of node-wide stats
 Path(RECORDINGS_DIR).mkdir(parents=True, exist_ok=True)  # Ensure the recordings directory exists
 
+logger = logging.getLogger(__name__)
 
-# Initialize VAD
-vad = webrtcvad.Vad(1)  # Aggressiveness level is defaulted to 1
 
-# SSL context for securing WebSocket connection
-ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-ssl_context.load_cert_chain("cloudflare-cert.pem", "cloudflare-key.pem")
+# SSL context for securing WebSocket connection, built at startup so tools can import this module
+def create_ssl_context():
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_cert_chain("cloudflare-cert.pem", "cloudflare-key.pem")
+    return ssl_context
+
+# Only allow connections from the Cloudflare IP ranges (reloaded when cloudflare_ips.json changes),
+# and rate limit new connections per client IP and overall
+connection_admission = ConnectionAdmission()
+
+# Observers subscribed to sessions' transcripts and summaries
+hub = SessionHub()
+
+# Transcripts of every session, kept on disk so clients can fetch history after reconnecting
+transcript_store = TranscriptStore()
 
-# Load the Cloudflare IP ranges to only allow connections from them
-with open('cloudflare_ips.json', 'r') as json_file:
-    cloudflare_ips = json.load(json_file)["cloudflare_ips"]
-allowed_networks = [ipaddress.ip_network(range) for range in cloudflare_ips]
-connected_clients = set()   # Keep track of connected clients
+# Remote summaries with a deadline, after which a local extractive summary is sent
+summary_engine = SummaryEngine()
+
+# Caps in-flight transcriptions and connections, shedding features under backlog
+admission = AdmissionController()
+
+# Shared-memory client for a transcription worker on this host
+shm_client = ShmTranscriptionClient() if TRANSCRIBE_TRANSPORT == "shm" else None
+# Work queue publisher, any number of workers on this host pull the jobs
+queue_client = QueueTranscriptionClient() if TRANSCRIBE_TRANSPORT == "queue" else None
+
+
+# Send audio to the transcription backend, returns the response body or None on failure.
+# Uses shared memory or the work queue when configured, falling back to HTTP with a file that
+# save(), when given, writes first. Shared memory never touches the disk.
+async def request_transcription(payload, audio_data, save=None):
+    response = None
+    if queue_client is not None:
+        if save is not None:
+            await save()  # Queue workers may forward the job to an HTTP backend that reads the file
+        try:
+            response = await queue_client.transcribe({**payload, 'sample_rate': SAMPLE_RATE}, audio_data)
+        except Exception as e:
+            logger.error("Transcription job failed: %s", e, extra={"category": "transcription"})
+            return None
+    elif shm_client is not None and shm_client.available():  # Skipped for a while after a failure
+        try:
+            response = await shm_client.transcribe(audio_data, payload['audio_size'], SAMPLE_RATE,
+                                                   speech_only=payload['speech_only'])
+        except (OSError, ValueError) as e:
+            logger.warning("Shared memory transport unavailable, falling back to HTTP: %s", e,
+                           extra={"category": "transcription"})
+    if response is not None:
+        if 'error' in response:
+            logger.error("Transcription failed: %s", response.get('details', response['error']),
+                         extra={"category": "transcription"})
+            return None
+        return response
+
+    if save is not None:
+        await save()
+    async with aiohttp.ClientSession() as session:
+        async with session.post(TRANSCRIBE_URL, json=payload) as response:
+            if response.status != 200:
+                logger.error("Failed to send audio to transcription server, status %s", response.status,
+                             extra={"category": "transcription"})
+                return None
+
+            logger.debug("Audio sent for transcription", extra={"category": "transcription"})
+            return await response.json()
 
 
 class ConnectionHandler:
@@ -59,8 +129,12 @@ class ConnectionHandler:
         self.long_chunks = bytearray()  # Buffer to hold longer audio for transcription
         self.speech_segment_buffer = bytearray()  # Buffer to hold the current speech segment
         self.silence_duration_ms = 0  # Counter for the duration of silence
-        self.long_transcriptions = {}  # Dictionary to store long transcriptions for each client
+        self.session_id = uuid.uuid4().hex  # Identifies this session's transcripts in the store, public
+        self.resume_token = None  # Secret that lets a reconnecting client continue this session
         self.processing_start_time = None  # Add a variable to track processing start time
+        # VAD for this connection, made less sensitive while its segments keep transcribing empty
+        self.vad_tuner = VadTuner(SAMPLE_RATE, FRAME_DURATION_MS / 1000)
+        self.summaries = SessionSummaries(summary_engine)  # At most one summary in progress per connection
 
     # Process incoming WebSocket message
     async def process_message(self, websocket, message):
@@ -73,16 +147,45 @@ class ConnectionHandler:
             # Handle non-binary message (JSON)
             try: 
                 json_object = json.loads(message)
-                await self.summarize(json_object['text'], websocket)
+                if 'resume' in json_object:
+                    # A reconnecting client continues its earlier session, with the token it was given
+                    session_id, token = str(json_object['resume']), json_object.get('token')
+                    if await asyncio.to_thread(transcript_store.check_token, session_id, token):
+                        self.session_id, self.resume_token = session_id, token
+                        await websocket.send(json.dumps({"session_id": self.session_id, "resume_token": token,
+                                                         "viewer_token": viewer_token(token)}))
+                    else:
+                        await websocket.send(json.dumps({"error": "Invalid resume token", "session_id": session_id}))
+                elif 'history' in json_object:
+                    await self.send_history(websocket, json_object['history'])
+                elif 'subscribe' in json_object:
+                    # Observers need the viewer token the speaker shares, the session id alone is public
+                    session_id = str(json_object['subscribe'])
+                    if not await asyncio.to_thread(transcript_store.check_viewer, session_id, json_object.get('token')):
+                        await websocket.send(json.dumps({"error": "Invalid viewer token", "session_id": session_id}))
+                    elif hub.subscribe(session_id, websocket):
+                        await websocket.send(json.dumps({"subscribed": session_id}))
+                    else:
+                        await websocket.send(json.dumps({"error": "Too many subscribers", "session_id": session_id}))
+                elif 'unsubscribe' in json_object:
+                    hub.unsubscribe(str(json_object['unsubscribe']), websocket)
+                elif 'search' in json_object:
+                    results = await asyncio.to_thread(transcript_store.search, str(json_object['search']), self.session_id)
+                    await websocket.send(json.dumps({"search_results": results}))
+                else:
+                    self.start_summary(json_object['text'], websocket)
             except ValueError as e:
-                print("Not valid JSON:", message)
+                logger.warning("Not valid JSON: %.200s", message, extra={"category": "connection"})
+            except (KeyError, TypeError, AttributeError):
+                logger.warning("Unrecognised message: %.200s", message, extra={"category": "connection"})
 
     # Call this function when transcription is sent to client to calculate and print processing time
     def print_processing_time(self):
         if self.processing_start_time is not None:
             processing_end_time = time.time()
             processing_time = processing_end_time - self.processing_start_time
-            print(f"Processing time: {processing_time:.2f} seconds")
+            logger.info("Processing time: %.2f seconds", processing_time,
+                        extra={"category": "transcription", "processing_secs": round(processing_time, 3)})
             self.processing_start_time = None  # Reset the timer for the next audio message
 
 
@@ -98,7 +201,7 @@ class ConnectionHandler:
             self.speech_buffer = self.speech_buffer[FRAME_SIZE:]
 
             # Use VAD to check if the current frame contains speech
-            if vad.is_speech(frame, SAMPLE_RATE):
+            if self.vad_tuner.is_speech(frame):
                 self.speech_segment_buffer.extend(frame)
                 self.silence_duration_ms = 0  # Reset silence duration when speech is detected
 
@@ -130,6 +233,10 @@ class ConnectionHandler:
         self.speech_segment_buffer = bytearray()   # Clear speech segment buffer
         self.silence_duration_ms = 0  # Reset silence duration
 
+        # Under heavy backlog, keep merging short segments until the buffer is full
+        if len(self.combined_chunks) < MAX_SPEECH_LENGTH and admission.should_shed('merge_short'):
+            return
+
         # Check if we have enough audio to save and transcribe
         if len(self.combined_chunks) >= MIN_SPEECH_LENGTH:
             # Construct filename and save audio
@@ -138,22 +245,28 @@ class ConnectionHandler:
             self.long_chunks.extend(self.combined_chunks)
 
             # Reset combined chunks buffer
+            audio_data = self.combined_chunks
             self.combined_chunks = bytearray()
             self.sequence += 1
             self.audio_saved += 1
 
             # Transcribe the short audio segment
-            await self.transcribe_audio(filename, 'short', websocket)
+            await self.transcribe_audio(filename, 'short', websocket, audio_data)
 
             # Every LONG_AUDIO_AMOUNT of audio pieces, transcribe long audio
             if self.audio_saved % LONG_AUDIO_AMOUNT == 0:
+                # Skip the long re-transcription first when the backend is falling behind
+                if admission.should_shed('long'):
+                    logger.info("Backend under pressure, skipping long transcription", extra={"category": "admission"})
+                    self.long_chunks = bytearray()
+                    return
+
                 self.long_audio_saved += 1
                 filename = f"combinedaudio_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{self.sequence}.wav"
                 await self.save_audio(filename, self.long_chunks)
 
                 # Transcribe the long audio segment
-                transcription = await self.transcribe_audio(filename, 'long', websocket)
-                await self.save_long_transcription(transcription, websocket)
+                await self.transcribe_audio(filename, 'long', websocket, self.long_chunks)
 
                 # Clear the long chunks buffer
                 self.long_chunks = bytearray()
@@ -175,142 +288,196 @@ class ConnectionHandler:
                 # Read the contents of the buffer
                 audio_bytes = audio_buffer.read()
             
-            # Upload the audio bytes to S3
-            s3_client.put_object(Bucket=BUCKET_NAME, Key=filename, Body=audio_bytes)
-            print(f"{filename} saved to S3.")
+            # Upload the audio bytes to S3 without holding up the event loop
+            await asyncio.to_thread(s3_client.put_object, Bucket=BUCKET_NAME, Key=filename, Body=audio_bytes)
+            logger.debug("%s saved to S3", filename, extra={"category": "recording"})
         except NoCredentialsError:
-            print("Credentials not available for AWS S3.")
+            logger.error("Credentials not available for AWS S3", extra={"category": "recording"})
 
     # Send audio data to transcription service and handle the response
-    async def transcribe_audio(self, filename, size, ws):
-        flask_server_url = f'http://localhost:8001/transcribe'
+    async def transcribe_audio(self, filename, size, ws, audio_data):
+        segment = self.audio_saved  # Echoed with the transcript, a long one carries its last segment's number
+        # Segments were cut by webrtcvad, so the backend can skip its own VAD pass
         payload = {'audio_file_path': os.path.join(
-            RECORDINGS_DIR, filename), 'audio_size': size}
-
-        # Post audio file to the transcription server
-        async with aiohttp.ClientSession() as session:
-            async with session.post(flask_server_url, json=payload) as response:
-                if response.status != 200:
-                    print("Failed to send audio to transcription server.",
-                          response.status)
-                    return
-
-                print("Audio sent for transcription")
-                # Extract transcription from response
-                transcription_data = await response.json()
-                transcription = transcription_data.get('transcription', '')
-
-                # If transcription is empty, no speech was detected
-                if not transcription:
-                    print("Audio contains no speech")
-                    return
-
-                # Send transcription back to the client
-                message = {"transcript": transcription, "audio_size": size}
-                await ws.send(json.dumps(message))
-                print("Transcription:", transcription)
-
-                # After sending the transcript, calculate and print processing time
-                self.print_processing_time()
-
-                # Initial summarize functionality
-                if self.long_audio_saved % 5 == 0 and size == "long":
-                    await self.summarize(transcription, ws)     # Send transcription to AI summarization
-
-
-    # Save the long transcription for the client
-    async def save_long_transcription(self, transcription, websocket):
-        # Use the id() of the websocket as a unique identifier for the client
-        client_id = id(websocket)
-        if client_id not in self.long_transcriptions:
-            self.long_transcriptions[client_id] = []
-        self.long_transcriptions[client_id].append(transcription)
-
-    # Method to get long transcriptions for a specific client
-    def get_long_transcriptions_for_client(self, websocket):
-        client_id = id(websocket)
-        return self.long_transcriptions.get(client_id, [])
+            RECORDINGS_DIR, filename), 'audio_size': size, 'speech_only': True}
+
+        # Send audio to the transcription server, waiting for a free in-flight slot
+        async with admission:
+            transcription_data = await request_transcription(payload, audio_data)
+        if transcription_data is None:
+            return
+
+        # Extract transcription from response
+        transcription = transcription_data.get('transcription', '')
+        if size == 'short':
+            # Long requests re-transcribe audio already counted as short segments
+            level = self.vad_tuner.record_result(len(audio_data) / (SAMPLE_RATE * BYTES_PER_SAMPLE),
+                                                 not transcription.strip())
+            if level is not None:
+                logger.info("VAD tuned to level %s", level,
+                            extra={"category": "vad", "session_id": self.session_id, **self.vad_tuner.snapshot()})
+
+        # If transcription is empty, no speech was detected
+        if not transcription:
+            logger.debug("Audio contains no speech", extra={"category": "transcription"})
+            return
+
+        # Store the transcription in the session history, then send it back to the client
+        entry = self.save_transcription(transcription, size)
+        message = {"transcript": transcription, "audio_size": size, "seq": entry["seq"], "segment": segment,
+                   "session_id": self.session_id}
+        # Serialized once for this socket and the session's subscribers
+        await ws.send(hub.publish(self.session_id, message))
+        logger.info("Transcription: %s", transcription,
+                    extra={"category": "transcription", "session_id": self.session_id, "audio_size": size})
+
+        # After sending the transcript, calculate and print processing time
+        self.print_processing_time()
+
+        # Initial summarize functionality, shed under backlog
+        if self.long_audio_saved % 5 == 0 and size == "long":
+            self.start_summary(transcription, ws)     # Send transcription to AI summarization
+
+        return transcription
+
+
+    # Save a transcription to this session's history
+    def save_transcription(self, transcription, size):
+        return transcript_store.append(self.session_id, transcription, size)
+
+    # Recent long transcriptions of this session
+    def get_long_transcriptions(self):
+        return transcript_store.recent_text(self.session_id, 'long')
+
+    # Send a page of session history, e.g. {"history": {"after": 41, "limit": 50}} or {"history": {"before": 10}}.
+    # Another session's history needs its resume token: {"history": {"session_id": ..., "token": ...}}
+    async def send_history(self, websocket, request):
+        request = request if isinstance(request, dict) else {}
+        session_id = str(request.get('session_id', self.session_id))
+        if session_id != self.session_id and not await asyncio.to_thread(
+                transcript_store.check_token, session_id, request.get('token')):
+            await websocket.send(json.dumps({"error": "Invalid resume token", "session_id": session_id}))
+            return
+        entries, cursor = await asyncio.to_thread(
+            transcript_store.history, session_id, request.get('after'), request.get('before'),
+            int(request.get('limit', 50)))
+        await websocket.send(json.dumps({"history": entries, "next": cursor, "session_id": session_id}))
     
-    async def summarize(self, request, ws):
-        instructions = "Summarize the transcription below into succinct bullet points, only respond with the bullet points: "
-        # Format request for OpenAI API
-        formattedRequest = [
-        {
-            "role": "system",
-            "content": "You are to summarize concisely but thoroughly the transcribed audio."
-        },
-        {
-            "role": "user",
-            "content": f'{instructions} {request}'
-        }]
-
-        print(f"Sending request to openai module: {formattedRequest}")
-        try:
-            response = await asyncio.wait_for(generate_response(formattedRequest), timeout=30)  # Set an appropriate timeout value
-            content = response.choices[0].message.content
-            message = {
-                "summary": content
-            }
-            print(f"Summary received: {content}")
-            print("Sending to client")
-            await ws.send(json.dumps(message))
-        except asyncio.TimeoutError:
-            print("OpenAI API request timed out")
-            # Handle the timeout error gracefully, e.g., by sending an error message back to the client or taking other appropriate actions
-        except Exception as error:
-            print(f"Error: {error}")
-
-# Check if an IP address is within the allowed Cloudflare range
-async def is_cloudflare_ip(ip):
-    return any(ipaddress.ip_address(ip) in network for network in allowed_networks)
-
+    # Summarize in the background, shed under backlog. Requests made while a summary is in progress
+    # coalesce into one; a local summary of the session stands in if the remote model is slow or failing.
+    def start_summary(self, request, ws):
+        if admission.should_shed('summary'):
+            logger.debug("Summary shed under backlog", extra={"category": "summary", "session_id": self.session_id})
+            return
+        session_id = self.session_id
+
+        async def send(message):
+            try:
+                await ws.send(hub.publish(session_id, {**message, "session_id": session_id}))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        self.summaries.request(request, transcript_store.recent_text(session_id), send, session_id)
+
+    # Drop a summary still waiting on the remote model once the client has gone
+    def close(self):
+        self.summaries.close()
+
+# Done-callback for sends nobody awaits: a socket that closed meanwhile is expected, anything else is logged
+def log_send_error(task):
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None and not isinstance(error, websockets.exceptions.ConnectionClosed):
+        logger.warning("Send failed: %r", error, extra={"category": "connection"})
 
 async def websocket_server(websocket, path):
-    # Initialize the handler for this connection
-    handler = ConnectionHandler()
-    connected_clients.add(websocket)
-
     # Get the IP address of the client
     client_ip = websocket.remote_address[0]
-    # Only allow connections from IPs within the Cloudflare range
-    if not await is_cloudflare_ip(client_ip):
-        print(f"Rejected connection from {client_ip}")
+    # Only allow connections from IPs within the Cloudflare range, within the connection rate limits.
+    # Checked before anything is allocated for the connection.
+    admitted, reason = connection_admission.admit(client_ip, forwarded_client_ip(websocket))
+    if not admitted:
+        logger.info("Rejected connection from %s: %s", client_ip, reason, extra={"category": "connection"})
+        if reason == "not_allowed":
+            await websocket.close(1008, "Forbidden")
+        else:
+            await websocket.close(1013, "Too many connections, try again later")
+        return
+
+    # Cap the number of connections this node accepts
+    if not admission.try_connect():
+        logger.warning("Connection cap reached, rejecting connection", extra={"category": "connection"})
+        await websocket.close(1013, "Server overloaded")
         return
 
-    await websocket.send("Connected to WebSocket server")
-    print(f"{client_ip} has connected")
+    # Initialize the handler for this connection
+    handler = ConnectionHandler()
+    capture = open_capture(handler.session_id)  # Records the session for replay.py when CAPTURE_DIR is set
+
+    # Notify the client whenever the node enters or leaves degraded mode
+    def notify_status(controller):
+        asyncio.ensure_future(websocket.send(controller.status_message())).add_done_callback(log_send_error)
+    admission.add_listener(notify_status)
 
     try:
+        await websocket.send("Connected to WebSocket server")
+        handler.resume_token = await asyncio.to_thread(transcript_store.create_session, handler.session_id)
+        await websocket.send(json.dumps({"session_id": handler.session_id, "resume_token": handler.resume_token,
+                                         "viewer_token": viewer_token(handler.resume_token)}))
+        logger.info("%s has connected", client_ip, extra={"category": "connection", "session_id": handler.session_id})
+        if admission.degraded:
+            await websocket.send(admission.status_message())
+
         async for message in websocket:
+            if capture:
+                capture.record(message)
             # Handle message using the connection handler's state
             await handler.process_message(websocket, message)
     except websockets.exceptions.ConnectionClosed as e:
         # Handle connection closed events
-        print("WebSocket connection closed", e)
+        logger.info("WebSocket connection closed: %s", e, extra={"category": "connection"})
     finally:
-        # Remove the client from the connected set on disconnection
-        print(f"{client_ip} has disconnected")
-        connected_clients.remove(websocket)
+        logger.info("%s has disconnected", client_ip,
+                    extra={"category": "connection", "session_id": handler.session_id,
+                           "vad": handler.vad_tuner.snapshot()})
+        hub.unsubscribe_all(websocket)
+        handler.close()
+        admission.remove_listener(notify_status)
+        admission.disconnect()
+        if capture:
+            capture.close()
+
+# Log admission state and VAD totals (empty decodes, GPU seconds saved by tuning) periodically
+async def log_stats():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        logger.info("Node stats", extra={"category": "stats", "admission": admission.snapshot(),
+                                         "vad": totals_snapshot()})
 
 async def start_websocket_server():
-    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    ssl_context.load_cert_chain("cloudflare-cert.pem", "cloudflare-key.pem")
+    ssl_context = create_ssl_context()
+    LoopLagMonitor().start()  # Logs where the event loop blocks
+    asyncio.ensure_future(log_stats())
     async with websockets.serve(websocket_server, '0.0.0.0', WSS_PORT, ssl=ssl_context):
         await asyncio.Future()  # Run forever
 
 
 if __name__ == '__main__':
+    setup_logging()
+    install_profiler_signal()
     loop = asyncio.get_event_loop()
+    LoopLagMonitor(loop).start()  # Logs where the event loop blocks
+    loop.create_task(log_stats())
     # Start the server and await the server to start properly
-    start_server = websockets.serve(websocket_server, '0.0.0.0', WSS_PORT, ssl=ssl_context)
-    print(f"Server is running on port {WSS_PORT}")
+    start_server = websockets.serve(websocket_server, '0.0.0.0', WSS_PORT, ssl=create_ssl_context())
+    logger.info("Server is running on port %s", WSS_PORT)
     server = loop.run_until_complete(start_server)
 
     try:
         # Run the event loop forever until interrupted
         loop.run_forever()
     except KeyboardInterrupt:
-        print("Server is shutting down.")
+        logger.info("Server is shutting down")
     finally:
         # Stop server and wait until it is closed
         server.close()
@@ -325,4 +492,4 @@ if __name__ == '__main__':
 
         # Finally close the event loop
         loop.close()
-        print("Server has shutdown successfully")
+        logger.info("Server has shutdown successfully")
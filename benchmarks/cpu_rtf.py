@@ -0,0 +1,71 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from model_registry import ModelRegistry, backend_settings, load_faster_whisper, warm_up_faster_whisper
+
+# Real-time factor and throughput of CPU int8 inference, for sizing CPU transcription pools
+#   python -m benchmarks.cpu_rtf --audio recordings/combinedaudio_*.wav --replicas 1 2 4
+SAMPLE_RATE = 16000
+
+
+def load_clips(patterns, limit):
+    from faster_whisper.audio import decode_audio
+    paths = sorted(p for pattern in patterns for p in glob.glob(pattern))[:limit]
+    if not paths:
+        raise SystemExit("No audio files matched, pass --audio with recordings to benchmark on")
+    return [decode_audio(path, sampling_rate=SAMPLE_RATE) for path in paths]
+
+
+def decode(model, clip):
+    segments, info = model.transcribe(clip, beam_size=1, vad_filter=False)
+    return "".join(segment.text for segment in segments)
+
+
+def benchmark(model_size, clips, replicas, threads, requests):
+    registry = ModelRegistry(loader=load_faster_whisper, warm_up=warm_up_faster_whisper)
+    # The options the CPU backend loads with, one decode worker per replica included
+    device, compute_type, _, options = backend_settings("cpu")
+    pool = registry.get_pool(model_size, device, compute_type, replicas, **dict(options, cpu_threads=threads))
+    audio_seconds = sum(len(clip) for clip in clips) / SAMPLE_RATE
+
+    # Single-stream real-time factor: decode time / audio duration on one replica
+    with pool.acquire() as model:
+        start_time = time.time()
+        for clip in clips:
+            decode(model, clip)
+        rtf = (time.time() - start_time) / audio_seconds
+
+    # Throughput: all replicas decoding concurrently
+    def run(clip):
+        with pool.acquire() as model:
+            decode(model, clip)
+    work = [clips[i % len(clips)] for i in range(requests)]
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=replicas) as executor:
+        list(executor.map(run, work))
+    elapsed = time.time() - start_time
+    work_seconds = sum(len(clip) for clip in work) / SAMPLE_RATE
+    return rtf, work_seconds / elapsed, len(work) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark CPU int8 Whisper inference")
+    parser.add_argument("--audio", nargs="+", default=["recordings/*.wav"])
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small"])
+    parser.add_argument("--replicas", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--threads", type=int, default=0, help="Threads per replica, default cpu_count / replicas")
+    parser.add_argument("--clips", type=int, default=8, help="Number of audio files to use")
+    parser.add_argument("--requests", type=int, default=16, help="Requests for the throughput run")
+    args = parser.parse_args()
+
+    clips = load_clips(args.audio, args.clips)
+    print(f"{os.cpu_count()} CPUs, {len(clips)} clips, {sum(len(c) for c in clips) / SAMPLE_RATE:.1f}s of audio")
+    print(f"{'model':<8}{'replicas':>9}{'threads':>8}{'RTF':>8}{'audio s/s':>11}{'req/s':>8}")
+    for model_size in args.models:
+        for replicas in args.replicas:
+            threads = args.threads or max(1, (os.cpu_count() or 1) // replicas)
+            rtf, audio_per_sec, requests_per_sec = benchmark(model_size, clips, replicas, threads, args.requests)
+            print(f"{model_size:<8}{replicas:>9}{threads:>8}{rtf:>8.3f}{audio_per_sec:>11.2f}{requests_per_sec:>8.2f}")
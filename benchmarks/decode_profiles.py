@@ -0,0 +1,51 @@
+import argparse
+import glob
+import time
+
+from decode_profiles import DECODE_PROFILES, resolve_profile
+from model_registry import ModelRegistry
+
+# Compute spent per decode profile, relative to the archival profile
+#   python -m benchmarks.decode_profiles --audio "recordings/audio_*.wav" --device cuda
+SAMPLE_RATE = 16000
+
+
+def run(model, clips, options):
+    start_time = time.time()
+    for clip in clips:
+        segments, info = model.transcribe(clip, **options)
+        list(segments)  # Consume the lazy generator so the decode actually runs
+    return time.time() - start_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark decode profiles on recorded speech segments")
+    parser.add_argument("--audio", nargs="+", default=["recordings/audio_*.wav"])
+    parser.add_argument("--model", default="large-v3")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--clips", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+
+    from faster_whisper.audio import decode_audio
+    paths = sorted(p for pattern in args.audio for p in glob.glob(pattern))[:args.clips]
+    if not paths:
+        raise SystemExit("No audio files matched, pass --audio with recorded segments")
+    clips = [decode_audio(path, sampling_rate=SAMPLE_RATE) for path in paths]
+    audio_seconds = sum(len(clip) for clip in clips) / SAMPLE_RATE
+
+    model = ModelRegistry().get(args.model, args.device, "int8")
+    cases = [(name, {'profile': name}) for name in DECODE_PROFILES]
+    cases += [(f"{name}+speech_only", {'profile': name, 'speech_only': True}) for name in DECODE_PROFILES
+              if resolve_profile({'profile': name})[1]['vad_filter']]
+
+    results = {}
+    for label, payload in cases:
+        _, options = resolve_profile(payload)
+        results[label] = min(run(model, clips, options) for _ in range(args.repeats))
+
+    baseline = results["archival"]
+    print(f"{len(clips)} clips, {audio_seconds:.1f}s of audio, {args.model} on {args.device}")
+    print(f"{'profile':<24}{'secs':>8}{'RTF':>8}{'saved':>8}")
+    for label, elapsed in results.items():
+        print(f"{label:<24}{elapsed:>8.2f}{elapsed / audio_seconds:>8.3f}{1 - elapsed / baseline:>8.0%}")
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+from session_hub import SessionHub, SUBSCRIBER_QUEUE
+
+# Transcript fan-out to many subscribers per session: how long the speaker's handler is held up
+# per message and how quickly subscribers receive it, through the SessionHub and with a direct
+# send to every subscriber (serialized per subscriber and awaited, the obvious alternative).
+# A share of the subscribers are slow consumers.
+#   python -m benchmarks.fanout --sessions 4 --subscribers 500 --slow 0.05
+PERCENTILES = (50, 95, 99)
+SAMPLE_TEXT = "and the release is blocked on the login bug that some users on older phones still hit"
+
+
+class FakeWebSocket:
+    def __init__(self, delay):
+        self.delay = delay  # Seconds each send takes to drain
+        self.received = {}  # seq -> receive time
+
+    async def send(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        self.received[json.loads(message)["seq"]] = time.monotonic()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)] if values else float('nan')
+
+
+def make_subscribers(count, slow_share, slow_delay, rng):
+    return [FakeWebSocket(slow_delay if rng.random() < slow_share else 0) for _ in range(count)]
+
+
+# Publish messages from each session's speaker, returning the speaker's stall per message and the
+# send time of each (session, seq)
+async def speak(session_id, messages, interval, deliver):
+    stalls = []
+    sent = {}
+    for seq in range(messages):
+        message = {"transcript": SAMPLE_TEXT, "audio_size": "short", "seq": seq, "session_id": session_id}
+        start = time.monotonic()
+        sent[seq] = start
+        await deliver(session_id, message)
+        stalls.append(time.monotonic() - start)
+        await asyncio.sleep(max(0, interval - (time.monotonic() - start)))
+    return stalls, sent
+
+
+async def run(mode, args):
+    rng = random.Random(0)
+    sessions = {f"session-{i}": make_subscribers(args.subscribers, args.slow, args.slow_delay, rng)
+                for i in range(args.sessions)}
+    hub = SessionHub(queue_size=args.queue, max_subscribers=args.subscribers)
+    serialized = 0
+
+    if mode == "hub":
+        for session_id, subscribers in sessions.items():
+            for ws in subscribers:
+                hub.subscribe(session_id, ws)
+
+        async def deliver(session_id, message):
+            nonlocal serialized
+            hub.publish(session_id, message)
+            serialized += 1
+    else:
+        async def deliver(session_id, message):
+            nonlocal serialized
+            serialized += len(sessions[session_id])
+            await asyncio.gather(*(ws.send(json.dumps(message)) for ws in sessions[session_id]))
+
+    messages = args.messages if mode == "hub" else args.direct_messages
+    results = await asyncio.gather(*(speak(s, messages, args.interval, deliver) for s in sessions))
+    await asyncio.sleep(args.drain)
+    dropped = hub.dropped()
+    for session_id in sessions:
+        for ws in sessions[session_id]:
+            hub.unsubscribe(session_id, ws)
+
+    stalls = [stall for session_stalls, _ in results for stall in session_stalls]
+    latency = []
+    for (_, sent), subscribers in zip(results, sessions.values()):
+        for ws in subscribers:
+            if not ws.delay:
+                latency.extend(ws.received[seq] - sent[seq] for seq in ws.received)
+    return {
+        "messages": messages * len(sessions),
+        "stall": stalls,
+        "latency": latency,
+        "serialized": serialized,
+        "dropped": dropped,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark transcript fan-out to session subscribers")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--subscribers", type=int, default=500, help="Subscribers per session")
+    parser.add_argument("--slow", type=float, default=0.05, help="Share of slow subscribers")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="Seconds a slow subscriber takes per message")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per session through the hub")
+    parser.add_argument("--direct-messages", type=int, default=20, help="Messages per session sent directly")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between a session's messages")
+    parser.add_argument("--queue", type=int, default=SUBSCRIBER_QUEUE, help="Messages buffered per subscriber")
+    parser.add_argument("--drain", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions x {args.subscribers} subscribers, {args.slow:.0%} slow at {args.slow_delay}s a message")
+    print(f"{'mode':<8}{'msgs':>7}" + "".join(f"{f'stall p{p}':>12}" for p in PERCENTILES)
+          + "".join(f"{f'fast p{p}':>11}" for p in PERCENTILES) + f"{'json':>9}{'dropped':>9}")
+    for mode in ("direct", "hub"):
+        result = asyncio.run(run(mode, args))
+        print(f"{mode:<8}{result['messages']:>7}"
+              + "".join(f"{percentile(result['stall'], p) * 1000:>10.2f}ms" for p in PERCENTILES)
+              + "".join(f"{percentile(result['latency'], p) * 1000:>9.2f}ms" for p in PERCENTILES)
+              + f"{result['serialized']:>9}{result['dropped']:>9}")
@@ -0,0 +1,79 @@
+import argparse
+import ipaddress
+import json
+import os
+import random
+import time
+
+from connection_admission import Allowlist
+
+# Allowlist lookups per second, bisect over compiled intervals vs the old linear network scan
+#   python -m benchmarks.ip_lookup --ranges cloudflare_ips.json
+# Cloudflare's published ranges, used when no ranges file is available
+DEFAULT_RANGES = [
+    "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22", "141.101.64.0/18",
+    "108.162.192.0/18", "190.93.240.0/20", "188.114.96.0/20", "197.234.240.0/22", "198.41.128.0/17",
+    "162.158.0.0/15", "104.16.0.0/13", "104.24.0.0/14", "172.64.0.0/13", "131.0.72.0/22",
+    "2400:cb00::/32", "2606:4700::/32", "2803:f800::/32", "2405:b500::/32", "2405:8100::/32",
+    "2a06:98c0::/29", "2c0f:f248::/32",
+]
+
+
+def linear_lookup(networks, ip):
+    return any(ipaddress.ip_address(ip) in network for network in networks)
+
+
+def sample_ips(ranges, count, hit_ratio):
+    networks = [ipaddress.ip_network(r) for r in ranges]
+    ips = []
+    for _ in range(count):
+        if random.random() < hit_ratio:
+            network = random.choice(networks)
+            ips.append(str(network[random.randrange(min(network.num_addresses, 1 << 32))]))
+        elif random.random() < 0.5:
+            ips.append(str(ipaddress.IPv4Address(random.getrandbits(32))))
+        else:
+            ips.append(str(ipaddress.IPv6Address(random.getrandbits(128))))
+    return ips
+
+
+def run(lookup, ips):
+    start_time = time.perf_counter()
+    hits = sum(1 for ip in ips if lookup(ip))
+    return time.perf_counter() - start_time, hits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark allowlist lookups per second")
+    parser.add_argument("--ranges", default="cloudflare_ips.json")
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--hit-ratio", type=float, default=0.9, help="Share of lookups from allowed ranges")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Repeat the range list this many times (shifted) to see how lookups scale")
+    args = parser.parse_args()
+
+    if os.path.exists(args.ranges):
+        with open(args.ranges, 'r') as json_file:
+            ranges = json.load(json_file)["cloudflare_ips"]
+    else:
+        ranges = DEFAULT_RANGES
+    base = [ipaddress.ip_network(r) for r in ranges]
+    # Extra copies shifted into unrelated address space, standing in for a larger allowlist
+    for i in range(1, args.scale):
+        ranges = ranges + [str(ipaddress.ip_network(
+            (int(n.network_address) ^ (i << (n.max_prefixlen - 8)), n.prefixlen))) for n in base]
+
+    random.seed(0)
+    ips = sample_ips(ranges, args.lookups, args.hit_ratio)
+    allowlist = Allowlist(ranges)
+    networks = [ipaddress.ip_network(r) for r in ranges]
+
+    indexed, indexed_hits = run(allowlist.contains, ips)
+    linear, linear_hits = run(lambda ip: linear_lookup(networks, ip), ips)
+    assert indexed_hits == linear_hits, "Indexed and linear lookups disagree"
+
+    print(f"{len(ranges)} ranges, {args.lookups} lookups, {indexed_hits / args.lookups:.0%} allowed")
+    print(f"{'method':<10}{'lookups/s':>14}{'us/lookup':>12}")
+    for label, elapsed in (("bisect", indexed), ("linear", linear)):
+        print(f"{label:<10}{args.lookups / elapsed:>14,.0f}{elapsed / args.lookups * 1e6:>12.2f}")
+    print(f"speedup {linear / indexed:.1f}x")
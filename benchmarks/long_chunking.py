@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from faster_whisper.audio import decode_audio
+
+from decode_profiles import DECODE_PROFILES
+from long_chunking import transcribe_chunked, join_text
+from model_registry import ModelRegistry
+from segment_validation import transcribe_validated, SAMPLE_RATE
+
+# Throughput of chunked long-file transcription against the serial single-call path
+#   python -m benchmarks.long_chunking recordings/meeting.wav --workers 1 2 4
+
+
+def report(label, audio_seconds, elapsed, serial_elapsed):
+    speedup = serial_elapsed / elapsed if serial_elapsed else 1.0
+    print(f"{label:<20}{elapsed:>9.1f}{audio_seconds / elapsed:>12.1f}{speedup:>9.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark chunked long-file transcription")
+    parser.add_argument("audio", help="A long recording, ideally several minutes")
+    parser.add_argument("--model", default="large-v3")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--profile", default="archival", choices=sorted(DECODE_PROFILES))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    args = parser.parse_args()
+
+    audio = decode_audio(args.audio, sampling_rate=SAMPLE_RATE)
+    audio_seconds = len(audio) / SAMPLE_RATE
+    model = ModelRegistry().get(args.model, args.device, "int8", num_workers=max(args.workers))
+    options = DECODE_PROFILES[args.profile]
+
+    print(f"{audio_seconds:.0f}s of audio, {args.model} on {args.device}, {args.profile} profile")
+    print(f"{'mode':<20}{'wall s':>9}{'audio s/s':>12}{'speedup':>10}")
+    start_time = time.time()
+    segments, _ = transcribe_validated(model, audio, options)
+    serial_elapsed = time.time() - start_time
+    serial_words = len(join_text(segments).split())
+    report("serial", audio_seconds, serial_elapsed, serial_elapsed)
+
+    for workers in args.workers:
+        start_time = time.time()
+        segments, stats = transcribe_chunked(model, audio, options, workers=workers)
+        elapsed = time.time() - start_time
+        report(f"chunked x{workers} ({stats['chunks']})", audio_seconds, elapsed, serial_elapsed)
+        print(f"{'':<20}words {len(join_text(segments).split())} vs serial {serial_words}")
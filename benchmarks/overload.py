@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import json
+import time
+
+import websocket_server
+from admission_control import AdmissionController
+from websocket_server import ConnectionHandler, MIN_SPEECH_LENGTH, AUDIO_DURATION
+
+# Synthetic overload for the admission controller.
+# Start the stub backend first (STUB_LATENCY=1.0 python stub_transcribe.py), then run
+#   python -m benchmarks.overload --speakers 40 --duration 30
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append((time.time(), message))
+
+
+async def speaker(handler, ws, duration, segment_bytes, pause):
+    end = time.time() + duration
+    while time.time() < end:
+        # Bypass VAD and feed a finished speech segment straight into the pipeline
+        handler.speech_segment_buffer.extend(bytes(segment_bytes))
+        started = time.time()
+        await handler.process_speech_segment(ws)
+        await asyncio.sleep(max(0, pause - (time.time() - started)))
+
+
+async def main(args):
+    admission = websocket_server.admission
+    segment_bytes = int(MIN_SPEECH_LENGTH * args.segment_seconds)
+    handlers = []
+    for _ in range(args.speakers):
+        ws = FakeWebSocket()
+        if admission.try_connect():
+            admission.add_listener(lambda controller, ws=ws: asyncio.ensure_future(ws.send(controller.status_message())))
+            handlers.append((ConnectionHandler(), ws))
+
+    started = time.time()
+    await asyncio.gather(*(speaker(h, ws, args.duration, segment_bytes, AUDIO_DURATION / args.speedup)
+                           for h, ws in handlers))
+    elapsed = time.time() - started
+
+    transcripts = sum(1 for _, ws in handlers for _, m in ws.messages if '"transcript"' in m)
+    notices = [json.loads(m)["status"] for _, ws in handlers for _, m in ws.messages if '"status"' in m]
+    print(f"Speakers admitted: {len(handlers)}/{args.speakers}")
+    print(f"Transcripts delivered: {transcripts} in {elapsed:.1f}s")
+    print(f"Status notices: {notices.count('degraded')} degraded, {notices.count('normal')} normal")
+    print(json.dumps(admission.snapshot(), indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drive the WebSocket pipeline against the stub backend")
+    parser.add_argument("--speakers", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds each speaker talks")
+    parser.add_argument("--segment-seconds", type=float, default=1.5)
+    parser.add_argument("--speedup", type=float, default=1.0, help="Send segments N times faster than real time")
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    args = parser.parse_args()
+    if args.max_in_flight:
+        # The handlers look the controller up on the module, so a replacement applies to all of them
+        websocket_server.admission = AdmissionController(max_in_flight=args.max_in_flight)
+    asyncio.run(main(args))
@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import math
+import time
+from collections import Counter
+
+from summarizer import REMOTE_TIMEOUT, SUMMARY_DEADLINE, SummaryEngine, extractive_summary
+
+# Time until the client sees a summary, with and without the local fallback, against a slow or
+# failing model. Start the fake model first, then point the OpenAI client at it:
+#   FAKE_OPENAI_LATENCY=8 FAKE_OPENAI_FAIL_RATE=0.2 python fake_openai.py
+#   OPENAI_BASE_URL=http://localhost:8003/v1 OPENAI_API_KEY=fake python -m benchmarks.summary_deadline
+SAMPLE_TRANSCRIPT = (
+    "Okay, let's get started. The main thing today is the release of the mobile app next week. "
+    "The release is blocked on the login bug that some users on older phones still hit. "
+    "Sarah thinks the login bug comes from the token refresh on slow networks. "
+    "Yeah. We should add a retry to the token refresh before the release. "
+    "Marketing wants the release notes by Friday so they can plan the announcement. "
+    "Um, I had lunch late so sorry about that. "
+    "The backend team will load test the new sync service on Thursday. "
+    "If the load test fails, the release moves to the week after. "
+    "Right. Any questions about the release plan?"
+)
+PERCENTILES = (50, 95)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)] if values else float('nan')
+
+
+# Seconds to each request's first summary, and the source of each final summary. remote_only
+# counts only what the client would have seen without the local fallback.
+async def run(engine, text, requests, remote_only):
+    first = []
+    sources = Counter()
+
+    async def one():
+        start = time.monotonic()
+        seen = []
+
+        async def send(message):
+            if remote_only and message["source"] != "remote":
+                return
+            if not seen:
+                first.append(time.monotonic() - start)
+            seen.append(message)
+
+        source = await engine.summarize(text, [text], send)
+        if seen:
+            sources[source] += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return first, sources
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the summary deadline and local fallback")
+    parser.add_argument("--requests", type=int, default=20, help="Concurrent summary requests")
+    parser.add_argument("--deadline", type=float, default=SUMMARY_DEADLINE)
+    parser.add_argument("--transcript", help="Text file to summarize instead of the built-in sample")
+    args = parser.parse_args()
+
+    text = SAMPLE_TRANSCRIPT
+    if args.transcript:
+        with open(args.transcript) as f:
+            text = f.read()
+    print("Local summary:")
+    print(extractive_summary(text))
+
+    start = time.perf_counter()
+    for _ in range(100):
+        extractive_summary(text, [text] * 10)
+    print(f"Local summary takes {(time.perf_counter() - start) * 10:.2f} ms\n")
+
+    print(f"{'mode':<12}{'p50 s':>8}{'p95 s':>8}{'summaries':>11}{'remote':>8}{'local':>7}")
+    for label, deadline, remote_only in (("remote only", REMOTE_TIMEOUT, True), ("deadline", args.deadline, False)):
+        first, sources = asyncio.run(run(SummaryEngine(deadline=deadline), text, args.requests, remote_only))
+        print(f"{label:<12}" + "".join(f"{percentile(first, p):>8.2f}" for p in PERCENTILES)
+              + f"{len(first):>11}{sources['remote']:>8}{sources['local']:>7}")
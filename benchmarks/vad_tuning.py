@@ -0,0 +1,114 @@
+import argparse
+import glob
+import os
+import tempfile
+import wave
+
+from session_capture import read_capture
+from vad_tuner import GPU_SECONDS_PER_AUDIO_SECOND, VadTuner
+from work_queue import Job, http_handler, local_handler
+
+# Decodes wasted on empty segments with a fixed VAD vs per-connection tuning, over noisy recordings
+# (session captures or 48 kHz mono wav files), and the words transcribed by each, to check tuning
+# doesn't cut real speech. Exits with 1 if tuning loses more than --max-word-loss of the words.
+#   python -m benchmarks.vad_tuning "captures/*.cap" --backend http://localhost:8001/transcribe
+# Segmentation mirrors ConnectionHandler in websocket_server.py
+SAMPLE_RATE = 48000
+BYTES_PER_SAMPLE = 2
+FRAME_DURATION_MS = 30
+FRAME_SIZE = SAMPLE_RATE * FRAME_DURATION_MS * BYTES_PER_SAMPLE // 1000
+MAX_SPEECH_LENGTH = SAMPLE_RATE * BYTES_PER_SAMPLE * 3
+MIN_SPEECH_LENGTH = SAMPLE_RATE * BYTES_PER_SAMPLE
+PHRASE_TIMEOUT_MS = 300
+
+
+def load_pcm(path):
+    if path.endswith(".cap"):
+        return b"".join(m for _, m in read_capture(path) if isinstance(m, bytes))
+    with wave.open(path, 'rb') as wf:
+        if (wf.getframerate(), wf.getnchannels(), wf.getsampwidth()) != (SAMPLE_RATE, 1, BYTES_PER_SAMPLE):
+            raise ValueError(f"{path} is not {SAMPLE_RATE} Hz mono 16-bit")
+        return wf.readframes(wf.getnframes())
+
+
+# Yield the segments ConnectionHandler would send for transcription
+def segments(pcm, tuner):
+    speech = bytearray()
+    combined = bytearray()
+    silence_ms = 0
+    for start in range(0, len(pcm) - FRAME_SIZE + 1, FRAME_SIZE):
+        frame = pcm[start:start + FRAME_SIZE]
+        if tuner.is_speech(frame):
+            speech.extend(frame)
+            silence_ms = 0
+            if len(speech) < MAX_SPEECH_LENGTH:
+                continue
+        elif not speech:
+            continue
+        else:
+            silence_ms += FRAME_DURATION_MS
+            if silence_ms < PHRASE_TIMEOUT_MS and len(speech) + len(combined) < MAX_SPEECH_LENGTH:
+                continue
+        combined.extend(speech)
+        speech = bytearray()
+        silence_ms = 0
+        if len(combined) >= MIN_SPEECH_LENGTH:
+            yield bytes(combined)
+            combined = bytearray()
+
+
+def run(pcm, transcribe, autotune, workdir):
+    tuner = VadTuner(SAMPLE_RATE, FRAME_DURATION_MS / 1000, autotune=autotune)
+    words = 0
+    for index, audio in enumerate(segments(pcm, tuner)):
+        path = os.path.join(workdir, f"segment_{index}.wav")
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(BYTES_PER_SAMPLE)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(audio)
+        payload = {'audio_file_path': path, 'audio_size': 'short', 'speech_only': True, 'sample_rate': SAMPLE_RATE}
+        text = transcribe(Job(index, payload, audio, 1)).get('transcription', '')
+        words += len(text.split())
+        tuner.record_result(len(audio) / (SAMPLE_RATE * BYTES_PER_SAMPLE), not text.strip())
+    return tuner.snapshot(), words
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark per-connection VAD tuning on noisy recordings")
+    parser.add_argument("recordings", nargs="+", help="Session captures (.cap) or wav files, globs allowed")
+    parser.add_argument("--backend", default="local",
+                        help="'local' to transcribe in this process, or a /transcribe URL")
+    parser.add_argument("--max-word-loss", type=float, default=0.05)
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in args.recordings for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("No recordings matched")
+    transcribe = local_handler() if args.backend == "local" else http_handler(args.backend)
+
+    totals = {autotune: {"decodes": 0, "empty_decodes": 0, "wasted_gpu_seconds": 0.0, "suppressed_seconds": 0.0,
+                         "words": 0} for autotune in (False, True)}
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in paths:
+            pcm = load_pcm(path)
+            for autotune in (False, True):
+                snapshot, words = run(pcm, transcribe, autotune, workdir)
+                for key in ("decodes", "empty_decodes", "wasted_gpu_seconds", "suppressed_seconds"):
+                    totals[autotune][key] += snapshot[key]
+                totals[autotune]["words"] += words
+                print(f"{os.path.basename(path):<40}{'tuned' if autotune else 'fixed':>7}{snapshot['decodes']:>9}"
+                      f"{snapshot['empty_decodes']:>7}{words:>7}  level {snapshot['level']}")
+
+    print(f"\n{'':<10}{'decodes':>9}{'empty':>7}{'wasted GPU s':>14}{'words':>8}")
+    for autotune, label in ((False, "fixed"), (True, "tuned")):
+        t = totals[autotune]
+        print(f"{label:<10}{t['decodes']:>9}{t['empty_decodes']:>7}{t['wasted_gpu_seconds']:>14.2f}{t['words']:>8}")
+    fixed, tuned = totals[False], totals[True]
+    print(f"GPU seconds saved by suppressing {tuned['suppressed_seconds']:.1f}s of audio: "
+          f"{tuned['suppressed_seconds'] * GPU_SECONDS_PER_AUDIO_SECOND:.2f} "
+          f"(at {GPU_SECONDS_PER_AUDIO_SECOND} GPU s per audio s)")
+    word_loss = 1 - tuned["words"] / fixed["words"] if fixed["words"] else 0.0
+    print(f"Empty decodes {fixed['empty_decodes']} -> {tuned['empty_decodes']}, words lost {word_loss:.1%}")
+    if word_loss > args.max_word_loss:
+        raise SystemExit(f"Tuning lost {word_loss:.1%} of the words, over the {args.max_word_loss:.0%} limit")
@@ -0,0 +1,271 @@
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import time
+import wave
+from collections import deque
+from math import gcd
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+
+from model_registry import s2t_registry, backend_settings
+from structured_logging import setup_logging
+
+# Offline re-transcription of saved recordings with the same model loading as transcribes2t.py
+#   python bulk_transcribe.py "recordings/*.wav" --output transcripts.jsonl
+#   python bulk_transcribe.py s3://bucket-soefr/ --output transcripts/ --format parquet
+SAMPLE_RATE = 16000  # Whisper input rate
+BATCH_SIZE = 24  # Same batch size transcribes2t.py uses
+PREFETCH_BATCHES = 2  # Batches decoded ahead of the model
+REPORT_EVERY = 10  # Log throughput every N batches
+
+logger = logging.getLogger(__name__)
+
+
+# Lazily yield input keys: local paths for a glob pattern, or object keys for s3://bucket/prefix
+def scan_inputs(source):
+    if source.startswith("s3://"):
+        import boto3
+        bucket, _, prefix = source[len("s3://"):].partition("/")
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].endswith('.wav'):
+                    yield f"s3://{bucket}/{item['Key']}"
+    else:
+        yield from glob.iglob(source, recursive=True)
+
+
+_s3_client = None
+
+
+def read_bytes(key):
+    global _s3_client
+    if key.startswith("s3://"):
+        if _s3_client is None:
+            import boto3
+            _s3_client = boto3.client('s3')  # One client per worker process
+        bucket, _, name = key[len("s3://"):].partition("/")
+        return _s3_client.get_object(Bucket=bucket, Key=name)['Body'].read()
+    with open(key, 'rb') as f:
+        return f.read()
+
+
+# Decode a 16-bit PCM wav into the mono 16 kHz float32 array the model expects. Runs in the pool.
+def decode_wav(key):
+    with wave.open(io.BytesIO(read_bytes(key)), 'rb') as wf:
+        channels, rate = wf.getnchannels(), wf.getframerate()
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{wf.getsampwidth() * 8}-bit audio, expected 16-bit PCM")
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    audio = pcm.reshape(-1, channels).mean(axis=1).astype(np.float32) / 32768.0
+    if rate != SAMPLE_RATE:
+        # Polyphase resampling low-passes before decimating, so speech above 8 kHz doesn't alias
+        from scipy.signal import resample_poly
+        step = gcd(rate, SAMPLE_RATE)
+        audio = resample_poly(audio, SAMPLE_RATE // step, rate // step).astype(np.float32)
+    return key, audio
+
+
+# Keys already transcribed by an earlier, interrupted run
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+# Keys already in the output. Results are written before they are checkpointed, so a run interrupted
+# in between leaves its last batch in the output but not the checkpoint; a resumed run skips them
+# instead of writing them twice. Drops a partly written last JSONL line or Parquet part.
+def recover_output(output, fmt):
+    if fmt == "jsonl":
+        if not os.path.exists(output):
+            return set()
+        keys = set()
+        size = os.path.getsize(output)
+        with open(output, 'rb+') as f:
+            offset = 0
+            for line in f:
+                key = None
+                if line.endswith(b"\n"):
+                    try:
+                        key = json.loads(line)["key"]
+                    except (ValueError, KeyError):
+                        pass
+                if key is not None:
+                    keys.add(key)
+                elif offset + len(line) == size:
+                    logger.warning("Dropping a partly written line at byte %s of %s", offset, output)
+                    f.truncate(offset)
+                else:
+                    logger.warning("Skipping an unreadable line at byte %s of %s", offset, output)
+                offset += len(line)
+        return keys
+    parts = sorted(Path(output).glob("part-*.parquet"))
+    if not parts:
+        return set()
+    import pyarrow.parquet as pq
+    try:
+        # Every earlier part was checkpointed before the next one was written
+        return set(pq.read_table(parts[-1], columns=["key"]).column("key").to_pylist())
+    except Exception as e:
+        logger.warning("Dropping partly written %s: %s", parts[-1], e)
+        parts[-1].unlink()
+        return set()
+
+
+class ResultWriter:
+    def __init__(self, output, fmt):
+        self.output = output
+        self.fmt = fmt
+        if fmt == "jsonl":
+            self.file = open(output, 'a')
+        else:
+            import pyarrow  # noqa: F401  Fail early if Parquet output isn't available
+            Path(output).mkdir(parents=True, exist_ok=True)
+            self.part = len(list(Path(output).glob("part-*.parquet")))
+
+    def write(self, rows):
+        if self.fmt == "jsonl":
+            for row in rows:
+                self.file.write(json.dumps(row) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # Parquet files can't be appended to, so each batch becomes its own part file
+            pq.write_table(pa.Table.from_pylist(rows), os.path.join(self.output, f"part-{self.part:06d}.parquet"))
+            self.part += 1
+
+    def close(self):
+        if self.fmt == "jsonl":
+            self.file.close()
+
+
+def transcribe_batch(model, batch, use_vad):
+    keys = [key for key, _ in batch]
+    audio = [audio for _, audio in batch]
+    transcribe = model.transcribe_with_vad if use_vad else model.transcribe
+    out = transcribe(audio,
+                     lang_codes=['en'] * len(audio),
+                     tasks=['transcribe'] * len(audio),
+                     initial_prompts=[None] * len(audio),
+                     batch_size=len(audio))
+    return [{
+        "key": key,
+        "duration": len(samples) / SAMPLE_RATE,
+        "transcription": " ".join(segment['text'].strip() for segment in segments),
+        "segments": [{"start": s.get('start_time'), "end": s.get('end_time'), "text": s['text']} for s in segments],
+    } for key, samples, segments in zip(keys, audio, out)]
+
+
+def run(args):
+    device, compute_type, _, model_options = backend_settings(args.device)
+    model = s2t_registry.get(args.model, device, compute_type, **model_options)
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    failures_path = args.failures or f"{args.output}.failures"
+    done = load_checkpoint(checkpoint_path)
+    unrecorded = recover_output(args.output, args.format) - done
+    done |= unrecorded
+    if done:
+        logger.info("Resuming, %s files already transcribed", len(done))
+    writer = ResultWriter(args.output, args.format)
+    checkpoint = open(checkpoint_path, 'a')
+    checkpoint.write("".join(key + "\n" for key in unrecorded))
+    failures = open(failures_path, 'a')
+
+    files = 0
+    failed = 0
+    audio_seconds = 0.0
+    batches = 0
+    start_time = time.time()
+
+    def report():
+        elapsed = time.time() - start_time
+        rtf = elapsed / audio_seconds if audio_seconds else 0
+        logger.info("%s files, %.2f files/s, RTF %.4f, %.1f audio s/s", files, files / elapsed, rtf,
+                    audio_seconds / elapsed,
+                    extra={"category": "progress", "files": files, "audio_seconds": round(audio_seconds, 1),
+                           "rtf": round(rtf, 5)})
+
+    def flush(batch):
+        nonlocal files, audio_seconds, batches
+        rows = transcribe_batch(model, batch, args.vad)
+        writer.write(rows)
+        # Checkpoint only after results are on disk, so an interrupted run redoes at most one batch
+        checkpoint.write("".join(row["key"] + "\n" for row in rows))
+        checkpoint.flush()
+        files += len(rows)
+        audio_seconds += sum(row["duration"] for row in rows)
+        batches += 1
+        if batches % REPORT_EVERY == 0:
+            report()
+
+    # Add a decoded file to the batch. A file that can't be read or decoded (corrupt, not 16-bit
+    # PCM, S3 error) is recorded in the failures file and checkpointed, so a resumed run moves past it.
+    def take(key, future):
+        nonlocal batch, failed
+        try:
+            batch.append(future.result())
+        except BrokenProcessPool:
+            raise  # The pool died, not the file
+        except Exception as e:
+            logger.warning("Skipping %s: %s", key, e, extra={"category": "progress"})
+            failures.write(json.dumps({"key": key, "error": f"{type(e).__name__}: {e}"}) + "\n")
+            failures.flush()
+            checkpoint.write(key + "\n")
+            checkpoint.flush()
+            failed += 1
+            return
+        if len(batch) == args.batch_size:
+            flush(batch)
+            batch = []
+
+    pending = deque()
+    batch = []
+    inputs = (key for key in scan_inputs(args.source) if key not in done)
+    with ProcessPoolExecutor(max_workers=args.decode_workers) as pool:
+        # Keep a bounded number of decodes in flight ahead of the model
+        for key in inputs:
+            pending.append((key, pool.submit(decode_wav, key)))
+            while len(pending) >= args.batch_size * PREFETCH_BATCHES:
+                take(*pending.popleft())
+        while pending:
+            take(*pending.popleft())
+        if batch:
+            flush(batch)
+
+    writer.close()
+    checkpoint.close()
+    failures.close()
+    if failed:
+        logger.warning("%s files could not be decoded, see %s", failed, failures_path)
+    if files:
+        report()
+    else:
+        logger.info("Nothing to transcribe")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk transcribe recordings with WhisperS2T")
+    parser.add_argument("source", help="Glob of wav files (recordings/*.wav) or s3://bucket/prefix")
+    parser.add_argument("--output", required=True, help="JSONL file, or directory for Parquet parts")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--checkpoint", help="Progress file, defaults to <output>.checkpoint")
+    parser.add_argument("--failures", help="Files that could not be decoded, defaults to <output>.failures")
+    parser.add_argument("--model", default=os.environ.get("TRANSCRIBE_MODEL", "medium.en"))
+    parser.add_argument("--device", default=os.environ.get("TRANSCRIBE_DEVICE", "cuda"))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--vad", action="store_true", help="Run VAD, needed for recordings over 30 s")
+    setup_logging()
+    run(parser.parse_args())
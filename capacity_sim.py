@@ -0,0 +1,371 @@
+import argparse
+import heapq
+import json
+import math
+import random
+from collections import defaultdict, deque
+
+from admission_control import AdmissionController, MAX_IN_FLIGHT
+
+# Discrete-event capacity simulator for the ingest -> ASR -> summarize pipeline. Models what
+# ConnectionHandler does for each speaker: VAD segmentation, short requests, the long
+# re-transcription every LONG_AUDIO_AMOUNT segments, and the summary every 5th long one.
+# Requests go through the real AdmissionController (shedding included) to a backend with a fixed
+# number of slots. Predicts latency percentiles and where the deployment saturates.
+#   python capacity_sim.py --speakers 10 20 40 80 --service-log transcribe.log
+#   python capacity_sim.py --speakers 40 --rtf 0.04 --overhead 0.08 --audio-duration 5
+# Defaults mirror websocket_server.py
+AUDIO_DURATION = 3  # Seconds of speech per short request
+LONG_AUDIO_AMOUNT = 5  # Short segments per long request
+SUMMARY_EVERY = 5  # Long requests per summary
+MIN_SPEECH_SECONDS = 1  # Shorter segments are held back and merged with the next
+PHRASE_TIMEOUT = 0.3  # Silence that ends a segment
+SUMMARY_TIMEOUT = 30
+SUMMARY_DEADLINE = 3.0  # Seconds before the local summary is sent in place of the remote one
+# Speaker behaviour: talk spurts separated by pauses, some shorter than the phrase timeout
+TALK_MEAN = 3.0  # Mean seconds of a talk spurt (lognormal)
+TALK_SIGMA = 0.8
+PAUSE_MEAN = 1.5  # Mean seconds of a pause between spurts (exponential)
+SHORT_GAP_RATIO = 0.4  # Share of pauses that are brief gaps within a phrase
+# Backend service time when no logs are given: overhead + rtf * audio seconds, with lognormal jitter
+OVERHEAD = 0.08
+RTF = 0.05
+JITTER = 0.3
+SUMMARY_SECONDS = 4.0  # Mean OpenAI summary latency (lognormal)
+BATCH_COST = 0.15  # Extra service time per additional request in a batch, relative to the longest
+SLO_SECONDS = 2.0  # p95 short latency above which a speaker count counts as saturated
+PERCENTILES = (50, 95, 99)
+
+
+# Minimal process-based event loop: a process is a generator yielding either a delay in seconds
+# or a function that takes a resume callback
+class Simulation:
+    def __init__(self):
+        self.now = 0.0
+        self.events = []
+        self.counter = 0
+
+    def schedule(self, delay, callback, *args):
+        self.counter += 1
+        heapq.heappush(self.events, (self.now + delay, self.counter, callback, args))
+
+    def process(self, generator):
+        self.step(generator, None)
+
+    def step(self, generator, value):
+        try:
+            command = generator.send(value)
+        except StopIteration:
+            return
+        if isinstance(command, (int, float)):
+            self.schedule(command, self.step, generator, None)
+        else:
+            command(lambda result=None: self.step(generator, result))
+
+    def run(self, until):
+        while self.events and self.events[0][0] <= until:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+        self.now = until
+
+
+class ServiceModel:
+    def __init__(self, overhead=OVERHEAD, rtf=RTF, jitter=JITTER, empirical=None):
+        self.overhead = overhead
+        self.rtf = rtf
+        self.jitter = jitter
+        self.empirical = empirical or {}  # audio_size -> observed compute seconds, when lengths are unknown
+
+    def sample(self, rng, audio_seconds, size):
+        observed = self.empirical.get(size)
+        if observed:
+            return rng.choice(observed)
+        noise = rng.lognormvariate(-self.jitter ** 2 / 2, self.jitter)  # Mean 1
+        return (self.overhead + self.rtf * audio_seconds) * noise
+
+    def describe(self):
+        if self.empirical:
+            return "empirical " + ", ".join(f"{size}: {len(v)} samples" for size, v in self.empirical.items())
+        return f"{self.overhead:.3f}s + {self.rtf:.4f} x audio, jitter {self.jitter:.2f}"
+
+
+# Fit service times from the backends' structured logs (transcription records with compute_secs).
+# With audio_secs present, fits overhead + rtf * audio by least squares and the jitter from the
+# residuals; otherwise resamples the observed times per audio size.
+def fit_service_model(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and record.get("compute_secs") is not None:
+                    records.append(record)
+    if not records:
+        raise SystemExit("No transcription records with compute_secs found in the service logs")
+
+    points = [(r["audio_secs"], r["compute_secs"]) for r in records if r.get("audio_secs")]
+    if len(points) >= 10:
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        rtf = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0.0
+        rtf = max(rtf, 0.0)
+        overhead = max(mean_y - rtf * mean_x, 0.0)
+        residuals = [math.log(y / (overhead + rtf * x)) for x, y in points if y > 0 and overhead + rtf * x > 0]
+        mean_r = sum(residuals) / len(residuals)
+        jitter = math.sqrt(sum((r - mean_r) ** 2 for r in residuals) / len(residuals))
+        return ServiceModel(overhead, rtf, jitter)
+
+    empirical = defaultdict(list)
+    for record in records:
+        empirical[record.get("audio_size", "short")].append(record["compute_secs"])
+    return ServiceModel(empirical=dict(empirical))
+
+
+# Transcription backend with a fixed number of slots (replicas x concurrent decodes). A free slot
+# takes up to batch_size waiting requests at once.
+class Backend:
+    def __init__(self, sim, rng, service, slots, batch_size=1, batch_cost=BATCH_COST):
+        self.sim = sim
+        self.rng = rng
+        self.service = service
+        self.free = slots
+        self.slots = slots
+        self.batch_size = batch_size
+        self.batch_cost = batch_cost
+        self.queue = deque()
+        self.busy_time = 0.0
+
+    def submit(self, audio_seconds, size):
+        def command(resume):
+            self.queue.append((audio_seconds, size, resume))
+            self.start()
+        return command
+
+    def start(self):
+        while self.free and self.queue:
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            longest = max(self.service.sample(self.rng, audio, size) for audio, size, _ in batch)
+            duration = longest * (1 + self.batch_cost * (len(batch) - 1))
+            self.free -= 1
+            self.busy_time += duration
+            self.sim.schedule(duration, self.finish, batch)
+
+    def finish(self, batch):
+        self.free += 1
+        for _, _, resume in batch:
+            resume()
+        self.start()
+
+
+# AdmissionController with its semaphore replaced by a simulated one
+class SimAdmission:
+    def __init__(self, max_in_flight):
+        self.controller = AdmissionController(max_in_flight=max_in_flight)
+        self.waiters = deque()
+        self.max_waiting = 0
+
+    def acquire(self, resume):
+        controller = self.controller
+        if controller.in_flight < controller.max_in_flight:
+            controller.in_flight += 1
+            controller.update()
+            resume()
+        else:
+            controller.waiting += 1
+            self.max_waiting = max(self.max_waiting, controller.waiting)
+            controller.update()
+            self.waiters.append(resume)
+
+    def release(self):
+        controller = self.controller
+        if self.waiters:
+            controller.waiting -= 1  # The slot passes straight to the next waiter
+            controller.update()
+            self.waiters.popleft()()
+        else:
+            controller.in_flight -= 1
+            controller.update()
+
+    def should_shed(self, feature):
+        return self.controller.should_shed(feature)
+
+
+# VAD segments of one speaker as (time the segment is cut, time its speech ended, speech seconds).
+# Speech is cut every audio_duration seconds and after PHRASE_TIMEOUT of silence; silent frames are
+# not part of the segment.
+def speaker_segments(rng, duration, audio_duration, talk_mean=TALK_MEAN, pause_mean=PAUSE_MEAN,
+                     short_gap_ratio=SHORT_GAP_RATIO):
+    segments = []
+    talk_mu = math.log(talk_mean) - TALK_SIGMA ** 2 / 2
+    t = rng.uniform(0, pause_mean)  # Speakers don't all start at once
+    speech = 0.0
+    while t < duration:
+        spurt = rng.lognormvariate(talk_mu, TALK_SIGMA)
+        while speech + spurt >= audio_duration:
+            used = audio_duration - speech
+            t += used
+            spurt -= used
+            segments.append((t, t, audio_duration))
+            speech = 0.0
+        t += spurt
+        speech += spurt
+        if rng.random() < short_gap_ratio:
+            t += rng.uniform(0, PHRASE_TIMEOUT)  # Too short to end the segment
+            continue
+        pause = rng.expovariate(1 / pause_mean) + PHRASE_TIMEOUT
+        if speech > 0:
+            segments.append((t + PHRASE_TIMEOUT, t, speech))
+            speech = 0.0
+        t += pause
+    return segments
+
+
+class Metrics:
+    def __init__(self, warmup):
+        self.warmup = warmup
+        self.latency = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.max_handler_lag = 0.0
+
+    def record(self, now, kind, latency=None):
+        if now < self.warmup:
+            return
+        self.counts[kind] += 1
+        if latency is not None:
+            self.latency[kind].append(latency)
+
+
+# One connection: segments are handled strictly in order, and every request is awaited before the
+# next audio is processed, as in ConnectionHandler. Summaries run alongside, their latency is the
+# time to the first summary the client sees (the local one once the remote misses its deadline).
+def speaker_process(sim, rng, config, segments, admission, backend, metrics):
+    max_secs = config.audio_duration
+    combined = 0.0
+    long_audio = 0.0
+    audio_saved = 0
+    long_saved = 0
+    for cut_time, speech_end, seconds in segments:
+        if cut_time > sim.now:
+            yield cut_time - sim.now
+        metrics.max_handler_lag = max(metrics.max_handler_lag, sim.now - cut_time)
+        combined += seconds
+        if combined < max_secs and admission.should_shed('merge_short'):
+            continue
+        if combined < MIN_SPEECH_SECONDS:
+            continue
+        long_audio += combined
+        short_audio, combined = combined, 0.0
+        audio_saved += 1
+
+        yield admission.acquire
+        yield backend.submit(short_audio, 'short')
+        admission.release()
+        metrics.record(sim.now, 'short', sim.now - speech_end)
+
+        if audio_saved % config.long_audio_amount == 0:
+            if admission.should_shed('long'):
+                metrics.record(sim.now, 'long_shed')
+                long_audio = 0.0
+                continue
+            long_saved += 1
+            yield admission.acquire
+            yield backend.submit(long_audio, 'long')
+            admission.release()
+            metrics.record(sim.now, 'long', sim.now - speech_end)
+            long_audio = 0.0
+            if long_saved % SUMMARY_EVERY == 0:
+                if admission.should_shed('summary'):
+                    metrics.record(sim.now, 'summary_shed')
+                else:
+                    mu = math.log(config.summary_seconds) - 0.5 ** 2 / 2
+                    wait = min(rng.lognormvariate(mu, 0.5), SUMMARY_TIMEOUT, SUMMARY_DEADLINE)
+                    metrics.record(sim.now + wait, 'summary', wait)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)] if values else float('nan')
+
+
+def simulate(speakers, config, service, seed=0):
+    rng = random.Random(seed)
+    sim = Simulation()
+    admission = SimAdmission(config.max_in_flight)
+    backend = Backend(sim, rng, service, config.backend_slots, config.batch_size)
+    metrics = Metrics(config.warmup)
+    for _ in range(speakers):
+        segments = speaker_segments(rng, config.duration, config.audio_duration, config.talk_mean, config.pause_mean)
+        sim.process(speaker_process(sim, rng, config, segments, admission, backend, metrics))
+    sim.run(config.duration)
+
+    measured = config.duration - config.warmup
+    result = {
+        "speakers": speakers,
+        "utilization": backend.busy_time / (config.backend_slots * config.duration),
+        "requests_per_sec": (metrics.counts['short'] + metrics.counts['long']) / measured,
+        "max_waiting": admission.max_waiting,
+        "max_handler_lag": metrics.max_handler_lag,
+        "shed": dict(admission.controller.stats["shed"]),
+        "counts": dict(metrics.counts),
+    }
+    for kind in ('short', 'long'):
+        for p in PERCENTILES:
+            result[f"{kind}_p{p}"] = percentile(metrics.latency[kind], p)
+    return result
+
+
+def saturated(result, slo):
+    return result["short_p95"] > slo or result["utilization"] >= 0.95 or result["shed"]["long"] > 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate pipeline latency and saturation for a deployment")
+    parser.add_argument("--speakers", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    parser.add_argument("--duration", type=float, default=900, help="Simulated seconds")
+    parser.add_argument("--warmup", type=float, default=60, help="Seconds excluded from the statistics")
+    parser.add_argument("--audio-duration", type=float, default=AUDIO_DURATION)
+    parser.add_argument("--long-audio-amount", type=int, default=LONG_AUDIO_AMOUNT)
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--backend-slots", type=int, default=2, help="Replicas x concurrent decodes per replica")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--talk-mean", type=float, default=TALK_MEAN)
+    parser.add_argument("--pause-mean", type=float, default=PAUSE_MEAN)
+    parser.add_argument("--summary-seconds", type=float, default=SUMMARY_SECONDS)
+    parser.add_argument("--service-log", nargs="*", help="JSON logs from the transcription backends to fit")
+    parser.add_argument("--rtf", type=float, default=RTF, help="Real-time factor, e.g. from benchmarks.cpu_rtf")
+    parser.add_argument("--overhead", type=float, default=OVERHEAD, help="Fixed seconds per request")
+    parser.add_argument("--jitter", type=float, default=JITTER)
+    parser.add_argument("--slo", type=float, default=SLO_SECONDS, help="p95 short latency target in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    args = parser.parse_args()
+
+    service = fit_service_model(args.service_log) if args.service_log else ServiceModel(args.overhead, args.rtf,
+                                                                                        args.jitter)
+    if not args.json:
+        print(f"Service time: {service.describe()}; {args.backend_slots} backend slots, batch {args.batch_size}, "
+              f"{args.audio_duration}s segments, long every {args.long_audio_amount}")
+        print(f"{'speakers':>9}{'util':>7}{'req/s':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'long p95':>10}"
+              f"{'lag':>8}{'shed':>7}")
+    saturation = None
+    for speakers in args.speakers:
+        result = simulate(speakers, args, service, args.seed)
+        if saturation is None and saturated(result, args.slo):
+            saturation = speakers
+        if args.json:
+            print(json.dumps({k: None if isinstance(v, float) and math.isnan(v) else v for k, v in result.items()}))
+            continue
+        print(f"{speakers:>9}{result['utilization']:>7.0%}{result['requests_per_sec']:>8.1f}"
+              f"{result['short_p50']:>8.2f}{result['short_p95']:>8.2f}{result['short_p99']:>8.2f}"
+              f"{result['long_p95']:>10.2f}{result['max_handler_lag']:>8.1f}{sum(result['shed'].values()):>7}")
+    if not args.json:
+        if saturation is None:
+            print(f"No saturation up to {max(args.speakers)} speakers (p95 short <= {args.slo}s)")
+        else:
+            print(f"Saturates at about {saturation} speakers (p95 short > {args.slo}s, 95% utilization "
+                  f"or long transcriptions shed)")
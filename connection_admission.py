@@ -0,0 +1,183 @@
+import ipaddress
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+# Connection admission: Cloudflare allowlist and connection-rate limits, checked before a
+# connection gets a handler or any buffers
+CLOUDFLARE_IPS_PATH = "cloudflare_ips.json"
+RELOAD_CHECK_SECONDS = 5  # How often the allowlist file is checked for changes
+PER_IP_RATE = 2.0  # New connections per second allowed from one source IP
+PER_IP_BURST = 10  # Connections a source IP may open at once before the rate applies
+GLOBAL_RATE = 200.0  # New connections per second across all sources
+GLOBAL_BURST = 400
+MAX_TRACKED_IPS = 100000  # Per-IP buckets kept, least recently seen are dropped first
+
+logger = logging.getLogger(__name__)
+
+
+# Sorted, merged integer intervals for one address family, looked up with bisect
+class IntervalIndex:
+    def __init__(self, networks):
+        intervals = sorted((int(n.network_address), int(n.broadcast_address)) for n in networks)
+        self.starts = []
+        self.ends = []
+        for start, end in intervals:
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)  # Merge overlapping or adjacent ranges
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, value):
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+
+# Parse an address to (version, integer), unwrapping IPv4-mapped IPv6. Returns None if invalid.
+def ip_to_int(ip):
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split('%', 1)[0]), 'big')
+    except OSError:
+        return None
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+class Allowlist:
+    def __init__(self, ranges):
+        networks = [ipaddress.ip_network(r, strict=False) for r in ranges]
+        self.indexes = {
+            4: IntervalIndex(n for n in networks if n.version == 4),
+            6: IntervalIndex(n for n in networks if n.version == 6),
+        }
+        self.size = len(networks)
+
+    def contains(self, ip):
+        parsed = ip_to_int(ip)
+        if parsed is None:
+            return False
+        version, value = parsed
+        return self.indexes[version].contains(value)
+
+
+# Allowlist backed by cloudflare_ips.json, reloaded when the file changes
+class ReloadingAllowlist:
+    def __init__(self, path=CLOUDFLARE_IPS_PATH, check_seconds=RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.mtime = None
+        self.next_check = 0.0
+        self.allowlist = Allowlist([])
+        self.lock = threading.Lock()
+        self.reload()
+        if self.allowlist.size == 0:
+            logger.warning("No allowed IP ranges loaded from %s, every connection will be rejected", self.path,
+                           extra={"category": "connection"})
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self.mtime and self.mtime is not None:
+            return False
+        try:
+            with open(self.path, 'r') as json_file:
+                ranges = json.load(json_file)["cloudflare_ips"]
+            allowlist = Allowlist(ranges)
+        except (OSError, ValueError, KeyError) as e:
+            # Keep serving with the last good list rather than locking everyone out, and don't
+            # retry until the file changes again
+            if mtime is not None or self.mtime is not None:
+                logger.error("Could not load %s, keeping the previous allowlist: %s", self.path, e,
+                             extra={"category": "connection"})
+            self.mtime = mtime
+            return False
+        with self.lock:
+            self.allowlist, self.mtime = allowlist, mtime
+        logger.info("Loaded %s allowed IP ranges from %s", allowlist.size, self.path, extra={"category": "connection"})
+        return True
+
+    def contains(self, ip):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.check_seconds
+            self.reload()
+        return self.allowlist.contains(ip)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ConnectionAdmission:
+    def __init__(self, allowlist=None, per_ip_rate=PER_IP_RATE, per_ip_burst=PER_IP_BURST,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, max_tracked_ips=MAX_TRACKED_IPS):
+        self.allowlist = allowlist if allowlist is not None else ReloadingAllowlist()
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = per_ip_burst
+        self.max_tracked_ips = max_tracked_ips
+        self.global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.ip_buckets = OrderedDict()
+        self.stats = {"admitted": 0, "not_allowed": 0, "ip_rate_limited": 0, "global_rate_limited": 0}
+
+    # Decide on a new connection. peer_ip must be in the allowlist; client_ip (the real client
+    # behind Cloudflare, if known) is what the per-IP limit applies to. Returns (admitted, reason).
+    def admit(self, peer_ip, client_ip=None):
+        if not self.allowlist.contains(peer_ip):
+            self.stats["not_allowed"] += 1
+            return False, "not_allowed"
+
+        now = time.monotonic()
+        source = client_ip or peer_ip
+        bucket = self.ip_buckets.pop(source, None) or TokenBucket(self.per_ip_rate, self.per_ip_burst, now)
+        self.ip_buckets[source] = bucket  # Most recently seen last
+        if len(self.ip_buckets) > self.max_tracked_ips:
+            self.ip_buckets.popitem(last=False)
+        if not bucket.take(now):
+            self.stats["ip_rate_limited"] += 1
+            return False, "ip_rate_limited"
+        if not self.global_bucket.take(now):
+            self.stats["global_rate_limited"] += 1
+            return False, "global_rate_limited"
+        self.stats["admitted"] += 1
+        return True, None
+
+
+# Real client address from Cloudflare's header, when the websockets version exposes request headers
+def forwarded_client_ip(websocket):
+    headers = getattr(websocket, 'request_headers', None)
+    if headers is None:
+        request = getattr(websocket, 'request', None)
+        headers = getattr(request, 'headers', None)
+    if headers is None:
+        return None
+    return headers.get('CF-Connecting-IP')
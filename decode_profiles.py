@@ -0,0 +1,22 @@
+# Named decode settings, picked per request with the 'profile' field of the /transcribe payload
+DECODE_PROFILES = {
+    # Low latency captions: greedy decode, no word alignment, trust the client's VAD segmentation
+    "interactive": {"beam_size": 1, "word_timestamps": False, "vad_filter": False, "temperature": 0},
+    # Full quality for stored transcripts: beam search with word timestamps
+    "archival": {"beam_size": 5, "word_timestamps": True, "vad_filter": True, "temperature": 0},
+}
+# Profile used when a request doesn't name one
+DEFAULT_PROFILES = {"short": "interactive", "long": "archival"}
+FALLBACK_PROFILE = "archival"
+
+
+# Resolve the decode options for a /transcribe payload, raises ValueError for an unknown profile
+def resolve_profile(payload):
+    name = payload.get('profile') or DEFAULT_PROFILES.get(payload.get('audio_size'), FALLBACK_PROFILE)
+    if name not in DECODE_PROFILES:
+        raise ValueError(f"Unknown decode profile '{name}', expected one of {sorted(DECODE_PROFILES)}")
+    options = dict(DECODE_PROFILES[name])
+    # Audio already segmented by the caller's VAD doesn't need a second VAD pass
+    if payload.get('speech_only'):
+        options['vad_filter'] = False
+    return name, options
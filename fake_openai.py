@@ -0,0 +1,43 @@
+from flask import Flask, request, jsonify
+import os
+import random
+import time
+import uuid
+
+# Stand-in for the OpenAI chat completions API with configurable latency and failures, used to
+# exercise the summary deadline and fallback. Point the client at it with
+#   OPENAI_BASE_URL=http://localhost:8003/v1 OPENAI_API_KEY=fake
+FAKE_OPENAI_LATENCY = float(os.environ.get("FAKE_OPENAI_LATENCY", "5"))  # Mean response time in seconds
+FAKE_OPENAI_JITTER = float(os.environ.get("FAKE_OPENAI_JITTER", "0.2"))  # Fraction of the latency added as random jitter
+FAKE_OPENAI_FAIL_RATE = float(os.environ.get("FAKE_OPENAI_FAIL_RATE", "0"))  # Share of requests answered with a 500
+FAKE_OPENAI_SUMMARY = os.environ.get("FAKE_OPENAI_SUMMARY", "- this is a remote summary")
+
+app = Flask(__name__)
+
+
+def service_time():
+    return FAKE_OPENAI_LATENCY * (1 + random.uniform(-FAKE_OPENAI_JITTER, FAKE_OPENAI_JITTER))
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.json
+    time.sleep(service_time())
+    if random.random() < FAKE_OPENAI_FAIL_RATE:
+        return jsonify({"error": {"message": "fake failure", "type": "server_error"}}), 500
+    return jsonify({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get('model', 'gpt-4'),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": FAKE_OPENAI_SUMMARY},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    })
+
+
+if __name__ == '__main__':
+    app.run(port=8003, threaded=True)
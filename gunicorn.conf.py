@@ -0,0 +1,25 @@
+import importlib
+
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
+from model_registry import MODEL_WORKERS, backend_settings
+
+# Gunicorn settings for the Flask transcription backends (picked up from the working directory).
+#   gunicorn --bind=0.0.0.0:8001 transcribes2t:app
+
+# One request thread per replica on CPU, or per concurrent decode on the single GPU model. The
+# default sync worker handles one request at a time and would leave the other replicas idle.
+device, _, replicas, _ = backend_settings()
+worker_class = "gthread"
+threads = replicas if device == "cpu" else MODEL_WORKERS
+
+
+# Workers load the app module but never run its __main__, so do its startup here: configure logging
+# (without it every INFO record, compute times included, is dropped), and start the model load,
+# otherwise it only begins with the first /transcribe and /ready stays 503 until a request arrives
+def post_worker_init(worker):
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 to a worker's pid, the master uses it for upgrades
+    module = importlib.import_module(worker.app.app_uri.split(":")[0])
+    if hasattr(module, "load_model"):
+        module.load_model()
@@ -0,0 +1,111 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from model_registry import MODEL_WORKERS
+from segment_validation import transcribe_validated, SAMPLE_RATE
+
+# Long-file mode: split at silences, decode chunks in parallel, stitch the results back together
+LONG_FILE_SECONDS = 60  # Files longer than this are chunked, shorter files decode in one call
+CHUNK_SECONDS = 30  # Target chunk length, matching Whisper's 30 s window
+SPLIT_SEARCH_SECONDS = 5  # How far either side of the target length to look for a silence
+CHUNK_OVERLAP_SECONDS = 0.5  # Audio shared by neighbouring chunks, so words at a split aren't cut
+ENERGY_FRAME_MS = 30  # Frame length for the energy profile used to find silences
+CHUNK_WORKERS = MODEL_WORKERS  # Chunks decoded at once, matching the concurrent decodes the model accepts
+
+
+# Per-frame RMS energy of the audio
+def frame_energy(audio, frame_ms=ENERGY_FRAME_MS):
+    frame = SAMPLE_RATE * frame_ms // 1000
+    frames = len(audio) // frame
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.sqrt(np.mean(audio[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+
+
+# Split points (in samples) at the quietest frame near every CHUNK_SECONDS boundary
+def find_split_points(audio, chunk_seconds=CHUNK_SECONDS, search_seconds=SPLIT_SEARCH_SECONDS):
+    frame = SAMPLE_RATE * ENERGY_FRAME_MS // 1000
+    energy = frame_energy(audio)
+    frames_per_second = 1000 / ENERGY_FRAME_MS
+    splits = []
+    position = 0
+    while len(audio) - position > (chunk_seconds + search_seconds) * SAMPLE_RATE:
+        target = position // frame + int(chunk_seconds * frames_per_second)
+        low = max(position // frame + 1, target - int(search_seconds * frames_per_second))
+        high = min(len(energy), target + int(search_seconds * frames_per_second))
+        quietest = low + int(np.argmin(energy[low:high]))
+        position = quietest * frame + frame // 2  # Split in the middle of the quietest frame
+        splits.append(position)
+    return splits
+
+
+# Chunks as (nominal start, nominal end, padded start, padded end) in samples.
+# The nominal ranges tile the audio, the padded ranges are what gets decoded.
+def make_chunks(audio, overlap_seconds=CHUNK_OVERLAP_SECONDS, **split_options):
+    bounds = [0] + find_split_points(audio, **split_options) + [len(audio)]
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    return [(start, end, max(0, start - overlap), min(len(audio), end + overlap))
+            for start, end in zip(bounds, bounds[1:])]
+
+
+# Keep only the part of a chunk's output that falls inside its nominal range, which removes the
+# duplicates decoded in the overlaps. Words are kept by their midpoint, or whole segments if
+# there are no word timestamps.
+def trim_to_range(segments, start, end):
+    trimmed = []
+    for segment in segments:
+        if segment.words:
+            words = [w for w in segment.words if start <= (w.start + w.end) / 2 < end]
+            if words:
+                trimmed.append(segment._replace(start=words[0].start, end=words[-1].end, words=words,
+                                                text="".join(w.word for w in words)))
+        elif start <= (segment.start + segment.end) / 2 < end:
+            trimmed.append(segment)
+    return trimmed
+
+
+def shift(segment, offset):
+    words = [w._replace(start=w.start + offset, end=w.end + offset) for w in segment.words]
+    return segment._replace(start=segment.start + offset, end=segment.end + offset, words=words)
+
+
+# Transcribe long audio chunk by chunk on a thread pool. on_progress(done, total, index, segments)
+# is called as each chunk finishes, in completion order. Returns stitched segments and stats.
+def transcribe_chunked(audio_model, audio, decode_options, workers=CHUNK_WORKERS, on_progress=None):
+    chunks = make_chunks(audio)
+    results = [None] * len(chunks)
+    retry_totals = {}
+
+    def decode_chunk(index):
+        start, end, padded_start, padded_end = chunks[index]
+        segments, retry_stats = transcribe_validated(audio_model, audio[padded_start:padded_end], decode_options)
+        offset = padded_start / SAMPLE_RATE
+        segments = [shift(segment, offset) for segment in segments]
+        return trim_to_range(segments, start / SAMPLE_RATE, end / SAMPLE_RATE), retry_stats
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(decode_chunk, index): index for index in range(len(chunks))}
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            results[index], retry_stats = future.result()
+            for key, value in retry_stats.items():
+                retry_totals[key] = retry_totals.get(key, 0) + value
+            if on_progress:
+                on_progress(done, len(chunks), index, results[index])
+
+    segments = [segment for chunk_segments in results for segment in chunk_segments]
+    stats = {
+        **retry_totals,
+        "chunks": len(chunks),
+        "audio_seconds": len(audio) / SAMPLE_RATE,  # Not the sum of the padded chunks
+        "wall_seconds": time.time() - start_time,
+    }
+    return segments, stats
+
+
+def join_text(segments):
+    return "".join(segment.text for segment in segments)
+
@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Models shared by every transcription endpoint in this process
+WARMUP_DECODES = int(os.environ.get("WARMUP_DECODES", "1"))  # Decodes of silence run before a model reports ready
+WARMUP_SECONDS = 1  # Length of the silent warm-up clip
+WARMUP_SAMPLE_RATE = 16000  # Whisper models expect 16 kHz audio
+
+# Inference backend selection, TRANSCRIBE_DEVICE=cpu runs int8 inference on GPU-less nodes
+TRANSCRIBE_DEVICE = os.environ.get("TRANSCRIBE_DEVICE", "cuda")
+CPU_REPLICAS = int(os.environ.get("CPU_REPLICAS", "2"))  # Model replicas serving requests in parallel
+CPU_THREADS = int(os.environ.get("CPU_THREADS", "0")) or max(1, (os.cpu_count() or 1) // CPU_REPLICAS)  # Intra-op threads per replica
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", "2"))  # Concurrent decodes one faster-whisper model accepts
+
+logger = logging.getLogger(__name__)
+
+
+# Device, compute type, replica count and loader options for the configured backend
+def backend_settings(device=TRANSCRIBE_DEVICE):
+    if device == "cpu":
+        return device, "int8", CPU_REPLICAS, {"cpu_threads": CPU_THREADS, "num_workers": 1}
+    return device, "int8", 1, {}
+
+
+def load_faster_whisper(model_size, device, compute_type, **kwargs):
+    from faster_whisper import WhisperModel
+    kwargs.setdefault("num_workers", MODEL_WORKERS)  # Lets threads decode in parallel on one loaded model
+    return WhisperModel(model_size, device=device, compute_type=compute_type, **kwargs)
+
+
+# Run a short decode on silence so CUDA kernels and JIT paths are initialised before real traffic
+def warm_up_faster_whisper(model, decodes=WARMUP_DECODES):
+    import numpy as np
+    silence = np.zeros(WARMUP_SAMPLE_RATE * WARMUP_SECONDS, dtype=np.float32)
+    for _ in range(decodes):
+        segments, info = model.transcribe(silence, beam_size=1, vad_filter=False)
+        list(segments)  # Segments are a lazy generator, consume them to actually decode
+
+
+def load_whisper_s2t(model_size, device, compute_type, **kwargs):
+    import whisper_s2t
+    return whisper_s2t.load_model(model_size, device=device, compute_type=compute_type, **kwargs)
+
+
+def warm_up_whisper_s2t(model, decodes=WARMUP_DECODES):
+    import numpy as np
+    silence = np.zeros(WARMUP_SAMPLE_RATE * WARMUP_SECONDS, dtype=np.float32)
+    for _ in range(decodes):
+        model.transcribe([silence], lang_codes=['en'], tasks=['transcribe'], initial_prompts=[None], batch_size=1)
+
+
+# A fixed set of identical models, each request borrows one so requests run in parallel across replicas
+class ReplicaPool:
+    def __init__(self, models):
+        self.models = list(models)
+        self.idle = queue.Queue()
+        for model in self.models:
+            self.idle.put(model)
+
+    def __len__(self):
+        return len(self.models)
+
+    # Borrow a replica, blocking until one is free. A lone replica is shared instead of leased, so
+    # concurrent requests reach it together and its own workers (MODEL_WORKERS) decode them in parallel.
+    @contextmanager
+    def acquire(self):
+        if len(self.models) == 1:
+            yield self.models[0]
+            return
+        model = self.idle.get()
+        try:
+            yield model
+        finally:
+            self.idle.put(model)
+
+
+class ModelRegistry:
+    def __init__(self, loader=load_faster_whisper, warm_up=warm_up_faster_whisper, warmup_decodes=WARMUP_DECODES):
+        self.loader = loader
+        self.warm_up = warm_up
+        self.warmup_decodes = warmup_decodes
+        self.models = {}  # (model, device, compute_type) or pool_key() -> loaded and warmed model or ReplicaPool
+        self.loading = {}  # (model, device, compute_type) -> Event set once loading has finished
+        self.errors = {}  # (model, device, compute_type) -> exception raised while loading
+        self.load_times = {}  # (model, device, compute_type) -> seconds spent loading and warming up
+        self.lock = threading.Lock()
+
+    # Get a model, loading it on first use. Concurrent callers wait for the same load.
+    def get(self, model_size, device="cuda", compute_type="int8", **kwargs):
+        key = (model_size, device, compute_type)
+        return self._get_or_load(key, lambda: self._load_model(model_size, device, compute_type, **kwargs))
+
+    # Get a pool of replicas of a model, loading them on first use
+    def get_pool(self, model_size, device="cuda", compute_type="int8", replicas=1, **kwargs):
+        key = pool_key(model_size, device, compute_type, replicas)
+        return self._get_or_load(key, lambda: ReplicaPool(
+            self._load_model(model_size, device, compute_type, **kwargs) for _ in range(replicas)))
+
+    def _get_or_load(self, key, factory):
+        with self.lock:
+            if key in self.models:
+                return self.models[key]
+            event = self.loading.get(key)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self.loading[key] = event
+                self.errors.pop(key, None)
+
+        if owner:
+            self._load(key, event, factory)
+        else:
+            event.wait()
+
+        with self.lock:
+            if key in self.errors:
+                raise self.errors[key]
+            return self.models[key]
+
+    def _load_model(self, model_size, device, compute_type, **kwargs):
+        logger.info("Loading %s on %s (%s)", model_size, device, compute_type, extra={"category": "model"})
+        model = self.loader(model_size, device, compute_type, **kwargs)
+        if self.warm_up and self.warmup_decodes > 0:
+            logger.info("Warming up %s with %s decode(s)", model_size, self.warmup_decodes, extra={"category": "model"})
+            self.warm_up(model, self.warmup_decodes)
+        return model
+
+    def _load(self, key, event, factory):
+        name = "/".join(key)
+        start_time = time.time()
+        try:
+            model = factory()
+            with self.lock:
+                self.models[key] = model
+                self.load_times[key] = time.time() - start_time
+            logger.info("%s loaded and ready in %.3g secs", name, self.load_times[key],
+                        extra={"category": "model", "load_secs": round(self.load_times[key], 3)})
+        except Exception as e:
+            logger.exception("Failed to load %s: %s", name, e, extra={"category": "model"})
+            with self.lock:
+                self.errors[key] = e
+                del self.loading[key]  # Allow a later call to retry the load
+        finally:
+            event.set()
+
+    # Start loading a model in a background thread, so the server can accept requests immediately
+    def load_in_background(self, model_size, device="cuda", compute_type="int8", replicas=None, **kwargs):
+        def load():
+            try:
+                if replicas is None:
+                    self.get(model_size, device, compute_type, **kwargs)
+                else:
+                    self.get_pool(model_size, device, compute_type, replicas, **kwargs)
+            except Exception:
+                pass  # Recorded in self.errors and reported by status()
+        thread = threading.Thread(target=load, name=f"load-{model_size}", daemon=True)
+        thread.start()
+        return thread
+
+    # Check a key from get() as (model, device, compute_type) or from get_pool() via pool_key()
+    def is_ready(self, *key):
+        with self.lock:
+            return tuple(key) in self.models
+
+    # Summary of every model the registry knows about, for readiness endpoints
+    def status(self):
+        with self.lock:
+            keys = set(self.models) | set(self.loading) | set(self.errors)
+            return {
+                "/".join(key): {
+                    "ready": key in self.models,
+                    "error": str(self.errors[key]) if key in self.errors else None,
+                    "load_time": self.load_times.get(key),
+                }
+                for key in sorted(keys)
+            }
+
+    # Body and status code for a /ready endpoint: 200 once the given model is loaded and warmed, 503 before
+    def ready_status(self, *key):
+        ready = self.is_ready(*key)
+        return {"ready": ready, "models": self.status()}, 200 if ready else 503
+
+    # Flask response for a /ready endpoint
+    def ready_response(self, *key):
+        from flask import jsonify
+        body, status = self.ready_status(*key)
+        return jsonify(body), status
+
+
+def pool_key(model_size, device, compute_type, replicas):
+    return (model_size, device, compute_type, f"x{replicas}")
+
+
+# Process-wide registries, shared by transcribe.py, transcribeshort.py and transcribelong.py
+registry = ModelRegistry()
+s2t_registry = ModelRegistry(loader=load_whisper_s2t, warm_up=warm_up_whisper_s2t)
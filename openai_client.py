@@ -1,11 +1,13 @@
 from dotenv import load_dotenv # type: ignore
 from openai import AsyncOpenAI # type: ignore
+import logging
 
 # Load the environment variables from the .env file
 load_dotenv()
 
 # Load the OpenAI API key from environment variables
 client = AsyncOpenAI()
+logger = logging.getLogger(__name__)
 
 async def generate_response(request):
     try:
@@ -15,4 +17,4 @@ async def generate_response(request):
         )
         return response
     except Exception as error:
-        print(f"Error: {error}")
+        logger.error("OpenAI request failed: %s", error, extra={"category": "summary"})
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import glob
+import json
+import math
+import ssl
+import sys
+import time
+from collections import Counter, defaultdict
+
+from session_capture import BINARY, read_capture
+from vad_tuner import VadTuner
+
+# Re-drive captured sessions (see session_capture.py) against a server and compare transcript
+# timing and message counts with a stored baseline. Exits with 1 on a regression.
+#   python replay.py "captures/*.cap" --url wss://localhost:8000 --insecure --speed 4 --save-baseline baseline.json
+#   python replay.py "captures/*.cap" --url wss://localhost:8000 --insecure --speed 4 --baseline baseline.json
+# The server only admits Cloudflare addresses, add 127.0.0.1/32 to its cloudflare_ips.json for a local run.
+PERCENTILES = (50, 90, 99)
+DRAIN_SECONDS = 15  # Seconds to wait for responses after a session's last message
+THRESHOLD = 0.2  # Allowed regression, as a fraction of the baseline value
+LATENCY_SLACK = 0.05  # Seconds of latency increase that never count as a regression
+COMPARED_COUNTS = ("transcript", "summary")  # Message kinds whose counts must match the baseline
+# Framing and segmentation, mirroring ConnectionHandler in websocket_server.py
+SAMPLE_RATE = 48000
+BYTES_PER_SAMPLE = 2
+FRAME_DURATION_MS = 30
+FRAME_SIZE = SAMPLE_RATE * FRAME_DURATION_MS * BYTES_PER_SAMPLE // 1000
+MAX_SPEECH_LENGTH = SAMPLE_RATE * BYTES_PER_SAMPLE * 3
+MIN_SPEECH_LENGTH = SAMPLE_RATE * BYTES_PER_SAMPLE
+PHRASE_TIMEOUT_MS = 300
+LONG_AUDIO_AMOUNT = 5
+
+
+# For each message, the segments the server cuts when it arrives, as the index of the message where
+# each segment's speech ended: the first frame of the phrase-timeout gap, or the frame where the
+# segment reached AUDIO_DURATION. Segments under a second are merged into the next, as on the server.
+# is_speech defaults to the server's VAD at its starting level; a server that tunes its VAD during
+# the session may cut differently, the segment numbers it echoes keep the matching right regardless.
+def segment_ends(messages, is_speech=None):
+    if is_speech is None:
+        is_speech = VadTuner(SAMPLE_RATE, FRAME_DURATION_MS / 1000, autotune=False).is_speech
+    cuts = [[] for _ in messages]
+    buffer = bytearray()
+    speech = combined = silence_ms = 0
+    gap_start = None
+    for index, message in enumerate(messages):
+        if isinstance(message, str):
+            continue
+        buffer.extend(message)
+        usable = len(buffer) - len(buffer) % FRAME_SIZE
+        for start in range(0, usable, FRAME_SIZE):
+            if is_speech(buffer[start:start + FRAME_SIZE]):
+                speech += FRAME_SIZE
+                silence_ms = 0
+                gap_start = None
+                if speech < MAX_SPEECH_LENGTH:
+                    continue
+                end = index
+            elif not speech:
+                continue
+            else:
+                if gap_start is None:
+                    gap_start = index
+                silence_ms += FRAME_DURATION_MS
+                if silence_ms < PHRASE_TIMEOUT_MS and speech + combined < MAX_SPEECH_LENGTH:
+                    continue
+                end = gap_start
+            combined += speech
+            speech = silence_ms = 0
+            gap_start = None
+            if combined >= MIN_SPEECH_LENGTH:
+                cuts[index].append(end)
+                combined = 0
+        del buffer[:usable]
+    return cuts
+
+
+# Load a capture as (offset, message, segment ends) records, segmenting audio before the timed replay
+def load_session(path, is_speech=None):
+    records = list(read_capture(path))
+    cuts = segment_ends([message for _, message in records], is_speech)
+    return [(offset, message, ends) for (offset, message), ends in zip(records, cuts)]
+
+
+def message_kind(message):
+    try:
+        body = json.loads(message)
+    except ValueError:
+        return "text"
+    if not isinstance(body, dict):
+        return "other"
+    if "transcript" in body:
+        return f"transcript_{body.get('audio_size', 'unknown')}"
+    for kind in ("summary", "status", "session_id", "history", "search_results"):
+        if kind in body:
+            return kind
+    return "other"
+
+
+# Transcripts are matched to segments by the segment number the server echoes with each one, so a
+# segment that transcribes empty (and sends nothing) doesn't shift the matches after it.
+class SessionReplay:
+    def __init__(self, records, speed):
+        self.records = records
+        self.speed = speed
+        self.counts = Counter()
+        self.latency = defaultdict(list)  # Seconds from the end of speech to each transcript, by kind
+        self.sent = []  # Send time of each message
+        self.segments = 0
+        # End of speech of each segment still waiting for its transcript, by transcript kind and segment number
+        self.pending = {"transcript_short": {}, "transcript_long": {}}
+
+    async def receive(self, ws):
+        async for message in ws:
+            kind = message_kind(message)
+            self.counts[kind] += 1
+            if kind in self.pending:
+                sent = self.pending[kind].pop(json.loads(message).get("segment"), None)
+                if sent is not None:
+                    self.latency[kind].append(time.monotonic() - sent)
+
+    def segments_cut(self, ends):
+        for index in ends:
+            self.segments += 1
+            self.pending["transcript_short"][self.segments] = self.sent[index]
+            # Every LONG_AUDIO_AMOUNT segments the server also re-transcribes them together
+            if self.segments % LONG_AUDIO_AMOUNT == 0:
+                self.pending["transcript_long"][self.segments] = self.sent[index]
+
+    async def run(self, url, ssl_context, drain=DRAIN_SECONDS):
+        import websockets
+        async with websockets.connect(url, ssl=ssl_context, max_size=None) as ws:
+            receiver = asyncio.ensure_future(self.receive(ws))
+            start = time.monotonic()
+            for offset, message, ends in self.records:
+                delay = start + offset / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await ws.send(message)
+                self.sent.append(time.monotonic())
+                self.segments_cut(ends)
+            await asyncio.sleep(drain)
+            receiver.cancel()
+        return self
+
+
+# Nearest-rank percentile of a sorted list
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def build_report(replays, failures, speed):
+    counts = Counter()
+    latency = defaultdict(list)
+    for replay in replays:
+        counts.update(replay.counts)
+        for kind, values in replay.latency.items():
+            latency[kind].extend(values)
+    return {
+        "sessions": len(replays),
+        "failed_sessions": failures,
+        "speed": speed,
+        "counts": dict(counts),
+        "latency": {kind: {f"p{p}": round(percentile(sorted(values), p), 4) for p in PERCENTILES}
+                    for kind, values in latency.items()},
+    }
+
+
+# Regressions of the report against the baseline, as readable lines
+def compare(report, baseline, threshold=THRESHOLD):
+    regressions = []
+    if report["failed_sessions"]:
+        regressions.append(f"{report['failed_sessions']} sessions failed")
+    for kind, base_percentiles in baseline["latency"].items():
+        for name, base in base_percentiles.items():
+            value = report["latency"].get(kind, {}).get(name)
+            if value is None:
+                regressions.append(f"{kind} {name}: no transcripts")
+            elif value > base * (1 + threshold) + LATENCY_SLACK:
+                regressions.append(f"{kind} {name}: {value:.3f}s vs {base:.3f}s baseline")
+    for kind, base in baseline["counts"].items():
+        if not kind.startswith(COMPARED_COUNTS):
+            continue
+        value = report["counts"].get(kind, 0)
+        if abs(value - base) > base * threshold:
+            regressions.append(f"{kind} count: {value} vs {base} baseline")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"{report['sessions']} sessions at {report['speed']}x, {report['failed_sessions']} failed")
+    print(f"{'kind':<20}{'count':>8}" + "".join(f"{f'p{p}':>10}" for p in PERCENTILES)
+          + (f"{'base p50':>10}" if baseline else ""))
+    for kind, count in sorted(report["counts"].items()):
+        line = f"{kind:<20}{count:>8}"
+        if kind in report["latency"]:
+            line += "".join(f"{report['latency'][kind][f'p{p}']:>10.3f}" for p in PERCENTILES)
+            if baseline and kind in baseline["latency"]:
+                line += f"{baseline['latency'][kind]['p50']:>10.3f}"
+        print(line)
+
+
+async def replay_all(paths, url, speed, ssl_context, repeat=1, stagger=0.0, drain=DRAIN_SECONDS):
+    sessions = [load_session(path) for path in paths]
+
+    async def run(index, records):
+        await asyncio.sleep(index * stagger)
+        return await SessionReplay(records, speed).run(url, ssl_context, drain)
+
+    results = await asyncio.gather(*(run(i, records) for i, records in enumerate(sessions * repeat)),
+                                   return_exceptions=True)
+    replays = [r for r in results if isinstance(r, SessionReplay)]
+    for error in (r for r in results if not isinstance(r, SessionReplay)):
+        print(f"Session failed: {error!r}")
+    return build_report(replays, len(results) - len(replays), speed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay captured sessions and check for performance regressions")
+    parser.add_argument("captures", nargs="+", help="Capture files or globs")
+    parser.add_argument("--url", default="wss://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 4 sends a minute of audio in 15 s")
+    parser.add_argument("--repeat", type=int, default=1, help="Concurrent copies of each session")
+    parser.add_argument("--stagger", type=float, default=0.0, help="Seconds between session starts")
+    parser.add_argument("--drain", type=float, default=DRAIN_SECONDS)
+    parser.add_argument("--insecure", action="store_true", help="Skip certificate checks, for the origin cert")
+    parser.add_argument("--baseline", help="Baseline report to compare with")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--save-baseline", help="Write this run's report as the new baseline")
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in args.captures for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("No capture files matched")
+    ssl_context = None
+    if args.url.startswith("wss://"):
+        ssl_context = ssl.create_default_context()
+        if args.insecure:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+    report = asyncio.run(replay_all(paths, args.url, args.speed, ssl_context, args.repeat, args.stagger, args.drain))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        if baseline.get("speed") != report["speed"]:
+            print(f"Warning: baseline was recorded at {baseline.get('speed')}x, this run at {report['speed']}x")
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
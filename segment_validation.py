@@ -0,0 +1,142 @@
+import logging
+import time
+from typing import NamedTuple
+
+# Per-segment hallucination checks, using the signals Whisper returns with every segment
+COMPRESSION_RATIO_THRESHOLD = 2.4  # Higher means the text is repetitive
+LOG_PROB_THRESHOLD = -1.0  # Lower average log probability means a low confidence decode
+NO_SPEECH_THRESHOLD = 0.6  # Above this (with low confidence) the segment is silence or noise
+MAX_WORDS_PER_SECOND = 6  # Faster than anyone speaks
+MAX_WORD_REPEATS = 5  # Any word repeated more often within one segment
+TEMPERATURE_FALLBACK = (0.2, 0.4, 0.6, 0.8, 1.0)  # Temperatures tried when re-decoding a bad segment
+MAX_RETRY_COMPUTE = 0.5  # Seconds of audio that may be re-decoded per second of request audio
+WINDOW_PADDING = 0.2  # Seconds of context added on each side of a re-decoded segment
+SAMPLE_RATE = 16000
+
+logger = logging.getLogger(__name__)
+
+
+class Word(NamedTuple):
+    start: float
+    end: float
+    word: str
+
+
+class Segment(NamedTuple):
+    start: float
+    end: float
+    text: str
+    words: list
+    avg_logprob: float
+    compression_ratio: float
+    no_speech_prob: float
+
+
+# Copy a faster-whisper segment, shifting its timestamps by offset seconds
+def from_faster_whisper(segment, offset=0.0):
+    words = [Word(word.start + offset, word.end + offset, word.word) for word in segment.words or []]
+    return Segment(segment.start + offset, segment.end + offset, segment.text, words,
+                   segment.avg_logprob, segment.compression_ratio, segment.no_speech_prob)
+
+
+# Reason a segment looks like a hallucination, 'no_speech' for segments that should be dropped, or None
+def segment_issue(segment):
+    if segment.no_speech_prob > NO_SPEECH_THRESHOLD and segment.avg_logprob < LOG_PROB_THRESHOLD:
+        return "no_speech"
+    if segment.compression_ratio > COMPRESSION_RATIO_THRESHOLD:
+        return "repetitive"
+    if segment.avg_logprob < LOG_PROB_THRESHOLD:
+        return "low_confidence"
+    words = segment.text.split()
+    duration = max(segment.end - segment.start, 0.5)
+    if len(words) / duration > MAX_WORDS_PER_SECOND:
+        return "too_many_words"
+    word_count = {}
+    for word in words:
+        word_count[word] = word_count.get(word, 0) + 1
+    if word_count and max(word_count.values()) > MAX_WORD_REPEATS:
+        return "repeated_word"
+    return None
+
+
+# Re-decode only the time window of a bad segment, stepping through the temperature fallback while
+# budget (seconds of audio) allows another attempt. The first temperature is always tried, so short
+# clips whose budget is smaller than one window still get a retry. Returns the replacement segments,
+# or None if no temperature produced a clean decode, and the seconds of audio decoded.
+def redecode_window(audio_model, audio, segment, decode_options, budget, temperatures=TEMPERATURE_FALLBACK):
+    start = max(0.0, segment.start - WINDOW_PADDING)
+    end = min(len(audio) / SAMPLE_RATE, segment.end + WINDOW_PADDING)
+    window = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+    window_seconds = end - start
+    options = dict(decode_options, vad_filter=False)
+    used = 0.0
+    for temperature in temperatures:
+        if used and used + window_seconds > budget:
+            break
+        used += window_seconds
+        options['temperature'] = temperature
+        segments, info = audio_model.transcribe(window, **options)
+        replacement = [from_faster_whisper(s, offset=start) for s in segments]
+        if all(segment_issue(s) is None for s in replacement):
+            logger.debug("Segment [%.2fs -> %.2fs] re-decoded at temperature %s", segment.start, segment.end,
+                         temperature, extra={"category": "validation"})
+            return replacement, used
+    return None, used
+
+
+# Transcribe audio, then repair hallucinated segments locally instead of re-running the whole file.
+# Returns the final segments and retry statistics. Audio is a file path or a 16 kHz float32 array.
+def transcribe_validated(audio_model, audio, decode_options, max_retry_compute=MAX_RETRY_COMPUTE):
+    if isinstance(audio, str):
+        from faster_whisper.audio import decode_audio
+        audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+    segments, info = audio_model.transcribe(audio, **decode_options)
+
+    budget = len(audio) / SAMPLE_RATE * max_retry_compute  # Seconds of audio we may re-decode
+    stats = {"dropped": 0, "redecoded": 0, "unrepaired": 0, "retry_seconds": 0.0, "retry_compute_time": 0.0,
+             "audio_seconds": len(audio) / SAMPLE_RATE}
+    result = []
+    for segment in segments:
+        segment = from_faster_whisper(segment)
+        issue = segment_issue(segment)
+        if issue is None:
+            result.append(segment)
+            continue
+        logger.debug("Segment [%.2fs -> %.2fs] flagged as %s", segment.start, segment.end, issue,
+                     extra={"category": "validation"})
+        if issue == "no_speech":
+            stats["dropped"] += 1
+            continue
+
+        # Every temperature attempt is charged to the budget
+        retry_start_time = time.time()
+        replacement, used = redecode_window(audio_model, audio, segment, decode_options, budget)
+        budget -= used
+        stats["retry_seconds"] += used
+        stats["retry_compute_time"] += time.time() - retry_start_time
+        if replacement is not None:
+            stats["redecoded"] += 1
+            result.extend(replacement)
+            continue
+        stats["unrepaired"] += 1
+        # Out of budget or still bad at every temperature: keep low confidence text, drop hallucinations
+        if issue == "low_confidence":
+            result.append(segment)
+    return result, stats
+
+
+# Same checks for WhisperS2T output, whose segments are dicts. Drops flagged segments, since its
+# decode options are fixed at load time and a re-run would give the same result.
+def filter_s2t_segments(segments):
+    kept = []
+    for segment in segments:
+        checked = Segment(segment.get('start_time', 0.0), segment.get('end_time', 0.0), segment['text'], [],
+                          segment.get('avg_logprob', 0.0), segment.get('compression_ratio', 0.0),
+                          segment.get('no_speech_prob', 0.0))
+        issue = segment_issue(checked)
+        if issue is None:
+            kept.append(segment)
+        else:
+            logger.debug("Dropping segment [%.2fs -> %.2fs] flagged as %s", checked.start, checked.end, issue,
+                         extra={"category": "validation"})
+    return kept
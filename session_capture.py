@@ -0,0 +1,92 @@
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Session capture: every message a client sends, with its arrival time, in a compact binary file
+# that replay.py can re-drive against a server. Captures hold raw user audio, keep them private.
+#   file   = MAGIC, then records
+#   record = offset in microseconds since the session started (u64), kind (u8), length (u32), payload
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR", "")  # Capturing is off unless this is set
+MAGIC = b"SOEFRCAP1"
+RECORD_HEADER = struct.Struct("<QBI")
+BINARY = 0
+TEXT = 1
+FLUSH_BYTES = 256 * 1024  # Buffered bytes handed to the writer thread at a time
+
+logger = logging.getLogger(__name__)
+
+# One thread does every capture write, so the event loop never waits on the disk and each file's
+# chunks are written in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-capture")
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.start = time.monotonic()
+        self.buffer = bytearray(MAGIC)
+        self.file = None
+        self.records = 0
+        self.lock = threading.Lock()
+
+    # Record a message as it arrives. Cheap, the disk write happens on the writer thread.
+    def record(self, message):
+        offset = int((time.monotonic() - self.start) * 1e6)
+        if isinstance(message, str):
+            kind, payload = TEXT, message.encode()
+        else:
+            kind, payload = BINARY, message
+        self.buffer += RECORD_HEADER.pack(offset, kind, len(payload))
+        self.buffer += payload
+        self.records += 1
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        data, self.buffer = self.buffer, bytearray()
+        if data:
+            _writer.submit(self.write, bytes(data))
+
+    def write(self, data):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(data)
+
+    def close(self):
+        self.flush()
+        _writer.submit(self.close_file)
+
+    def close_file(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+        logger.info("Captured %s messages to %s", self.records, self.path, extra={"category": "capture"})
+
+
+# Start capturing a session, or return None when capturing is off
+def open_capture(session_id, capture_dir=CAPTURE_DIR):
+    if not capture_dir:
+        return None
+    os.makedirs(capture_dir, exist_ok=True)
+    path = os.path.join(capture_dir, f"{time.strftime('%Y%m%d%H%M%S')}-{session_id}.cap")
+    return CaptureWriter(path)
+
+
+# Yield (offset seconds, message) for each record, message is bytes or str as it was received
+def read_capture(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session capture")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return  # End of file, or a capture cut short mid-record
+            offset, kind, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield offset / 1e6, payload.decode() if kind == TEXT else payload
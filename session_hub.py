@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import os
+from collections import Counter, deque
+
+# Fan-out of a session's transcripts and summaries to observers (a meeting display, captions for
+# other participants). Each message is serialized once and queued for every subscriber; a writer
+# task per subscriber drains its queue, so subscribers are sent to concurrently and a slow one
+# only ever holds up itself. Queues are bounded and drop their oldest message when full.
+#   {"subscribe": "<session_id>", "token": "<viewer_token>"}  -> {"subscribed": "<session_id>"}, then the
+#                                                               session's messages
+#   {"unsubscribe": "<session_id>"}
+SUBSCRIBER_QUEUE = int(os.environ.get("SUBSCRIBER_QUEUE", "64"))  # Messages buffered per subscriber
+MAX_SUBSCRIBERS = int(os.environ.get("MAX_SUBSCRIBERS", "1000"))  # Per session
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, ws, session_id, queue_size=SUBSCRIBER_QUEUE):
+        self.ws = ws
+        self.session_id = session_id
+        self.queue = deque(maxlen=queue_size)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.task = None
+
+    # Queue a serialized message, dropping the oldest if the subscriber has fallen too far behind
+    def put(self, payload):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(payload)
+        self.ready.set()
+
+    async def write(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                await self.ws.send(self.queue.popleft())
+
+
+class SessionHub:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE, max_subscribers=MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.sessions = {}  # session_id -> {ws: Subscriber}
+        self.by_socket = {}  # ws -> {session_id: Subscriber}, to clean up when a socket closes
+        self.stats = Counter()
+
+    # Start sending session_id's messages to ws. Returns False if the session is at its limit.
+    def subscribe(self, session_id, ws):
+        subscribers = self.sessions.setdefault(session_id, {})
+        if ws in subscribers:
+            return True
+        if len(subscribers) >= self.max_subscribers:
+            return False
+        subscriber = Subscriber(ws, session_id, self.queue_size)
+        subscriber.task = asyncio.ensure_future(self.run(subscriber))
+        subscribers[ws] = subscriber
+        self.by_socket.setdefault(ws, {})[session_id] = subscriber
+        self.stats["subscribed"] += 1
+        return True
+
+    async def run(self, subscriber):
+        try:
+            await subscriber.write()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket closed or failed, its own handler cleans up the rest
+            logger.debug("Subscriber of %s gone: %r", subscriber.session_id, e, extra={"category": "fanout"})
+            self.remove(subscriber)
+
+    def unsubscribe(self, session_id, ws):
+        subscriber = self.sessions.get(session_id, {}).get(ws)
+        if subscriber is not None:
+            subscriber.task.cancel()
+            self.remove(subscriber)
+
+    # Drop every subscription of a socket, when it disconnects
+    def unsubscribe_all(self, ws):
+        for subscriber in list(self.by_socket.get(ws, {}).values()):
+            subscriber.task.cancel()
+            self.remove(subscriber)
+
+    def remove(self, subscriber):
+        subscribers = self.sessions.get(subscriber.session_id, {})
+        if subscribers.get(subscriber.ws) is not subscriber:
+            return
+        del subscribers[subscriber.ws]
+        if not subscribers:
+            del self.sessions[subscriber.session_id]
+        sessions = self.by_socket[subscriber.ws]
+        del sessions[subscriber.session_id]
+        if not sessions:
+            del self.by_socket[subscriber.ws]
+        if subscriber.dropped:
+            logger.info("Subscriber to %s dropped %s messages", subscriber.session_id, subscriber.dropped,
+                        extra={"category": "fanout", "session_id": subscriber.session_id})
+
+    # Serialize a message once and queue it for the session's subscribers. Never waits on a
+    # subscriber. Returns the serialized message, for the speaker's own socket.
+    def publish(self, session_id, message):
+        payload = json.dumps(message)
+        subscribers = self.sessions.get(session_id)
+        if subscribers:
+            for subscriber in subscribers.values():
+                subscriber.put(payload)
+            self.stats["published"] += 1
+            self.stats["queued"] += len(subscribers)
+        return payload
+
+    def subscriber_count(self, session_id=None):
+        if session_id is not None:
+            return len(self.sessions.get(session_id, ()))
+        return sum(len(subscribers) for subscribers in self.sessions.values())
+
+    def dropped(self):
+        return sum(s.dropped for subscribers in self.sessions.values() for s in subscribers.values())
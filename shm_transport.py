@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
+
+# Co-located transport: audio goes through a shared-memory ring, a Unix socket carries the control
+# messages. Used instead of WAV files and HTTP when the transcription worker runs on the same host.
+SHM_NAME = os.environ.get("SHM_NAME", "soefr-audio")  # Shared memory block holding the ring
+SHM_SOCKET_PATH = os.environ.get("SHM_SOCKET_PATH", "/tmp/soefr-asr.sock")  # Control channel
+SHM_SLOTS = 32  # Segments that can be in flight at once, across all clients
+SHM_SLOTS_PER_CLIENT = int(os.environ.get("SHM_SLOTS_PER_CLIENT", "8"))  # Leased to each client connection
+SHM_SLOT_BYTES = 48000 * 2 * 20  # Room for 20 s of 48 kHz 16-bit mono audio per slot
+SHM_WORKERS = 4  # Requests the worker transcribes concurrently
+RETRY_BACKOFF = 1.0  # Seconds before reconnecting after the worker was unreachable, doubling
+MAX_RETRY_BACKOFF = 60.0
+MODEL_SAMPLE_RATE = 16000
+
+logger = logging.getLogger(__name__)
+
+
+_created_here = set()  # Blocks created by a worker running in this process
+
+
+# Attach to an existing block without registering it with this process' resource tracker,
+# which would otherwise unlink the worker's block when this process exits
+def attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    if name not in _created_here:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+# Client side, used by the WebSocket server on the event loop
+class ShmTranscriptionClient:
+    def __init__(self, name=SHM_NAME, socket_path=SHM_SOCKET_PATH, slot_bytes=SHM_SLOT_BYTES):
+        self.name = name
+        self.socket_path = socket_path
+        self.slot_bytes = slot_bytes
+        self.shm = None
+        self.reader = None
+        self.writer = None
+        # Free slots and pending requests belong to one connection. The worker leases each connection
+        # its own slots, they go back to the queue when the worker answers, never earlier, and a
+        # reconnect starts over with a fresh lease.
+        self.free_slots = None
+        self.pending = {}  # Request id -> (future resolved by the completion notice, slot)
+        self.next_id = 0
+        self.connect_lock = asyncio.Lock()
+        self.retry_at = 0.0  # No connection attempts before this, after a failed one
+        self.backoff = RETRY_BACKOFF
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    # Whether to try this transport, False while backing off after the worker was unreachable
+    def available(self):
+        return self.connected or time.monotonic() >= self.retry_at
+
+    async def connect(self):
+        async with self.connect_lock:
+            if self.connected:
+                return
+            writer = None
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                # The worker answers with the slots this connection may write to
+                hello = json.loads(await reader.readline() or b'{"error": "Worker closed the connection"}')
+                if "error" in hello:
+                    raise ConnectionError(hello["error"])
+                shm = attach_shared_memory(self.name)  # A restarted worker has a new block
+            except (OSError, ValueError) as e:
+                if writer is not None:
+                    writer.close()
+                self.retry_at = time.monotonic() + self.backoff
+                self.backoff = min(self.backoff * 2, MAX_RETRY_BACKOFF)
+                raise ConnectionError(f"Transcription worker unavailable: {e}") from e
+            self.backoff = RETRY_BACKOFF
+            if self.shm is not None:
+                self.shm.close()
+            self.shm = shm
+            self.reader, self.writer = reader, writer
+            self.free_slots = asyncio.Queue()
+            for slot in hello["slots"]:
+                self.free_slots.put_nowait(slot)
+            self.pending = {}
+            asyncio.ensure_future(self.read_responses(reader, writer, self.free_slots, self.pending))
+            logger.info("Connected to co-located transcription worker at %s", self.socket_path,
+                        extra={"category": "transcription"})
+
+    # Resolve pending requests as completion notices arrive. A slot is free again once the worker
+    # has answered, even if the request was cancelled meanwhile; the worker may still be reading it.
+    async def read_responses(self, reader, writer, free_slots, pending):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future, slot = pending.pop(response.pop("id"), (None, None))
+                if slot is not None:
+                    free_slots.put_nowait(slot)
+                if future and not future.done():
+                    future.set_result(response)
+        finally:
+            # This connection's slots die with it, requests still waiting fail. Returning the slots
+            # wakes requests queued for one, which then find the connection closed.
+            writer.close()
+            for future, slot in pending.values():
+                free_slots.put_nowait(slot)
+                if not future.done():
+                    future.set_exception(ConnectionError("Transcription worker disconnected"))
+            pending.clear()
+
+    # Write PCM audio into a free slot and wait for the worker's transcription of it
+    async def transcribe(self, audio_data, audio_size, sample_rate, **options):
+        if len(audio_data) > self.slot_bytes:
+            raise ValueError(f"Segment of {len(audio_data)} bytes doesn't fit in a {self.slot_bytes} byte slot")
+        await self.connect()
+        free_slots, pending, writer = self.free_slots, self.pending, self.writer
+        slot = await free_slots.get()
+        if writer.is_closing():
+            raise ConnectionError("Transcription worker disconnected")
+        offset = slot * self.slot_bytes
+        self.shm.buf[offset:offset + len(audio_data)] = audio_data
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        pending[request_id] = (future, slot)  # read_responses frees the slot
+        request = {"id": request_id, "slot": slot, "length": len(audio_data), "sample_rate": sample_rate,
+                   "audio_size": audio_size, **options}
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        return await future
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        if self.shm:
+            self.shm.close()
+
+
+# Convert 16-bit PCM into the 16 kHz float32 array the model consumes
+def pcm_to_model_audio(pcm, rate):
+    import numpy as np
+    if rate % MODEL_SAMPLE_RATE == 0:
+        # Average each group of samples, a cheap low-pass filter and decimation in one step
+        factor = rate // MODEL_SAMPLE_RATE
+        usable = len(pcm) - len(pcm) % factor
+        audio = pcm[:usable].reshape(-1, factor).mean(axis=1, dtype=np.float32)
+    else:
+        positions = np.arange(0, len(pcm), rate / MODEL_SAMPLE_RATE)
+        audio = np.interp(positions, np.arange(len(pcm)), pcm).astype(np.float32)
+    audio /= 32768.0
+    return audio
+
+
+# Read a slot without copying the PCM out of shared memory first
+def read_slot(shm, request, slot_bytes=SHM_SLOT_BYTES):
+    import numpy as np
+    offset = request["slot"] * slot_bytes
+    pcm = np.frombuffer(shm.buf, dtype=np.int16, count=request["length"] // 2, offset=offset)
+    return pcm_to_model_audio(pcm, request["sample_rate"])
+
+
+# Worker side: owns the shared memory block and answers requests on the Unix socket.
+# handler(audio, request) returns the response dict, like the /transcribe JSON body.
+class ShmTranscriptionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, handler, name=SHM_NAME, socket_path=SHM_SOCKET_PATH, slots=SHM_SLOTS,
+                 slot_bytes=SHM_SLOT_BYTES, workers=SHM_WORKERS, slots_per_client=SHM_SLOTS_PER_CLIENT):
+        self.transcription_handler = handler
+        self.slot_bytes = slot_bytes
+        self.slots_per_client = slots_per_client
+        self.free_slots = list(range(slots))  # Slots not leased to any client connection
+        self.slots_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shm-transcribe")
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=slots * slot_bytes)
+        except FileExistsError:
+            # Left behind by a worker that didn't shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=slots * slot_bytes)
+        _created_here.add(name)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ShmRequestHandler)
+
+    # Lease a disjoint set of slots to a new client connection, so two clients never write to the
+    # same slot. Returns an empty list when every slot is leased.
+    def lease_slots(self):
+        with self.slots_lock:
+            leased = self.free_slots[:self.slots_per_client]
+            del self.free_slots[:len(leased)]
+        return leased
+
+    def release_slots(self, slots):
+        with self.slots_lock:
+            self.free_slots.extend(slots)
+
+    def transcribe(self, request):
+        try:
+            audio = read_slot(self.shm, request, self.slot_bytes)
+            response = self.transcription_handler(audio, request)
+        except Exception as e:
+            logger.exception("Error during transcription: %s", e, extra={"category": "transcription"})
+            response = {"error": "An error occurred during transcription", "details": str(e)}
+        return {"id": request["id"], **response}
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.shm.close()
+        self.shm.unlink()
+        _created_here.discard(self.shm.name)
+
+
+class ShmRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        slots = self.server.lease_slots()
+        if not slots:
+            logger.warning("No shared memory slots left, turning a client away", extra={"category": "transcription"})
+            self.wfile.write(json.dumps({"error": "No free shared memory slots"}).encode() + b"\n")
+            return
+        try:
+            self.wfile.write(json.dumps({"slots": slots}).encode() + b"\n")
+            self.wfile.flush()
+            self.serve(set(slots))
+        finally:
+            self.server.release_slots(slots)
+
+    def serve(self, slots):
+        write_lock = threading.Lock()
+
+        def send(response):
+            line = json.dumps(response).encode() + b"\n"
+            with write_lock:
+                try:
+                    self.wfile.write(line)
+                    self.wfile.flush()
+                except (OSError, ValueError):
+                    pass  # Client went away, nothing to notify
+
+        def reply(future):
+            send(future.result())
+
+        # Requests on one connection are transcribed concurrently and answered as they complete
+        futures = []
+        for line in self.rfile:
+            request = json.loads(line)
+            if request.get("slot") not in slots:
+                send({"id": request.get("id"), "error": "Slot not leased to this connection"})
+                continue
+            future = self.server.executor.submit(self.server.transcribe, request)
+            future.add_done_callback(reply)
+            futures.append(future)
+            futures = [f for f in futures if not f.done()]
+        wait(futures)  # Keep the connection open until every reply has been written
+
+
+def start_shm_server(handler, **options):
+    server = ShmTranscriptionServer(handler, **options)
+    logger.info("Co-located transcription worker listening on %s", server.server_address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,14 +1,19 @@
 import asyncio
 from websocket_server import start_websocket_server
-from transcribeshort import start_transcribe_short
+from transcribeshort import start_transcribe_short, start_shm_worker
 from transcribelong import start_transcribe_long
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
 
 async def main():
     ws_task = asyncio.create_task(start_websocket_server())
     ts_task = asyncio.create_task(asyncio.to_thread(start_transcribe_short))
     tl_task = asyncio.create_task(asyncio.to_thread(start_transcribe_long))
-    
-    await asyncio.gather(ws_task, ts_task, tl_task)
+    shm_task = asyncio.create_task(asyncio.to_thread(start_shm_worker))  # Same-host transport, HTTP stays as fallback
+
+    await asyncio.gather(ws_task, ts_task, tl_task, shm_task)
 
 if __name__ == "__main__":
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 starts and stops the sampling profiler
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,173 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# Structured logging for every server and worker. Records are put on a queue by the caller and
+# formatted and written by a background thread, so a slow stdout never blocks the event loop or
+# the Flask workers. Hot-path categories can be sampled and rate limited before they are queued.
+#   LOG_LEVEL=DEBUG                            also logs every segment and word
+#   LOG_FORMAT=text                            human readable lines instead of JSON
+#   LOG_SAMPLE="transcription=0.1"             keep 10% of records in a category
+#   LOG_RATE_LIMIT="segment=20,connection=50"  at most N records per second in a category
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = 10000  # Records waiting to be written before new ones are dropped
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+LOG_RATE_LIMIT = os.environ.get("LOG_RATE_LIMIT", "connection=20,segment=50")
+
+# Attributes every LogRecord has, anything else was passed through extra= and is a structured field
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "category"}
+
+
+# "a=0.1,b=2" -> {"a": 0.1, "b": 2.0}
+def parse_settings(value):
+    settings = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        if name.strip() and number.strip():
+            settings[name.strip()] = float(number)
+    return settings
+
+
+# Category of a record, from extra={"category": ...}, defaulting to the logger name
+def record_category(record):
+    return getattr(record, "category", record.name)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "category": record_category(record),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in RESERVED_ATTRS}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+# Per-category sampling and rate limits, applied on the caller's thread before a record is queued.
+# Warnings and errors always pass.
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample=None, rate_limits=None):
+        super().__init__()
+        self.sample = sample or {}
+        self.rate_limits = rate_limits or {}
+        self.buckets = {}  # category -> [tokens, last update]
+        self.dropped = {}  # category -> records dropped
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        category = record_category(record)
+        rate = self.sample.get(category)
+        if rate is not None and random.random() >= rate:
+            return self.drop(category)
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            now = time.monotonic()
+            with self.lock:
+                bucket = self.buckets.setdefault(category, [limit, now])
+                bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    return self.drop(category)
+                bucket[0] -= 1
+        return True
+
+    def drop(self, category):
+        self.dropped[category] = self.dropped.get(category, 0) + 1
+        return False
+
+
+# Queues records without formatting them, formatting happens on the listener thread. A full
+# queue drops the record instead of blocking the caller.
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+# Route all logging through the queue. Safe to call from every entry point, only the first call
+# takes effect.
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sample=LOG_SAMPLE, rate_limit=LOG_RATE_LIMIT, stream=None):
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return _handler
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+            level = level if isinstance(level, int) else logging.INFO
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(SamplingFilter(parse_settings(sample), parse_settings(rate_limit)))
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(level)
+        for noisy in ("werkzeug", "urllib3", "botocore", "websockets"):
+            logging.getLogger(noisy).setLevel(max(level, logging.INFO))
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _handler
+
+
+# Write out everything still queued, called at exit
+def stop_logging():
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+# Records dropped so far by sampling, rate limits and a full queue
+def dropped_counts():
+    if _handler is None:
+        return {}
+    counts = {}
+    for log_filter in _handler.filters:
+        counts.update(getattr(log_filter, "dropped", {}))
+    counts["queue_full"] = _handler.dropped
+    return counts
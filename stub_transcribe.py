@@ -0,0 +1,32 @@
+from flask import Flask, request, jsonify
+import os
+import random
+import time
+
+# Stand-in for the transcription backends, used to exercise the WebSocket server without a GPU
+STUB_LATENCY = float(os.environ.get("STUB_LATENCY", "0.5"))  # Mean service time in seconds
+STUB_JITTER = float(os.environ.get("STUB_JITTER", "0.2"))  # Fraction of the latency added as random jitter
+STUB_TEXT = os.environ.get("STUB_TEXT", "this is a stub transcription")
+
+app = Flask(__name__)
+
+
+def service_time():
+    return STUB_LATENCY * (1 + random.uniform(-STUB_JITTER, STUB_JITTER))
+
+
+@app.route('/transcribe', methods=['POST'])
+@app.route('/transcribelong', methods=['POST'])
+def transcribe_audio():
+    audio_size = request.json.get('audio_size', 'short')
+    # Long audio takes proportionally longer to decode
+    time.sleep(service_time() * (2 if audio_size == 'long' else 1))
+    return jsonify({"transcription": STUB_TEXT})
+
+
+def start_transcribe():
+    app.run(port=8001, use_reloader=False, threaded=True)
+
+
+if __name__ == '__main__':
+    app.run(port=8001, threaded=True)
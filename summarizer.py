@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter
+
+# Summaries with a latency budget. The remote model is asked first; if it hasn't answered within
+# SUMMARY_DEADLINE seconds, an extractive summary of the session transcript is sent straight away
+# marked provisional, and the remote summary replaces it when it arrives. If the remote call fails
+# the extractive summary is sent as the final one, so the client always gets a summary.
+#   {"summary": "...", "provisional": true, "source": "local"}
+#   {"summary": "...", "provisional": false, "source": "remote"}
+SUMMARY_DEADLINE = float(os.environ.get("SUMMARY_DEADLINE", "3"))  # Seconds before the local summary is sent
+REMOTE_TIMEOUT = 30  # Seconds before the remote request is given up on
+EXTRACTIVE_SENTENCES = 5  # Sentences kept by the local summarizer
+MIN_SENTENCE_WORDS = 4  # Shorter sentences ("Okay.", "Yeah, right.") are never picked
+INSTRUCTIONS = "Summarize the transcription below into succinct bullet points, only respond with the bullet points: "
+SYSTEM_PROMPT = "You are to summarize concisely but thoroughly the transcribed audio."
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+    a about after all also am an and any are as at be because been but by can could did do does doing
+    don't for from get got had has have he her here him his how i i'm if in into is it it's its just know
+    like me more my no not now of oh okay on one or our out really right say so some that that's the their
+    them then there they think this to um uh up us very was we well were what when where which who will
+    with would yeah yes you your
+""".split())
+
+logger = logging.getLogger(__name__)
+
+# Summaries sent across connections, by how the final one was produced
+totals = Counter()
+
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+
+
+def content_words(text):
+    return [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+
+
+# Pick the sentences of text whose words come up most across the session, as bullet points in
+# their original order. context is the session's other transcripts, used for the word frequencies.
+def extractive_summary(text, context=(), max_sentences=EXTRACTIVE_SENTENCES):
+    frequencies = Counter(w for t in (text, *context) for w in content_words(t))
+    if not frequencies:
+        return ""
+    top = max(frequencies.values())
+    scored = []
+    seen = set()
+    for index, sentence in enumerate(split_sentences(text)):
+        key = sentence.lower()
+        # Whisper often repeats itself across segment boundaries
+        if key in seen or len(sentence.split()) < MIN_SENTENCE_WORDS:
+            continue
+        seen.add(key)
+        words = content_words(sentence)
+        if words:
+            # Normalised by the square root of the length, so long sentences don't win on length alone
+            score = sum(frequencies[w] for w in words) / top / len(words) ** 0.5
+            scored.append((score, index, sentence))
+    if not scored:
+        return ""
+    picked = sorted(sorted(scored, reverse=True)[:max_sentences], key=lambda s: s[1])
+    return "\n".join(f"- {sentence}" for _, _, sentence in picked)
+
+
+def summary_request(text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f'{INSTRUCTIONS} {text}'},
+    ]
+
+
+class SummaryEngine:
+    def __init__(self, generate=None, deadline=SUMMARY_DEADLINE, timeout=REMOTE_TIMEOUT):
+        if generate is None:
+            from openai_client import generate_response as generate  # Creates the OpenAI client
+        self.generate = generate  # Coroutine taking chat messages, returns a completion or None
+        self.deadline = deadline
+        self.timeout = timeout
+
+    async def remote_summary(self, text):
+        request = summary_request(text)
+        # The full prompt is only worth formatting when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending request to openai module: %s", request, extra={"category": "summary"})
+        response = await asyncio.wait_for(self.generate(request), timeout=self.timeout)
+        if response is None:
+            return None
+        return response.choices[0].message.content
+
+    # Summarize text, calling send with each summary message. context is the session's transcripts
+    # for the local summarizer. Returns the source of the final summary, or None if none was sent.
+    async def summarize(self, text, context, send, session_id=None):
+        start = time.monotonic()
+        remote = asyncio.ensure_future(self.remote_summary(text))
+        local = None
+        try:
+            done, _ = await asyncio.wait({remote}, timeout=self.deadline)
+            if not done:
+                local = await asyncio.to_thread(extractive_summary, text, context)
+                if local:
+                    await send({"summary": local, "provisional": True, "source": "local"})
+                    totals["provisional"] += 1
+                    logger.info("Remote summary over its %ss deadline, sent local summary", self.deadline,
+                                extra={"category": "summary", "session_id": session_id})
+            content = await remote
+        except asyncio.TimeoutError:
+            logger.warning("OpenAI API request timed out", extra={"category": "summary", "session_id": session_id})
+            content = None
+        except asyncio.CancelledError:
+            remote.cancel()
+            raise
+        except Exception as error:
+            logger.error("Summarization failed: %s", error, extra={"category": "summary", "session_id": session_id})
+            content = None
+
+        if content:
+            await send({"summary": content, "provisional": False, "source": "remote"})
+            source = "remote"
+        else:
+            # The remote model failed, the local summary becomes the final one
+            if local is None:
+                local = await asyncio.to_thread(extractive_summary, text, context)
+            if not local:
+                return None
+            await send({"summary": local, "provisional": False, "source": "local"})
+            source = "local"
+        totals[source] += 1
+        logger.info("Summary sent", extra={"category": "summary", "session_id": session_id, "source": source,
+                                           "summary_secs": round(time.monotonic() - start, 3)})
+        return source
+
+
+# One connection's summaries, run in the background so a slow remote model doesn't hold up the
+# connection's audio. While a summary is in progress, requests coalesce into one that runs after it
+# with the latest text, so a client can't start more than one remote call at a time.
+class SessionSummaries:
+    def __init__(self, engine):
+        self.engine = engine
+        self.task = None  # The summary in progress
+        self.next_request = None  # Arguments of the latest request, run once the current one finishes
+
+    # Summarize text like SummaryEngine.summarize, now or after the summary in progress
+    def request(self, text, context, send, session_id=None):
+        if self.task is not None and not self.task.done():
+            if self.next_request is not None:
+                totals["coalesced"] += 1
+            self.next_request = (text, context, send, session_id)
+            return
+        self.task = asyncio.ensure_future(self.run((text, context, send, session_id)))
+
+    async def run(self, request):
+        while request is not None:
+            await self.engine.summarize(*request)
+            request, self.next_request = self.next_request, None
+
+    # Drop a summary still waiting on the remote model, once the client has gone
+    def close(self):
+        self.next_request = None
+        if self.task is not None:
+            self.task.cancel()
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from admission_control import AdmissionController
+
+
+def shed_features(controller):
+    return [feature for feature in ("long", "summary", "merge_short") if controller.should_shed(feature)]
+
+
+def test_saturated_backend_sheds_in_order_and_recovers():
+    async def run():
+        controller = AdmissionController(max_in_flight=4)
+        notices = []
+        controller.add_listener(lambda c: notices.append(json.loads(c.status_message())["shed"]))
+        release = asyncio.Event()
+
+        # Stub backend: every request holds its slot until released
+        async def request():
+            async with controller:
+                await release.wait()
+
+        levels = []
+        tasks = []
+        for _ in range(8):
+            tasks.append(asyncio.ensure_future(request()))
+            await asyncio.sleep(0)
+            levels.append(shed_features(controller))
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, levels, notices
+
+    controller, levels, notices = asyncio.run(run())
+    # Load factor 0.25 per request: long at 0.75, summary at 1.0, merge_short at 1.5
+    assert levels == [[], [], ["long"], ["long", "summary"], ["long", "summary"],
+                      ["long", "summary", "merge_short"], ["long", "summary", "merge_short"],
+                      ["long", "summary", "merge_short"]]
+    assert notices[:3] == [["long"], ["long", "summary"], ["long", "summary", "merge_short"]]
+    assert notices[-1] == []
+    assert not controller.degraded and controller.in_flight == 0
+    assert controller.stats["max_load_factor"] == 2.0
+
+
+def test_recovery_has_hysteresis():
+    controller = AdmissionController(max_in_flight=4)
+    controller.in_flight = 4  # Load 1.0: long and summary shed
+    controller.update()
+    assert controller.shed_level == 2
+    controller.in_flight = 3  # 0.75 is below summary's threshold but within the recovery margin
+    controller.update()
+    assert controller.shed_level == 2
+    controller.in_flight = 2  # 0.5: summary comes back, long stays shed although 0.5 is below its 0.75
+    controller.update()
+    assert controller.shed_level == 1
+    controller.in_flight = 0
+    controller.update()
+    assert controller.shed_level == 0
+
+
+def test_connection_cap():
+    controller = AdmissionController(max_connections=2)
+    assert controller.try_connect() and controller.try_connect()
+    assert not controller.try_connect()
+    controller.disconnect()
+    assert controller.try_connect()
+    assert controller.stats["rejected_connections"] == 1
@@ -0,0 +1,40 @@
+import json
+import math
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from bulk_transcribe import SAMPLE_RATE, decode_wav, recover_output  # noqa: E402
+
+
+def write_wav(path, samples, rate):
+    with wave.open(str(path), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+
+
+def test_resampling_does_not_alias(tmp_path):
+    pytest.importorskip("scipy")
+    rate = 48000
+    t = np.arange(rate) / rate
+    # 12 kHz is above the 8 kHz Nyquist limit of the output, it must be filtered out, not folded to 4 kHz
+    write_wav(tmp_path / "tone.wav", 16000 * np.sin(2 * math.pi * 12000 * t), rate)
+    _, audio = decode_wav(str(tmp_path / "tone.wav"))
+    assert len(audio) == SAMPLE_RATE
+    assert np.sqrt(np.mean(audio[1000:-1000] ** 2)) < 0.01
+
+    write_wav(tmp_path / "speech.wav", 16000 * np.sin(2 * math.pi * 440 * t), rate)
+    _, audio = decode_wav(str(tmp_path / "speech.wav"))
+    assert abs(np.sqrt(np.mean(audio[1000:-1000] ** 2)) - 16000 / 32768 / math.sqrt(2)) < 0.01
+
+
+def test_resume_skips_written_rows_and_drops_a_partial_line(tmp_path):
+    output = tmp_path / "transcripts.jsonl"
+    rows = "".join(json.dumps({"key": f"a{n}.wav", "transcription": "hi"}) + "\n" for n in range(3))
+    output.write_text(rows + '{"key": "a3.wav", "transcri')
+    assert recover_output(str(output), "jsonl") == {"a0.wav", "a1.wav", "a2.wav"}
+    assert output.read_text() == rows
+    assert recover_output(str(tmp_path / "missing.jsonl"), "jsonl") == set()
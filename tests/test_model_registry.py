@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from model_registry import ModelRegistry, pool_key
+
+
+# Counts loads and can be made to fail or to take a while, so concurrent callers overlap
+class FakeLoader:
+    def __init__(self, delay=0.0, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, model_size, device, compute_type, **kwargs):
+        with self.lock:
+            self.loads += 1
+            fail = self.failures > 0
+            self.failures -= 1
+        time.sleep(self.delay)
+        if fail:
+            raise RuntimeError("out of memory")
+        return object()
+
+
+def test_concurrent_get_loads_once():
+    loader = FakeLoader(delay=0.2)
+    registry = ModelRegistry(loader=loader, warm_up=None)
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get("tiny"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.loads == 1
+    assert len(models) == 8 and all(model is models[0] for model in models)
+
+
+def test_load_failure_is_reported_and_retried():
+    loader = FakeLoader(failures=1)
+    registry = ModelRegistry(loader=loader, warm_up=None)
+    with pytest.raises(RuntimeError):
+        registry.get("tiny")
+    assert registry.status()["tiny/cuda/int8"]["error"] == "out of memory"
+    assert registry.get("tiny") is not None
+    assert loader.loads == 2
+    assert registry.status()["tiny/cuda/int8"] == {"ready": True, "error": None,
+                                                    "load_time": registry.load_times[("tiny", "cuda", "int8")]}
+
+
+def test_ready_status_before_and_after_load():
+    registry = ModelRegistry(loader=FakeLoader(delay=0.2), warm_up=None)
+    body, status = registry.ready_status("tiny", "cuda", "int8")
+    assert status == 503 and not body["ready"]
+    thread = registry.load_in_background("tiny")
+    body, status = registry.ready_status("tiny", "cuda", "int8")
+    assert status == 503 and body["models"]["tiny/cuda/int8"]["ready"] is False
+    thread.join()
+    body, status = registry.ready_status("tiny", "cuda", "int8")
+    assert status == 200 and body["ready"]
+
+
+def test_warm_up_runs_before_ready():
+    warmed = []
+    registry = ModelRegistry(loader=FakeLoader(), warm_up=lambda model, decodes: warmed.append(decodes),
+                             warmup_decodes=2)
+    registry.get("tiny")
+    assert warmed == [2]
+
+
+def test_pool_hands_out_and_returns_replicas():
+    loader = FakeLoader()
+    registry = ModelRegistry(loader=loader, warm_up=None)
+    pool = registry.get_pool("tiny", "cpu", "int8", replicas=2)
+    assert loader.loads == 2 and len(pool) == 2
+    assert registry.is_ready(*pool_key("tiny", "cpu", "int8", 2))
+    with pool.acquire() as first:
+        with pool.acquire() as second:
+            assert first is not second
+            # Both replicas are out, a third request waits for one
+            def borrow():
+                with pool.acquire():
+                    pass
+            waiter = threading.Thread(target=borrow)
+            waiter.start()
+            waiter.join(0.1)
+            assert waiter.is_alive()
+    waiter.join(1)
+    assert not waiter.is_alive()
+
+
+def test_single_replica_is_shared():
+    registry = ModelRegistry(loader=FakeLoader(), warm_up=None)
+    pool = registry.get_pool("tiny", "cuda", "int8", replicas=1)
+    with pool.acquire() as first:
+        with pool.acquire() as second:
+            assert first is second
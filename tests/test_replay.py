@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from replay import FRAME_SIZE, SessionReplay, segment_ends
+
+SPEECH = b"\x01" * FRAME_SIZE
+SILENCE = b"\x00" * FRAME_SIZE
+
+
+def is_speech(frame):
+    return frame[0] != 0
+
+
+def test_segments_end_at_the_start_of_the_phrase_gap():
+    # 1.2 s of speech, then the 300 ms phrase timeout, twice
+    messages = ([SPEECH] * 40 + [SILENCE] * 10) * 2
+    cuts = segment_ends(messages, is_speech)
+    assert {index: ends for index, ends in enumerate(cuts) if ends} == {49: [40], 99: [90]}
+
+
+def test_short_segments_merge_into_the_next():
+    # 0.6 s segments are under a second, so the first is sent with the second
+    messages = ([SPEECH] * 20 + [SILENCE] * 10) * 2
+    cuts = segment_ends(messages, is_speech)
+    assert {index: ends for index, ends in enumerate(cuts) if ends} == {59: [50]}
+
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.messages:
+            raise StopAsyncIteration
+        return self.messages.pop(0)
+
+
+def test_transcripts_match_by_segment_number():
+    replay = SessionReplay([], speed=1)
+    replay.sent = [0.0] * 10
+    replay.segments_cut([3, 7])
+    # Segment 1 transcribed empty, the server sent nothing for it
+    ws = FakeWebSocket([json.dumps({"transcript": "hello", "audio_size": "short", "seq": 0, "segment": 2})])
+    asyncio.run(replay.receive(ws))
+    assert replay.counts["transcript_short"] == 1
+    assert len(replay.latency["transcript_short"]) == 1
+    assert list(replay.pending["transcript_short"]) == [1]
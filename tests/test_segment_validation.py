@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from segment_validation import SAMPLE_RATE, transcribe_validated
+
+REPETITIVE = "thank you thank you thank you thank you thank you thank you thank you"
+
+
+def whisper_segment(start, end, text, compression_ratio=1.2, avg_logprob=-0.2, no_speech_prob=0.01):
+    return SimpleNamespace(start=start, end=end, text=text, words=[], avg_logprob=avg_logprob,
+                           compression_ratio=compression_ratio, no_speech_prob=no_speech_prob)
+
+
+# Returns a repetitive segment for the whole clip and clean text for any re-decoded window
+class FakeModel:
+    def __init__(self, clean_at=0.2):
+        self.clean_at = clean_at
+        self.calls = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append((len(audio), options.get('temperature')))
+        seconds = len(audio) / SAMPLE_RATE
+        if options.get('temperature', 0.0) >= self.clean_at:
+            return [whisper_segment(0.0, seconds, "the release is next week")], None
+        return [whisper_segment(0.0, seconds, REPETITIVE, compression_ratio=3.1)], None
+
+
+def test_short_clip_gets_one_retry():
+    audio = [0.0] * (2 * SAMPLE_RATE)  # 2 s, a budget of 1 s is less than the 2 s window
+    model = FakeModel()
+    segments, stats = transcribe_validated(model, audio, {"beam_size": 5})
+    assert [s.text for s in segments] == ["the release is next week"]
+    assert stats["redecoded"] == 1
+    assert stats["retry_seconds"] == 2.0
+    assert model.calls[1] == (2 * SAMPLE_RATE, 0.2)
+
+
+def test_retries_stop_at_budget():
+    audio = [0.0] * (2 * SAMPLE_RATE)
+    model = FakeModel(clean_at=2.0)  # Never clean
+    segments, stats = transcribe_validated(model, audio, {"beam_size": 5})
+    assert segments == []  # The repetitive text is dropped
+    assert stats["unrepaired"] == 1
+    assert len(model.calls) == 2  # The full decode and a single retry
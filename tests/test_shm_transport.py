@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import uuid
+
+import pytest
+
+from shm_transport import ShmTranscriptionClient, ShmTranscriptionServer
+
+
+# Answers with the slot a request was read from instead of transcribing it, no numpy needed
+class EchoServer(ShmTranscriptionServer):
+    def transcribe(self, request):
+        offset = request["slot"] * self.slot_bytes
+        return {"id": request["id"], "transcription": bytes(self.shm.buf[offset:offset + request["length"]]).decode()}
+
+
+@pytest.fixture
+def worker(tmp_path):
+    name = f"soefr-test-{uuid.uuid4().hex[:8]}"
+    server = EchoServer(None, name=name, socket_path=str(tmp_path / "asr.sock"), slots=4, slot_bytes=64,
+                        slots_per_client=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(worker):
+    return ShmTranscriptionClient(name=worker.shm.name, socket_path=worker.server_address, slot_bytes=64)
+
+
+def test_clients_get_disjoint_slots(worker):
+    async def run():
+        a, b = client_for(worker), client_for(worker)
+        await a.connect()
+        await b.connect()
+        slots_a = set(a.free_slots._queue)
+        slots_b = set(b.free_slots._queue)
+        results = await asyncio.gather(*(client.transcribe(f"{client_name}{n}".encode(), "short", 16000)
+                                         for n in range(6) for client_name, client in (("a", a), ("b", b))))
+        a.close()
+        b.close()
+        return slots_a, slots_b, results
+
+    slots_a, slots_b, results = asyncio.run(run())
+    assert len(slots_a) == len(slots_b) == 2
+    assert not slots_a & slots_b
+    assert [r["transcription"] for r in results] == [f"{c}{n}" for n in range(6) for c in "ab"]
+
+
+def test_client_turned_away_when_slots_run_out(worker):
+    async def run():
+        clients = [client_for(worker) for _ in range(3)]
+        await clients[0].connect()
+        await clients[1].connect()
+        with pytest.raises(ConnectionError):
+            await clients[2].connect()
+        assert not clients[2].available()  # Backing off before the next attempt
+        clients[0].close()
+        await asyncio.sleep(0.2)  # The worker takes the closed connection's slots back
+        clients[2].retry_at = 0.0
+        await clients[2].connect()
+        for client in clients:
+            client.close()
+
+    asyncio.run(run())
+
+
+def test_unleased_slot_is_rejected(worker):
+    async def run():
+        client = client_for(worker)
+        await client.connect()
+        leased = set(client.free_slots._queue)
+        other = next(slot for slot in range(4) if slot not in leased)
+        client.free_slots = asyncio.Queue()
+        client.free_slots.put_nowait(other)
+        response = await client.transcribe(b"x", "short", 16000)
+        client.close()
+        return response
+
+    assert "error" in asyncio.run(run())
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from summarizer import SessionSummaries, SummaryEngine
+
+TRANSCRIPT = (
+    "The release of the mobile app is planned for next week. "
+    "The release is blocked on the login bug that some users on older phones still hit. "
+    "We should add a retry to the token refresh before the release."
+)
+
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+# Remote model answering after delay seconds, recording the text of every request
+class FakeGenerate:
+    def __init__(self, delay, content="- remote summary"):
+        self.delay = delay
+        self.content = content
+        self.texts = []
+
+    async def __call__(self, request):
+        self.texts.append(request[-1]["content"])
+        await asyncio.sleep(self.delay)
+        return completion(self.content)
+
+
+def test_local_summary_is_sent_at_the_deadline():
+    async def run():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        engine = SummaryEngine(generate=FakeGenerate(delay=0.3), deadline=0.05)
+        source = await engine.summarize(TRANSCRIPT, [TRANSCRIPT], send)
+        return source, sent
+
+    source, sent = asyncio.run(run())
+    assert source == "remote"
+    assert [(m["source"], m["provisional"]) for m in sent] == [("local", True), ("remote", False)]
+    assert sent[0]["summary"].startswith("- ")
+
+
+def test_local_summary_is_final_when_remote_fails():
+    async def failing(request):
+        return None
+
+    async def run():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        source = await SummaryEngine(generate=failing, deadline=0.05).summarize(TRANSCRIPT, [], send)
+        return source, sent
+
+    source, sent = asyncio.run(run())
+    assert source == "local"
+    assert [(m["source"], m["provisional"]) for m in sent] == [("local", False)]
+
+
+def test_one_summary_per_connection_and_requests_coalesce():
+    generate = FakeGenerate(delay=0.1)
+
+    async def run():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        summaries = SessionSummaries(SummaryEngine(generate=generate, deadline=1))
+        for n in range(10):
+            summaries.request(f"text {n}", [], send)
+            await asyncio.sleep(0.005)
+        while summaries.task is not None and not summaries.task.done():
+            await summaries.task
+        return sent
+
+    sent = asyncio.run(run())
+    # The first request runs, the other nine collapse into one with the latest text
+    assert len(generate.texts) == 2
+    assert generate.texts[0].endswith("text 0") and generate.texts[1].endswith("text 9")
+    assert len(sent) == 2
+
+
+def test_close_cancels_the_summary_in_progress():
+    async def run():
+        async def send(message):
+            pass
+        summaries = SessionSummaries(SummaryEngine(generate=FakeGenerate(delay=10), deadline=10))
+        summaries.request("first", [], send)
+        summaries.request("second", [], send)
+        await asyncio.sleep(0.01)
+        summaries.close()
+        with pytest.raises(asyncio.CancelledError):
+            await summaries.task
+        return summaries.next_request
+
+    assert asyncio.run(run()) is None
+
+
+# End to end against fake_openai.py, slower than the deadline
+def test_provisional_summary_against_slow_fake_openai():
+    pytest.importorskip("flask")
+    openai = pytest.importorskip("openai")
+    from werkzeug.serving import make_server
+    import fake_openai
+
+    fake_openai.FAKE_OPENAI_LATENCY = 1.0
+    fake_openai.FAKE_OPENAI_JITTER = 0.0
+    fake_openai.FAKE_OPENAI_FAIL_RATE = 0.0
+    server = make_server("127.0.0.1", 0, fake_openai.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def run():
+        client = openai.AsyncOpenAI(base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="fake")
+
+        async def generate(request):
+            return await client.chat.completions.create(model="gpt-4", messages=request)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        summaries = SessionSummaries(SummaryEngine(generate=generate, deadline=0.2))
+        for n in range(5):
+            summaries.request(TRANSCRIPT, [TRANSCRIPT], send)
+        first = summaries.task
+        await first
+        return first, summaries, sent
+
+    try:
+        first, summaries, sent = asyncio.run(run())
+    finally:
+        server.shutdown()
+    # A provisional local summary, then the remote one, for the first and the coalesced request
+    assert [(m["source"], m["provisional"]) for m in sent] == [("local", True), ("remote", False)] * 2
+    assert sent[1]["summary"] == fake_openai.FAKE_OPENAI_SUMMARY
+    assert summaries.task is first
@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from transcript_store import TranscriptStore, viewer_token
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TranscriptStore(str(tmp_path / "transcripts.db"))
+
+
+def test_viewer_token_only_subscribes(store):
+    token = store.create_session("s1")
+    viewer = viewer_token(token)
+    assert store.check_viewer("s1", viewer)
+    assert store.check_viewer("s1", token)  # The speaker can watch its own session
+    assert not store.check_token("s1", viewer)  # But a viewer can't resume it or read its history
+    assert not store.check_viewer("s1", None)
+    assert not store.check_viewer("s1", "guess")
+    assert not store.check_viewer("s2", viewer)
+
+
+def test_sessions_from_before_viewer_tokens(tmp_path):
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, token_hash TEXT NOT NULL, created REAL NOT NULL)")
+    db.commit()
+    db.close()
+    store = TranscriptStore(path)
+    token = store.create_session("s1")
+    assert store.check_viewer("s1", viewer_token(token))
+
+
+def test_sequence_numbers_survive_eviction(tmp_path):
+    store = TranscriptStore(str(tmp_path / "transcripts.db"), max_sessions=2)
+    assert store.append("s1", "one")["seq"] == 0
+    store.append("s2", "two")
+    store.append("s3", "three")  # Evicts s1 before its entry is on disk
+    assert "s1" not in store.next_seqs
+    assert store.append("s1", "four")["seq"] == 1
+    store.flush()
+    store.append("s2", "five")  # Evicts s3, whose entries are all written by now
+    store.append("s4", "six")
+    assert len(store.next_seqs) == 2
+    assert store.flush()
+    assert store.append("s3", "seven")["seq"] == 1  # Continued from the disk
+    assert store.flush()
+    entries, _ = store.history("s1")
+    assert [(e["seq"], e["text"]) for e in entries] == [(0, "one"), (1, "four")]
+
+
+def test_expired_sessions_are_purged(tmp_path):
+    store = TranscriptStore(str(tmp_path / "transcripts.db"), session_ttl=60)
+    old = store.create_session("old")
+    store.connection().execute("UPDATE sessions SET created = created - 120 WHERE session_id = 'old'")
+    store.last_sweep = 0.0
+    new = store.create_session("new")  # Creating a session sweeps expired ones
+    assert not store.check_token("old", old)
+    assert not store.check_viewer("old", viewer_token(old))
+    assert store.check_token("new", new)
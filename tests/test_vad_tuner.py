@@ -0,0 +1,77 @@
+from array import array
+
+from vad_tuner import MIN_RESULTS, VAD_LEVELS, VadTuner
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+FRAME_SAMPLES = int(SAMPLE_RATE * FRAME_SECONDS)
+NOISE_RMS = 250
+MURMUR_RMS = 350  # Loud enough for mode 2, but within the energy gate above the noise floor
+SPEECH_RMS = 3000
+
+
+def frame(rms):
+    return array('h', [rms, -rms] * (FRAME_SAMPLES // 2)).tobytes()
+
+
+# Stand-in for webrtcvad.Vad: more aggressive modes need a louder frame, and every call is counted
+class FakeVad:
+    thresholds = {1: 100, 2: 300, 3: 600}
+    calls = 0
+
+    def __init__(self, mode):
+        self.threshold = self.thresholds[mode]
+
+    def is_speech(self, pcm, sample_rate):
+        FakeVad.calls += 1
+        samples = array('h', pcm)
+        return (sum(s * s for s in samples) / len(samples)) ** 0.5 > self.threshold
+
+
+def feed(tuner, rms, frames=100):
+    return sum(tuner.is_speech(frame(rms)) for _ in range(frames))
+
+
+def test_level_rises_in_noise_and_suppression_is_counted():
+    tuner = VadTuner(SAMPLE_RATE, FRAME_SECONDS, autotune=True, vad_factory=FakeVad)
+    assert feed(tuner, NOISE_RMS) == 100  # Mode 1 takes the room noise for speech
+    for _ in range(MIN_RESULTS):
+        level = tuner.record_result(1.0, empty=True)
+    assert level == 1 and VAD_LEVELS[1][0] == 2
+
+    assert feed(tuner, NOISE_RMS) == 0
+    assert feed(tuner, SPEECH_RMS) == 100
+    assert abs(tuner.stats["suppressed_seconds"] - 100 * FRAME_SECONDS) < 1e-9
+    assert abs(tuner.noise_floor - NOISE_RMS) < 1
+
+    # Another round of empty decodes turns on the energy gate above the noise floor
+    for _ in range(MIN_RESULTS):
+        tuner.record_result(1.0, empty=True)
+    assert tuner.level == 2 and tuner.gate_margin == 1.5
+    assert feed(tuner, MURMUR_RMS) == 0
+    assert abs(tuner.stats["gated_seconds"] - 100 * FRAME_SECONDS) < 1e-9
+    assert feed(tuner, SPEECH_RMS) == 100
+
+    # Decodes come back with text again, the tuner steps back towards the baseline
+    for _ in range(MIN_RESULTS):
+        tuner.record_result(1.0, empty=False)
+    assert tuner.level == 1
+    assert tuner.stats["empty_decodes"] == 2 * MIN_RESULTS
+
+
+def test_baseline_sees_every_frame():
+    tuner = VadTuner(SAMPLE_RATE, FRAME_SECONDS, autotune=True, vad_factory=FakeVad)
+    FakeVad.calls = 0
+    feed(tuner, SPEECH_RMS, 10)
+    feed(tuner, NOISE_RMS, 10)
+    assert FakeVad.calls == 40  # Tuned and baseline VAD, on speech frames as well
+
+
+def test_no_baseline_without_autotune():
+    tuner = VadTuner(SAMPLE_RATE, FRAME_SECONDS, autotune=False, vad_factory=FakeVad)
+    FakeVad.calls = 0
+    assert feed(tuner, NOISE_RMS, 10) == 10
+    assert FakeVad.calls == 10
+    for _ in range(MIN_RESULTS * 2):
+        assert tuner.record_result(1.0, empty=True) is None
+    assert tuner.level == 0
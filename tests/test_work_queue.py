@@ -0,0 +1,133 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from work_queue import Broker, QueueTranscriptionClient, SqliteBroker, run_worker
+
+# Delivery guarantees of the SQLite work queue on one box
+LEASE = 0.2  # Short leases so crashes are redelivered quickly
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Worker process for the drain test: transcribes slowly, drains on SIGTERM like work_queue.py
+DRAIN_WORKER = """
+import sys, threading, time
+from work_queue import SqliteBroker, drain_on_signals, run_worker
+def handle(job):
+    print("started", flush=True)
+    time.sleep(1.0)
+    return {"transcription": "drained"}
+stop = threading.Event()
+drain_on_signals(stop)
+run_worker(SqliteBroker(sys.argv[1]), handle, "drain-worker", stop)
+"""
+
+
+@pytest.fixture
+def broker(tmp_path):
+    return SqliteBroker(str(tmp_path / "queue.db"))
+
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+def test_ack(broker):
+    job_id = broker.publish({"audio_size": "short"})
+    job = broker.claim("a", LEASE)
+    assert job is not None and job.id == job_id and job.attempts == 1
+    assert broker.claim("b", LEASE) is None  # A leased job is not handed out twice
+    assert broker.ack(job_id, "a", {"transcription": "hi"})
+    assert broker.collect(job_id) == {"transcription": "hi"}
+    assert broker.stats() == {}  # Collecting removes the job
+
+
+def test_redelivery_after_a_crash(broker):
+    job_id = broker.publish({"audio_size": "short"})
+    broker.claim("crashed", LEASE)  # Never acked, as if the worker died
+    time.sleep(LEASE * 1.5)
+    job = broker.claim("b", LEASE)
+    assert job is not None and job.id == job_id and job.attempts == 2
+    assert not broker.ack(job_id, "crashed", {"transcription": "stale"})
+    assert broker.ack(job_id, "b", {"transcription": "fresh"})
+    assert broker.collect(job_id) == {"transcription": "fresh"}
+
+
+def test_fails_after_max_attempts(broker):
+    job_id = broker.publish({"audio_size": "short"})
+    for _ in range(broker.max_attempts):
+        broker.claim("crashing", LEASE)
+        time.sleep(LEASE * 1.5)
+    broker.claim("b", LEASE)  # Expires the last lease
+    result = broker.collect(job_id)
+    assert result is not None and "error" in result
+
+
+def test_cancel(broker):
+    job_id = broker.publish({"audio_size": "short"})
+    broker.cancel(job_id)
+    assert broker.claim("a", LEASE) is None
+
+    job_id = broker.publish({"audio_size": "short"})
+    broker.claim("a", LEASE)
+    broker.cancel(job_id)
+    assert not broker.ack(job_id, "a", {"transcription": "late"})
+    assert broker.stats() == {}
+
+
+def test_publisher_timeout_removes_the_job(broker):
+    client = QueueTranscriptionClient(broker, result_timeout=0.2)
+    with pytest.raises(TimeoutError):
+        asyncio.run(client.transcribe({"audio_size": "short"}))
+    assert broker.stats() == {}
+
+
+def test_worker_answers_every_job(broker):
+    stop = threading.Event()
+    thread = threading.Thread(target=run_worker, args=(broker, lambda job: {"transcription": job.payload["n"]}),
+                              kwargs={"worker_id": "w", "stop": stop, "lease_seconds": LEASE})
+    thread.start()
+    client = QueueTranscriptionClient(broker, result_timeout=5)
+
+    async def publish_all():
+        return await asyncio.gather(*(client.transcribe({"n": n}) for n in range(20)))
+    try:
+        results = asyncio.run(publish_all())
+    finally:
+        stop.set()
+        thread.join()
+    assert [r["transcription"] for r in results] == list(range(20))
+
+
+def test_expired_jobs_are_swept(tmp_path):
+    broker = SqliteBroker(str(tmp_path / "expiry.db"), job_ttl=0.5)
+    job_id = broker.publish({"audio_size": "short"})
+    broker.claim("a", LEASE)
+    broker.ack(job_id, "a", {"transcription": "uncollected"})  # The publisher restarted
+    broker.publish({"audio_size": "short"})  # Queued, but its publisher has gone too
+    time.sleep(0.6)
+    broker.last_sweep = 0.0
+    broker.claim("b", LEASE)
+    assert broker.stats() == {}
+
+
+def test_sigterm_drains_the_worker(tmp_path):
+    path = str(tmp_path / "drain.db")
+    broker = SqliteBroker(path)
+    job_id = broker.publish({"audio_size": "short"})
+    worker = subprocess.Popen([sys.executable, "-c", DRAIN_WORKER, path], stdout=subprocess.PIPE, text=True,
+                              cwd=REPO_ROOT)
+    try:
+        assert worker.stdout.readline().strip() == "started"
+        worker.send_signal(signal.SIGTERM)
+        assert worker.wait(timeout=10) == 0  # The in-flight job finished first
+    finally:
+        worker.kill()
+        worker.stdout.close()
+    assert broker.collect(job_id) == {"transcription": "drained"}
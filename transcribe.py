@@ -1,101 +1,79 @@
 from flask import Flask, request, jsonify
-from faster_whisper import WhisperModel
+from decode_profiles import resolve_profile
+from segment_validation import transcribe_validated
+from model_registry import registry, backend_settings, pool_key
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
+import logging
+import os
 import time
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-model_size = "large-v3"
-
-# Run on GPU with FP16
-print("Loading Faster Whisper Model")
-audio_model = WhisperModel(model_size, device="cuda", compute_type="int8")
-print("Model loaded")
-
-def is_transcription_valid(transcription, audio_size):
-    print(f"Checking if transcription is valid")
-    # Split transcription into words or phrases
-    words = transcription.split()
-
-    # Re-transcribe if too many words
-    if len(words) > 20:
-        print(f"Too many words")
-        return False
-
-    # Count occurrences of each word
-    word_count = {}
-    for word in words:
-        if word in word_count:
-            word_count[word] += 1
-        else:
-            word_count[word] = 1
-
-    # Check for any word repeated more than three times
-    for word, count in word_count.items():
-        if count > 5:
-            print(f"Word '{word}' repeated {count} times, which is too many")
-            return False
-
-    return True  # No issues found with repetition
+# TRANSCRIBE_DEVICE=cpu runs int8 inference across CPU_REPLICAS replicas with CPU_THREADS threads each
+device, compute_type, replicas, model_options = backend_settings()
+model_size = os.environ.get("TRANSCRIBE_MODEL", "large-v3" if device == "cuda" else "small")
+# The models are loaded once per process by the shared registry, see start functions below
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
-    audio_file_path = request.json['audio_file_path']
-    audio_size = request.json['audio_size']
-
+    pool = registry.get_pool(model_size, device, compute_type, replicas, **model_options)  # Waits if still loading
+    try:
+        profile, decode_options = resolve_profile(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Borrow a free replica, requests beyond the replica count wait for one. A single replica is shared.
+    with pool.acquire() as audio_model:
+        return run_transcription(audio_model, request.json['audio_file_path'], request.json['audio_size'],
+                                 profile, decode_options)
+
+def run_transcription(audio_model, audio_file_path, audio_size, profile, decode_options):
     transcription = ""
     max_retries = 3  # Set the maximum number of retries
     retries = 0
     last_exception = None  # Define a variable to store the last exception outside of the loop
-    print("Attempting to transcribe " + str(audio_file_path))
+    logger.debug("Attempting to transcribe %s", audio_file_path, extra={"category": "transcription"})
     while retries < max_retries:
         try:
-            print(f"Transcribing {audio_size} audio")
+            logger.debug("Transcribing %s audio with %s profile", audio_size, profile, extra={"category": "transcription"})
             compute_start_time = time.time()
-            
-            # Transcribe the audio file with voice activity
-            segments, info = audio_model.transcribe(
-                audio_file_path, beam_size=5, vad_filter=True, word_timestamps=True, temperature=0)
-            # print("Detected language '%s' with probability %f" %
-            #       (info.language, info.language_probability))
 
-            # Transcription process
+            # Transcribe the audio file, re-decoding only the segments that look like hallucinations
+            segments, retry_stats = transcribe_validated(audio_model, audio_file_path, decode_options)
 
+            # Transcription process, segment and word dumps are skipped entirely unless debugging
+            dump_segments = logger.isEnabledFor(logging.DEBUG)
             for segment in segments:
-                print("[%.2fs -> %.2fs] %s" %
-                      (segment.start, segment.end, segment.text))
-                for word in segment.words:
-                    print("[%.2fs -> %.2fs] %s" % (word.start, word.end, word.word))
+                if dump_segments:
+                    logger.debug("[%.2fs -> %.2fs] %s", segment.start, segment.end, segment.text,
+                                 extra={"category": "segment"})
+                    for word in segment.words:
+                        logger.debug("[%.2fs -> %.2fs] %s", word.start, word.end, word.word,
+                                     extra={"category": "segment"})
                 transcription += segment.text
             elapsed_time = time.time() - compute_start_time
 
-            # Print compute time
-            if elapsed_time < 1:
-                # Convert to milliseconds and print with up to 3 significant digits.
-                print(f"Transcription took {elapsed_time * 1000:.3g} ms")
-            else:
-                # In seconds
-                print(f"Transcription took {elapsed_time:.3g} secs")
+            # Log compute time
+            logger.info("Transcription took %.3g secs", elapsed_time,
+                        extra={"category": "transcription", "audio_size": audio_size, "profile": profile,
+                               "compute_secs": round(elapsed_time, 4),
+                               "audio_secs": round(retry_stats.get("audio_seconds", 0), 2)})
+            if retry_stats["redecoded"] or retry_stats["unrepaired"] or retry_stats["dropped"]:
+                logger.info("Segment validation: %s", retry_stats, extra={"category": "validation"})
 
-            # Check if the transcription is valid
-            if is_transcription_valid(transcription, audio_size):
-                return jsonify({"transcription": transcription})
-            else:
-                print("Invalid transcription detected, retrying...")
-                transcription = ""  # Reset transcription for a retry
-                retries += 1
-                # Adjust model parameters for retry or use a different strategy
-                continue
+            return jsonify({"transcription": transcription})
 
         except (RuntimeError, FileNotFoundError) as e:
-            print(f"Error during transcription: {e}")
+            logger.warning("Error during transcription: %s", e, extra={"category": "transcription"})
             last_exception = e  # Store the exception
             retries += 1
-            print(f"Retrying transcription ({retries}/{max_retries})...")
+            logger.info("Retrying transcription (%s/%s)", retries, max_retries, extra={"category": "transcription"})
             time.sleep(1)  # Sleep before retrying
 
     # If retries have been exhausted, return an error response
     if last_exception:
-        print("Maximum retries reached. Transcription failed.")
+        logger.error("Maximum retries reached. Transcription failed.", extra={"category": "transcription"})
         return jsonify({
             "error": "Maximum retries reached. An error occurred during transcription",
             "details": str(last_exception)
@@ -105,8 +83,16 @@ def transcribe_audio():
             "error": "Unknown error occurred during transcription"
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    return registry.ready_response(*pool_key(model_size, device, compute_type, replicas))
+
 def start_transcribe():
-    app.run(port=8001, use_reloader=False)
+    registry.load_in_background(model_size, device, compute_type, replicas, **model_options)
+    app.run(port=8001, use_reloader=False, threaded=True)
 
 if __name__ == '__main__':
-    app.run(port=8001)
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 starts and stops the sampling profiler
+    registry.load_in_background(model_size, device, compute_type, replicas, **model_options)
+    app.run(port=8001, threaded=True)
@@ -1,69 +1,114 @@
-from flask import Flask, request, jsonify
-from faster_whisper import WhisperModel
+from flask import Flask, Response, request, jsonify
+from faster_whisper.audio import decode_audio
+from decode_profiles import resolve_profile
+from long_chunking import LONG_FILE_SECONDS, transcribe_chunked, join_text
+from segment_validation import transcribe_validated, SAMPLE_RATE
+from model_registry import registry
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
+import json
+import logging
+import queue
+import threading
 import time
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 model_size = "large-v3"
+device = "cuda"
+compute_type = "int8"
+# The model is loaded once per process by the shared registry, see start functions below
 
-# Run on GPU with FP16
-print("Loading Faster Whisper Model")
-audio_model = WhisperModel(model_size, device="cuda", compute_type="int8")
-print("Model loaded")
+
+# Run the chunked transcription on a background thread and stream progress as NDJSON lines,
+# ending with a line holding the full transcription
+def stream_chunked(audio_model, audio, decode_options):
+    updates = queue.Queue()
+
+    def on_progress(done, total, index, segments):
+        updates.put({"progress": done / total, "chunk": index, "chunks": total, "text": join_text(segments)})
+
+    def run():
+        try:
+            segments, stats = transcribe_chunked(audio_model, audio, decode_options, on_progress=on_progress)
+            logger.info("Chunked transcription: %s", stats, extra={"category": "validation"})
+            updates.put({"transcription": join_text(segments)})
+        except Exception as e:
+            logger.exception("Error during transcription: %s", e, extra={"category": "transcription"})
+            updates.put({"error": "An error occurred during transcription", "details": str(e)})
+        updates.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while (update := updates.get()) is not None:
+        yield json.dumps(update) + "\n"
 
 
 @app.route('/transcribelong', methods=['POST'])
 def transcribe_audio():
+    audio_model = registry.get(model_size, device, compute_type)  # Waits if the model is still loading
     audio_file_path = request.json['audio_file_path']
     audio_size = request.json['audio_size']
+    try:
+        profile, decode_options = resolve_profile(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stream = request.json.get('stream', False)  # Stream per-chunk progress instead of one response
 
     transcription = ""
     max_retries = 3  # Set the maximum number of retries
     retries = 0
     last_exception = None  # Define a variable to store the last exception outside of the loop
-    print("Attempting to transcribe " + str(audio_file_path))
+    logger.debug("Attempting to transcribe %s", audio_file_path, extra={"category": "transcription"})
     while retries < max_retries:
         try:
-            # Transcribe the audio file with voice activity
-            segments, info = audio_model.transcribe(
-                audio_file_path, beam_size=5, vad_filter=True, word_timestamps=True, temperature=0)
-            # print("Detected language '%s' with probability %f" %
-            #       (info.language, info.language_probability))
-
-            # Transcription process
-            print(f"Transcribing {audio_size} audio")
+            logger.debug("Transcribing %s audio with %s profile", audio_size, profile, extra={"category": "transcription"})
             compute_start_time = time.time()
+
+            audio = decode_audio(audio_file_path, sampling_rate=SAMPLE_RATE)
+            if stream:
+                return Response(stream_chunked(audio_model, audio, decode_options), mimetype='application/x-ndjson')
+
+            if len(audio) > LONG_FILE_SECONDS * SAMPLE_RATE:
+                # Long recordings are split at silences and the chunks decoded in parallel
+                segments, retry_stats = transcribe_chunked(audio_model, audio, decode_options)
+                logger.info("Chunked transcription: %s", retry_stats, extra={"category": "validation"})
+            else:
+                # Transcribe the audio, re-decoding only the segments that look like hallucinations
+                segments, retry_stats = transcribe_validated(audio_model, audio, decode_options)
+
+            # Transcription process, segment and word dumps are skipped entirely unless debugging
+            dump_segments = logger.isEnabledFor(logging.DEBUG)
             for segment in segments:
-                print("[%.2fs -> %.2fs] %s" %
-                      (segment.start, segment.end, segment.text))
-                for word in segment.words:
-                    print("[%.2fs -> %.2fs] %s" % (word.start, word.end, word.word))
+                if dump_segments:
+                    logger.debug("[%.2fs -> %.2fs] %s", segment.start, segment.end, segment.text,
+                                 extra={"category": "segment"})
+                    for word in segment.words:
+                        logger.debug("[%.2fs -> %.2fs] %s", word.start, word.end, word.word,
+                                     extra={"category": "segment"})
                 transcription += segment.text
             elapsed_time = time.time() - compute_start_time
 
-            # Print compute time
-            if elapsed_time < 1:
-                # Convert to milliseconds and print with up to 3 significant digits.
-                print(f"Transcription took {elapsed_time * 1000:.3g} ms")
-            else:
-                # In seconds
-                print(f"Transcription took {elapsed_time:.3g} secs")
+            # Log compute time
+            logger.info("Transcription took %.3g secs", elapsed_time,
+                        extra={"category": "transcription", "audio_size": audio_size, "profile": profile,
+                               "compute_secs": round(elapsed_time, 4),
+                               "audio_secs": round(retry_stats.get("audio_seconds", 0), 2)})
+            if retry_stats.get("redecoded") or retry_stats.get("unrepaired") or retry_stats.get("dropped"):
+                logger.info("Segment validation: %s", retry_stats, extra={"category": "validation"})
 
-            # return jsonify({"transcription": transcription})
-            return jsonify({
-                "transcription": transcription
-            })
+            return jsonify({"transcription": transcription})
 
         except (RuntimeError, FileNotFoundError) as e:
-            print(f"Error during transcription: {e}")
+            logger.warning("Error during transcription: %s", e, extra={"category": "transcription"})
             last_exception = e  # Store the exception
             retries += 1
-            print(f"Retrying transcription ({retries}/{max_retries})...")
+            logger.info("Retrying transcription (%s/%s)", retries, max_retries, extra={"category": "transcription"})
             time.sleep(1)  # Sleep before retrying
 
     # If retries have been exhausted, return an error response
     if last_exception:
-        print("Maximum retries reached. Transcription failed.")
+        logger.error("Maximum retries reached. Transcription failed.", extra={"category": "transcription"})
         return jsonify({
             "error": "Maximum retries reached. An error occurred during transcription",
             "details": str(last_exception)
@@ -73,8 +118,16 @@ def transcribe_audio():
             "error": "Unknown error occurred during transcription"
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    return registry.ready_response(model_size, device, compute_type)
+
 def start_transcribe_long():
+    registry.load_in_background(model_size, device, compute_type)
     app.run(port=8002, use_reloader=False)
 
 if __name__ == '__main__':
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 starts and stops the sampling profiler
+    registry.load_in_background(model_size, device, compute_type)
     app.run(port=8002)
@@ -1,99 +1,80 @@
 from flask import Flask, request, jsonify
+from decode_profiles import resolve_profile
+from segment_validation import filter_s2t_segments
+from model_registry import s2t_registry, backend_settings, pool_key
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
+import logging
+import os
 import time
-import whisper_s2t
 
-WHISPER_MODEL = "medium.en"
+# TRANSCRIBE_DEVICE=cpu runs int8 inference across CPU_REPLICAS replicas with CPU_THREADS threads each
+device, compute_type, replicas, model_options = backend_settings()
+WHISPER_MODEL = os.environ.get("TRANSCRIBE_MODEL", "medium.en" if device == "cuda" else "small.en")
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-model = whisper_s2t.load_model(WHISPER_MODEL, device="cuda", compute_type="int8", asr_options={'word_timestamps': True})
-print(f"{WHISPER_MODEL} loaded")
-
-def is_transcription_valid(transcription, audio_size):
-    words = transcription.split()
-    if audio_size == 'short':
-        size = 3
-    else:
-        size = 15
-
-    # Re-transcribe if too many words
-    if len(words) > size*7:
-        print(f"Too many words")
-        return False
-
-    # Count occurrences of each word
-    word_count = {}
-    for word in words:
-        if word in word_count:
-            word_count[word] += 1
-        else:
-            word_count[word] = 1
-
-    # Hallucination check: Checks for any word repeated too many times
-    for word, count in word_count.items():
-        if count > size*2:
-            print(f"Word '{word}' repeated {count} times, which is too many")
-            return False
-
-    return True  # No issues found with repetition
+model_options['asr_options'] = {'word_timestamps': True}
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
-    audio_file_path = [request.json['audio_file_path']]
-    audio_size = request.json['audio_size']
+    pool = s2t_registry.get_pool(WHISPER_MODEL, device, compute_type, replicas, **model_options)  # Waits if still loading
+    try:
+        profile, decode_options = resolve_profile(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Borrow a free replica, requests beyond the replica count wait for one. A single replica is shared.
+    with pool.acquire() as model:
+        return run_transcription(model, [request.json['audio_file_path']], request.json['audio_size'],
+                                 profile, decode_options)
+
+# Beam size and word timestamps are fixed when WhisperS2T loads, so only the VAD choice applies per request
+def run_transcription(model, audio_file_path, audio_size, profile, decode_options):
     transcription = ""
     max_retries = 3  # Set the maximum number of retries
     retries = 0
     last_exception = None  # Define a variable to store the last exception outside of the loop
-    print("Attempting to transcribe " + str(audio_file_path))
+    logger.debug("Attempting to transcribe %s", audio_file_path, extra={"category": "transcription"})
     while retries < max_retries:
         try:
             lang_codes = ['en']
             tasks = ['transcribe']
             initial_prompts = [None]
 
-            print(f"Transcribing {audio_size} audio")
+            logger.debug("Transcribing %s audio with %s profile", audio_size, profile, extra={"category": "transcription"})
             compute_start_time = time.time()
-            out = model.transcribe_with_vad(audio_file_path,
-                                            lang_codes=lang_codes,
-                                            tasks=tasks,
-                                            initial_prompts=initial_prompts,
-                                            batch_size=24)
-
-            transcription = out[0][0]['text']
-            print(transcription)
-            # Transcription process
+            transcribe = model.transcribe_with_vad if decode_options['vad_filter'] else model.transcribe
+            out = transcribe(audio_file_path,
+                             lang_codes=lang_codes,
+                             tasks=tasks,
+                             initial_prompts=initial_prompts,
+                             batch_size=24)
+
+            # Drop segments flagged by the per-segment hallucination checks instead of re-running the file
+            segments = filter_s2t_segments(out[0])
+            transcription = " ".join(segment['text'].strip() for segment in segments)
+            logger.debug("Transcription: %s", transcription, extra={"category": "transcription"})
 
             elapsed_time = time.time() - compute_start_time
 
-            # Print compute time
-            if elapsed_time < 1:
-                # Convert to milliseconds and print with up to 3 significant digits.
-                print(f"Transcription took {elapsed_time * 1000:.3g} ms")
-            else:
-                # In seconds
-                print(f"Transcription took {elapsed_time:.3g} secs")
-
-            # Check if the transcription is valid
-            if is_transcription_valid(transcription, audio_size):
-                return jsonify({"transcription": transcription})
-            else:
-                print("Invalid transcription detected, retrying...")
-                transcription = ""  # Reset transcription for a retry
-                retries += 1
-                # Adjust model parameters for retry or use a different strategy
-                continue
+            # Log compute time
+            logger.info("Transcription took %.3g secs", elapsed_time,
+                        extra={"category": "transcription", "audio_size": audio_size, "profile": profile,
+                               "compute_secs": round(elapsed_time, 4)})
+
+            return jsonify({"transcription": transcription})
 
         except (RuntimeError, FileNotFoundError) as e:
-            print(f"Error during transcription: {e}")
+            logger.warning("Error during transcription: %s", e, extra={"category": "transcription"})
             last_exception = e  # Store the exception
             retries += 1
-            print(f"Retrying transcription ({retries}/{max_retries})...")
+            logger.info("Retrying transcription (%s/%s)", retries, max_retries, extra={"category": "transcription"})
             time.sleep(1)  # Sleep before retrying
 
     # If retries have been exhausted, return an error response
     if last_exception:
-        print("Maximum retries reached. Transcription failed.")
+        logger.error("Maximum retries reached. Transcription failed.", extra={"category": "transcription"})
         return jsonify({
             "error": "Maximum retries reached. An error occurred during transcription",
             "details": str(last_exception)
@@ -103,8 +84,20 @@ def transcribe_audio():
             "error": "Unknown error occurred during transcription"
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    return s2t_registry.ready_response(*pool_key(WHISPER_MODEL, device, compute_type, replicas))
+
+# Start loading the model replicas, /ready reports 503 until they are up
+def load_model():
+    return s2t_registry.load_in_background(WHISPER_MODEL, device, compute_type, replicas, **model_options)
+
 def start_transcribe():
-    app.run(port=8001, use_reloader=False)
+    load_model()
+    app.run(port=8001, use_reloader=False, threaded=True)
 
 if __name__ == '__main__':
-    app.run(port=8001)
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 starts and stops the sampling profiler
+    load_model()
+    app.run(port=8001, threaded=True)
@@ -1,99 +1,76 @@
 from flask import Flask, request, jsonify
-from faster_whisper import WhisperModel
+from decode_profiles import resolve_profile
+from segment_validation import transcribe_validated
+from model_registry import registry
+from shm_transport import start_shm_server
+from structured_logging import setup_logging
+from diagnostics import install_profiler_signal
+import logging
 import time
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 model_size = "large-v3"
-
-# Run on GPU with FP16
-print("Loading Faster Whisper Model")
-audio_model = WhisperModel(model_size, device="cuda", compute_type="int8")
-print("Model loaded")
-
-def is_transcription_valid(transcription, audio_size):
-    print(f"Checking if transcription is valid")
-    # Split transcription into words or phrases
-    words = transcription.split()
-
-    # Re-transcribe if too many words
-    if len(words) > 20:
-        print(f"Too many words")
-        return False
-
-    # Count occurrences of each word
-    word_count = {}
-    for word in words:
-        if word in word_count:
-            word_count[word] += 1
-        else:
-            word_count[word] = 1
-
-    # Check for any word repeated more than three times
-    for word, count in word_count.items():
-        if count > 5:
-            print(f"Word '{word}' repeated {count} times, which is too many")
-            return False
-
-    return True  # No issues found with repetition
+device = "cuda"
+compute_type = "int8"
+# The model is loaded once per process by the shared registry, see start functions below
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
+    audio_model = registry.get(model_size, device, compute_type)  # Waits if the model is still loading
     audio_file_path = request.json['audio_file_path']
     audio_size = request.json['audio_size']
+    try:
+        profile, decode_options = resolve_profile(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     transcription = ""
     max_retries = 3  # Set the maximum number of retries
     retries = 0
     last_exception = None  # Define a variable to store the last exception outside of the loop
-    print("Attempting to transcribe " + str(audio_file_path))
+    logger.debug("Attempting to transcribe %s", audio_file_path, extra={"category": "transcription"})
     while retries < max_retries:
         try:
-            # Transcribe the audio file with voice activity
-            segments, info = audio_model.transcribe(
-                audio_file_path, beam_size=5, vad_filter=True, word_timestamps=True, temperature=0)
-            # print("Detected language '%s' with probability %f" %
-            #       (info.language, info.language_probability))
-
-            # Transcription process
-            print(f"Transcribing {audio_size} audio")
+            logger.debug("Transcribing %s audio with %s profile", audio_size, profile, extra={"category": "transcription"})
             compute_start_time = time.time()
+
+            # Transcribe the audio file, re-decoding only the segments that look like hallucinations
+            segments, retry_stats = transcribe_validated(audio_model, audio_file_path, decode_options)
+
+            # Transcription process, segment and word dumps are skipped entirely unless debugging
+            dump_segments = logger.isEnabledFor(logging.DEBUG)
             for segment in segments:
-                print("[%.2fs -> %.2fs] %s" %
-                      (segment.start, segment.end, segment.text))
-                for word in segment.words:
-                    print("[%.2fs -> %.2fs] %s" % (word.start, word.end, word.word))
+                if dump_segments:
+                    logger.debug("[%.2fs -> %.2fs] %s", segment.start, segment.end, segment.text,
+                                 extra={"category": "segment"})
+                    for word in segment.words:
+                        logger.debug("[%.2fs -> %.2fs] %s", word.start, word.end, word.word,
+                                     extra={"category": "segment"})
                 transcription += segment.text
             elapsed_time = time.time() - compute_start_time
 
-            # Print compute time
-            if elapsed_time < 1:
-                # Convert to milliseconds and print with up to 3 significant digits.
-                print(f"Transcription took {elapsed_time * 1000:.3g} ms")
-            else:
-                # In seconds
-                print(f"Transcription took {elapsed_time:.3g} secs")
+            # Log compute time
+            logger.info("Transcription took %.3g secs", elapsed_time,
+                        extra={"category": "transcription", "audio_size": audio_size, "profile": profile,
+                               "compute_secs": round(elapsed_time, 4),
+                               "audio_secs": round(retry_stats.get("audio_seconds", 0), 2)})
+            if retry_stats["redecoded"] or retry_stats["unrepaired"] or retry_stats["dropped"]:
+                logger.info("Segment validation: %s", retry_stats, extra={"category": "validation"})
 
-            # Check if the transcription is valid
-            if is_transcription_valid(transcription, audio_size):
-                return jsonify({"transcription": transcription})
-            else:
-                print("Invalid transcription detected, retrying...")
-                transcription = ""  # Reset transcription for a retry
-                retries += 1
-                # Adjust model parameters for retry or use a different strategy
-                continue
+            return jsonify({"transcription": transcription})
 
         except (RuntimeError, FileNotFoundError) as e:
-            print(f"Error during transcription: {e}")
+            logger.warning("Error during transcription: %s", e, extra={"category": "transcription"})
             last_exception = e  # Store the exception
             retries += 1
-            print(f"Retrying transcription ({retries}/{max_retries})...")
+            logger.info("Retrying transcription (%s/%s)", retries, max_retries, extra={"category": "transcription"})
             time.sleep(1)  # Sleep before retrying
 
     # If retries have been exhausted, return an error response
     if last_exception:
-        print("Maximum retries reached. Transcription failed.")
+        logger.error("Maximum retries reached. Transcription failed.", extra={"category": "transcription"})
         return jsonify({
             "error": "Maximum retries reached. An error occurred during transcription",
             "details": str(last_exception)
@@ -103,8 +80,34 @@ def transcribe_audio():
             "error": "Unknown error occurred during transcription"
         }), 500
 
-def start_transcribe():
+@app.route('/ready', methods=['GET'])
+def ready():
+    return registry.ready_response(model_size, device, compute_type)
+
+# Transcribe audio handed over by the shared-memory transport, answering like /transcribe
+def transcribe_array(audio, payload):
+    audio_model = registry.get(model_size, device, compute_type)
+    profile, decode_options = resolve_profile(payload)
+    compute_start_time = time.time()
+    segments, retry_stats = transcribe_validated(audio_model, audio, decode_options)
+    transcription = "".join(segment.text for segment in segments)
+    elapsed_time = time.time() - compute_start_time
+    logger.info("Transcribed %s audio from shared memory in %.3g secs", payload['audio_size'], elapsed_time,
+                extra={"category": "transcription", "audio_size": payload['audio_size'], "profile": profile,
+                       "compute_secs": round(elapsed_time, 4), "audio_secs": round(retry_stats["audio_seconds"], 2)})
+    return {"transcription": transcription}
+
+# Serve co-located WebSocket servers through shared memory, alongside the HTTP endpoint
+def start_shm_worker():
+    registry.load_in_background(model_size, device, compute_type)
+    start_shm_server(transcribe_array)
+
+def start_transcribe_short():
+    registry.load_in_background(model_size, device, compute_type)
     app.run(port=8001, use_reloader=False)
 
 if __name__ == '__main__':
+    setup_logging()
+    install_profiler_signal()  # SIGUSR2 starts and stops the sampling profiler
+    registry.load_in_background(model_size, device, compute_type)
     app.run(port=8001)
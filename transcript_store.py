@@ -0,0 +1,278 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Session transcript store: a bounded in-memory tail per session, with every entry written behind
+# to SQLite (WAL) so long meetings don't grow memory and history outlives the connection
+TRANSCRIPT_DB_PATH = os.environ.get("TRANSCRIPT_DB_PATH", "transcripts.db")
+TAIL_SIZE = 50  # Most recent entries kept in memory per session
+MAX_SESSIONS_IN_MEMORY = 1000  # Tails of idle sessions are dropped beyond this, they stay on disk
+FLUSH_INTERVAL = 0.5  # Seconds between batched writes to disk
+HISTORY_PAGE_SIZE = 50  # Default page size for history requests
+MAX_PAGE_SIZE = 500
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(30 * 24 * 3600)))  # Seconds a session's tokens stay valid
+SESSION_SWEEP_INTERVAL = 3600  # Seconds between purges of expired sessions
+COLUMNS = ("session_id", "seq", "ts", "audio_size", "text")
+
+logger = logging.getLogger(__name__)
+
+
+def to_entries(rows):
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Token the speaker hands to observers, derived from the resume token so a resumed session can send
+# it again. It lets them subscribe to the session, but not continue it or read its history.
+def viewer_token(token):
+    return hmac.new(token.encode(), b"viewer", hashlib.sha256).hexdigest()
+
+
+class TranscriptStore:
+    def __init__(self, path=TRANSCRIPT_DB_PATH, tail_size=TAIL_SIZE, max_sessions=MAX_SESSIONS_IN_MEMORY,
+                 session_ttl=SESSION_TTL):
+        self.path = path
+        self.tail_size = tail_size
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.last_sweep = 0.0
+        self.tails = {}  # session id -> deque of recent entries, in insertion (LRU) order
+        self.next_seqs = {}  # session id -> next sequence number, for the sessions with a tail
+        # Evicted sessions whose last entries may not be on disk yet: session id -> (next sequence
+        # number, entries queued at eviction). Until they are written, the disk can't be asked.
+        self.evicted = {}
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()  # Entries waiting to be written to disk
+        self.flushed = threading.Condition()
+        self.written = 0  # Entries written so far, for flush() to wait on
+        self.queued = 0
+        self.local = threading.local()
+        self.fts = self.init_db()
+        self.writer = threading.Thread(target=self.write_loop, name="transcript-store", daemon=True)
+        self.writer.start()
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    # Create the tables, returns whether full-text search is available
+    def init_db(self):
+        db = self.connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS transcripts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            audio_size TEXT,
+            text TEXT NOT NULL,
+            UNIQUE (session_id, seq))""")
+        db.execute("CREATE INDEX IF NOT EXISTS transcripts_session_ts ON transcripts (session_id, ts)")
+        # Resume and viewer tokens, stored hashed. The session id is public (subscribers see it), the
+        # resume token is what lets a client continue a session or read its history, the viewer
+        # token only lets observers subscribe.
+        db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            token_hash TEXT NOT NULL,
+            created REAL NOT NULL,
+            viewer_hash TEXT)""")
+        try:
+            db.execute("ALTER TABLE sessions ADD COLUMN viewer_hash TEXT")  # Databases from before viewer tokens
+        except sqlite3.OperationalError:
+            pass  # Already there
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5("
+                       "text, content='transcripts', content_rowid='id')")
+            db.execute("CREATE TRIGGER IF NOT EXISTS transcripts_fts_insert AFTER INSERT ON transcripts BEGIN "
+                       "INSERT INTO transcripts_fts (rowid, text) VALUES (new.id, new.text); END")
+            return True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite built without FTS5, transcript search falls back to LIKE")
+            return False
+
+    # Register a new session, returns its resume token. Only the speaker should ever be sent it.
+    def create_session(self, session_id):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        if now - self.last_sweep >= SESSION_SWEEP_INTERVAL:
+            self.last_sweep = now
+            self.purge_sessions(now - self.session_ttl)
+        self.connection().execute(
+            "INSERT INTO sessions (session_id, token_hash, created, viewer_hash) VALUES (?, ?, ?, ?)",
+            (session_id, hash_token(token), now, hash_token(viewer_token(token))))
+        return token
+
+    # Forget the tokens of sessions created before cutoff, they can no longer be resumed or watched.
+    # Their transcripts stay, and remain searchable.
+    def purge_sessions(self, cutoff):
+        purged = self.connection().execute("DELETE FROM sessions WHERE created < ?", (cutoff,)).rowcount
+        if purged:
+            logger.info("Purged %s expired sessions", purged)
+        return purged
+
+    # Whether token is the resume token of session_id
+    def check_token(self, session_id, token):
+        if not isinstance(token, str):
+            return False
+        row = self.connection().execute("SELECT token_hash FROM sessions WHERE session_id = ?",
+                                        (session_id,)).fetchone()
+        return row is not None and hmac.compare_digest(row[0], hash_token(token))
+
+    # Whether token may subscribe to session_id: its viewer token, or the resume token itself
+    def check_viewer(self, session_id, token):
+        if not isinstance(token, str):
+            return False
+        row = self.connection().execute("SELECT token_hash, viewer_hash FROM sessions WHERE session_id = ?",
+                                        (session_id,)).fetchone()
+        if row is None:
+            return False
+        token_hash = hash_token(token)
+        return hmac.compare_digest(row[0], token_hash) or (row[1] is not None and hmac.compare_digest(row[1], token_hash))
+
+    def next_seq(self, session_id):
+        if session_id in self.evicted:
+            self.next_seqs[session_id] = self.evicted.pop(session_id)[0]
+        elif session_id not in self.next_seqs:
+            row = self.connection().execute(
+                "SELECT MAX(seq) FROM transcripts WHERE session_id = ?", (session_id,)).fetchone()
+            self.next_seqs[session_id] = 0 if row[0] is None else row[0] + 1
+        return self.next_seqs[session_id]
+
+    # Add a transcript to a session, returns the stored entry. Cheap enough to call on the event loop.
+    def append(self, session_id, text, audio_size=None):
+        with self.lock:
+            seq = self.next_seq(session_id)
+            self.next_seqs[session_id] = seq + 1
+            entry = {"session_id": session_id, "seq": seq, "ts": time.time(), "audio_size": audio_size, "text": text}
+            tail = self.tails.pop(session_id, None) or deque(maxlen=self.tail_size)
+            tail.append(entry)
+            self.tails[session_id] = tail  # Re-insert to mark the session as recently used
+            while len(self.tails) > self.max_sessions:
+                evicted = next(iter(self.tails))
+                del self.tails[evicted]
+                self.evicted[evicted] = (self.next_seqs.pop(evicted), self.queued + 1)
+            self.queued += 1
+        self.pending.put(entry)
+        return entry
+
+    # Drain pending entries to disk in batches, one transaction per batch
+    def write_loop(self):
+        db = self.connection()
+        while True:
+            batch = [self.pending.get()]
+            time.sleep(FLUSH_INTERVAL)
+            while not self.pending.empty() and len(batch) < 1000:
+                batch.append(self.pending.get_nowait())
+            try:
+                db.execute("BEGIN")
+                db.executemany("INSERT OR IGNORE INTO transcripts (session_id, seq, ts, audio_size, text) "
+                               "VALUES (:session_id, :seq, :ts, :audio_size, :text)", batch)
+                db.execute("COMMIT")
+            except sqlite3.Error as e:
+                db.execute("ROLLBACK")
+                logger.error("Failed to write %s transcripts: %s", len(batch), e)
+            with self.flushed:
+                self.written += len(batch)
+                self.flushed.notify_all()
+            with self.lock:
+                # Sessions whose entries are all on disk can look up their next sequence number there
+                self.evicted = {session_id: value for session_id, value in self.evicted.items()
+                                if value[1] > self.written}
+
+    # Wait until everything appended so far is on disk
+    def flush(self, timeout=10):
+        with self.lock:
+            target = self.queued
+        with self.flushed:
+            return self.flushed.wait_for(lambda: self.written >= target, timeout)
+
+    # A page of a session's history in sequence order. Pass after_seq to page forwards (a
+    # reconnecting client catching up) or before_seq to page backwards. Returns entries and
+    # the cursor for the next page, None when there is nothing more.
+    def history(self, session_id, after_seq=None, before_seq=None, limit=HISTORY_PAGE_SIZE):
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with self.lock:
+            tail = list(self.tails.get(session_id, ()))
+        # Serve from memory when the whole page is inside the tail
+        entries = None
+        complete = bool(tail) and tail[0]["seq"] == 0  # The whole session still fits in the tail
+        if before_seq is not None:
+            older = [e for e in tail if e["seq"] < before_seq]
+            if complete or len(older) > limit:
+                entries = older[-(limit + 1):][::-1]
+        elif tail and (complete or (after_seq is not None and after_seq >= tail[0]["seq"] - 1)):
+            start = -1 if after_seq is None else after_seq
+            entries = [e for e in tail if e["seq"] > start][:limit + 1]
+        if entries is None:
+            self.flush()
+            if before_seq is not None:
+                rows = self.connection().execute(
+                    "SELECT session_id, seq, ts, audio_size, text FROM transcripts "
+                    "WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                    (session_id, before_seq, limit + 1)).fetchall()
+            else:
+                rows = self.connection().execute(
+                    "SELECT session_id, seq, ts, audio_size, text FROM transcripts "
+                    "WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (session_id, -1 if after_seq is None else after_seq, limit + 1)).fetchall()
+            entries = to_entries(rows)
+
+        more = len(entries) > limit
+        entries = entries[:limit]
+        if before_seq is not None:
+            entries.reverse()
+            cursor = {"before": entries[0]["seq"]} if more else None
+        else:
+            cursor = {"after": entries[-1]["seq"]} if more else None
+        return entries, cursor
+
+    # Entries of a session between two timestamps
+    def between(self, session_id, start_ts, end_ts, limit=MAX_PAGE_SIZE):
+        self.flush()
+        rows = self.connection().execute(
+            "SELECT session_id, seq, ts, audio_size, text FROM transcripts "
+            "WHERE session_id = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?",
+            (session_id, start_ts, end_ts, limit)).fetchall()
+        return to_entries(rows)
+
+    # Full-text search, optionally within one session
+    def search(self, query, session_id=None, limit=HISTORY_PAGE_SIZE):
+        self.flush()
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if self.fts:
+            sql = ("SELECT t.session_id, t.seq, t.ts, t.audio_size, t.text FROM transcripts_fts "
+                   "JOIN transcripts t ON t.id = transcripts_fts.rowid WHERE transcripts_fts MATCH ?")
+            # Quote each term so user input can't inject FTS query syntax
+            params = [" ".join('"' + term.replace('"', '""') + '"' for term in query.split())]
+        else:
+            sql = ("SELECT session_id, seq, ts, audio_size, text FROM transcripts t WHERE text LIKE ?")
+            params = [f"%{query}%"]
+        if session_id is not None:
+            sql += " AND t.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY t.ts DESC LIMIT ?"
+        params.append(limit)
+        if not params[0].strip('"% '):
+            return []
+        rows = self.connection().execute(sql, params).fetchall()
+        return to_entries(rows)
+
+    # Recent text of a session from the in-memory tail, optionally only one audio size
+    def recent_text(self, session_id, audio_size=None):
+        with self.lock:
+            tail = list(self.tails.get(session_id, ()))
+        return [e["text"] for e in tail if audio_size is None or e["audio_size"] == audio_size]
@@ -0,0 +1,132 @@
+import os
+from array import array
+from collections import deque
+from operator import mul
+
+# Per-connection VAD tuning. In a noisy room webrtcvad at a fixed aggressiveness passes background
+# noise as speech, and those segments cost a full decode only to come back empty. Each connection
+# tracks its share of empty transcripts and its noise floor, and steps up VAD aggressiveness and an
+# energy gate above the noise floor while too many decodes are wasted, back down once they aren't.
+VAD_AUTOTUNE = os.environ.get("VAD_AUTOTUNE", "1") != "0"
+VAD_AGGRESSIVENESS = 1  # Starting webrtcvad mode, and the baseline savings are measured against
+# Tuning levels from most to least sensitive: (webrtcvad mode, energy gate as a multiple of the
+# noise floor, 0 for no gate)
+VAD_LEVELS = [(1, 0), (2, 0), (2, 1.5), (3, 1.5), (3, 2.5), (3, 4.0)]
+RESULT_WINDOW = 20  # Recent transcripts the empty ratio is computed over
+MIN_RESULTS = 8  # Transcripts needed after a change before the next one
+RAISE_EMPTY_RATIO = 0.3  # Step to a less sensitive level above this share of empty transcripts
+LOWER_EMPTY_RATIO = 0.05  # Step back towards the baseline below it
+NOISE_SAMPLE_EVERY = 4  # Measure every Nth non-speech frame for the noise floor
+NOISE_ALPHA = 0.05  # Smoothing of the noise floor estimate
+MIN_NOISE_FLOOR = 50.0  # RMS floor, so digital silence doesn't gate quiet speech
+RMS_STRIDE = 4  # Every Nth sample is enough to estimate a frame's RMS
+# Decode cost per second of audio, to turn suppressed audio into GPU seconds (RTF of the backend)
+GPU_SECONDS_PER_AUDIO_SECOND = float(os.environ.get("GPU_SECONDS_PER_AUDIO_SECOND", "0.05"))
+
+# Totals across connections, logged periodically by the WebSocket server
+totals = {"empty_decodes": 0, "wasted_gpu_seconds": 0.0, "suppressed_seconds": 0.0, "gpu_seconds_saved": 0.0}
+
+
+def totals_snapshot():
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in totals.items()}
+
+
+# RMS of a frame of 16-bit little-endian PCM, from a strided subsample
+def frame_rms(frame):
+    samples = array('h', frame)[::RMS_STRIDE]
+    if not samples:
+        return 0.0
+    return (sum(map(mul, samples, samples)) / len(samples)) ** 0.5
+
+
+class VadTuner:
+    def __init__(self, sample_rate, frame_seconds, autotune=VAD_AUTOTUNE, vad_factory=None):
+        if vad_factory is None:
+            import webrtcvad
+            vad_factory = webrtcvad.Vad
+        self.sample_rate = sample_rate
+        self.frame_seconds = frame_seconds
+        self.autotune = autotune
+        self.vad = vad_factory(VAD_AGGRESSIVENESS)
+        # What an untuned connection would decide. webrtcvad adapts to the stream it is fed, so the
+        # baseline sees every frame; without autotuning the level never changes and it isn't needed.
+        self.baseline_vad = vad_factory(VAD_AGGRESSIVENESS) if autotune else None
+        self.vad_factory = vad_factory
+        self.level = 0
+        self.gate_margin = 0
+        self.results = deque(maxlen=RESULT_WINDOW)
+        self.results_since_change = 0
+        self.noise_floor = None
+        self.noise_frames = 0
+        self.stats = {"empty_decodes": 0, "decodes": 0, "wasted_gpu_seconds": 0.0, "suppressed_seconds": 0.0,
+                      "gated_seconds": 0.0, "level_changes": 0}
+
+    # Whether a frame counts as speech at the current level
+    def is_speech(self, frame):
+        baseline = self.baseline_vad is not None and self.baseline_vad.is_speech(frame, self.sample_rate)
+        speech = self.vad.is_speech(frame, self.sample_rate)
+        if not speech:
+            self.noise_frames += 1
+            if self.noise_frames % NOISE_SAMPLE_EVERY == 0:
+                self.update_noise_floor(frame_rms(frame))
+        elif self.gate_margin and self.noise_floor is not None:
+            if frame_rms(frame) < self.noise_floor * self.gate_margin:
+                self.stats["gated_seconds"] += self.frame_seconds
+                speech = False
+        if baseline and not speech:
+            self.suppress()
+        return speech
+
+    def update_noise_floor(self, level):
+        level = max(level, MIN_NOISE_FLOOR)
+        if self.noise_floor is None:
+            self.noise_floor = level
+        else:
+            self.noise_floor += NOISE_ALPHA * (level - self.noise_floor)
+
+    # Audio the baseline VAD would have sent for decoding
+    def suppress(self):
+        self.stats["suppressed_seconds"] += self.frame_seconds
+        totals["suppressed_seconds"] += self.frame_seconds
+        totals["gpu_seconds_saved"] += self.frame_seconds * GPU_SECONDS_PER_AUDIO_SECOND
+
+    # Feed back the outcome of a decode of audio_seconds of this connection's speech
+    def record_result(self, audio_seconds, empty):
+        self.stats["decodes"] += 1
+        if empty:
+            wasted = audio_seconds * GPU_SECONDS_PER_AUDIO_SECOND
+            self.stats["empty_decodes"] += 1
+            self.stats["wasted_gpu_seconds"] += wasted
+            totals["empty_decodes"] += 1
+            totals["wasted_gpu_seconds"] += wasted
+        self.results.append(empty)
+        self.results_since_change += 1
+        if not self.autotune or self.results_since_change < MIN_RESULTS:
+            return None
+        ratio = sum(self.results) / len(self.results)
+        if ratio > RAISE_EMPTY_RATIO and self.level < len(VAD_LEVELS) - 1:
+            return self.set_level(self.level + 1)
+        if ratio < LOWER_EMPTY_RATIO and self.level > 0:
+            return self.set_level(self.level - 1)
+        return None
+
+    def set_level(self, level):
+        mode, self.gate_margin = VAD_LEVELS[level]
+        if mode != VAD_LEVELS[self.level][0]:
+            self.vad = self.vad_factory(mode)
+        self.level = level
+        self.results.clear()
+        self.results_since_change = 0
+        self.stats["level_changes"] += 1
+        return level
+
+    def snapshot(self):
+        mode, gate = VAD_LEVELS[self.level]
+        return {
+            "level": self.level,
+            "vad_mode": mode,
+            "gate": round(self.noise_floor * gate, 1) if gate and self.noise_floor else None,
+            "noise_floor": round(self.noise_floor, 1) if self.noise_floor else None,
+            "gpu_seconds_saved": round(self.stats["suppressed_seconds"] * GPU_SECONDS_PER_AUDIO_SECOND, 3),
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()},
+        }
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+
+from structured_logging import setup_logging
+
+# Durable work queue between the WebSocket server and any number of transcription workers on the
+# same host (SQLite's WAL needs shared memory, so the queue file can't be shared across hosts).
+# Jobs are leased to one worker at a time; a job whose lease runs out (worker crashed or hung)
+# is handed to another worker. Results are stored on the job until the publisher collects them.
+# Jobs the publisher stopped waiting for are deleted, and anything older than JOB_TTL is swept.
+QUEUE_PATH = os.environ.get("QUEUE_PATH", "transcription_queue.db")
+LEASE_SECONDS = 30  # How long a worker owns a job before it's redelivered
+MAX_ATTEMPTS = 3  # Deliveries before a job is marked failed
+POLL_INTERVAL = 0.05  # Seconds between checks for new jobs or results
+MAX_POLL_INTERVAL = 0.5  # Back-off ceiling while the queue is idle
+RESULT_TIMEOUT = 120  # Seconds the publisher waits for a result
+JOB_TTL = RESULT_TIMEOUT * 2  # Jobs older than this are past any publisher's wait, finished or not
+SWEEP_INTERVAL = 10  # Seconds between sweeps of expired jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, job_id, payload, audio, attempts):
+        self.id = job_id
+        self.payload = payload
+        self.audio = audio
+        self.attempts = attempts
+
+
+# Interface every broker implements, so the queue can move to another backend without
+# touching the WebSocket server or the workers
+class Broker(ABC):
+    max_attempts = MAX_ATTEMPTS
+
+    # Add a job, returns its id
+    @abstractmethod
+    def publish(self, payload, audio=None):
+        ...
+
+    # Lease the oldest available job to a worker, or return None when the queue is empty
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        ...
+
+    # Keep ownership of a job that is taking a while
+    @abstractmethod
+    def extend_lease(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        ...
+
+    # Mark a job done with its result
+    @abstractmethod
+    def ack(self, job_id, worker_id, result):
+        ...
+
+    # Give a job back, so another worker can take it straight away
+    @abstractmethod
+    def nack(self, job_id, worker_id):
+        ...
+
+    # Return and remove the result of a finished job, or None while it's still pending
+    @abstractmethod
+    def collect(self, job_id):
+        ...
+
+    # Remove a job whose result is no longer wanted, so no worker spends time on it
+    @abstractmethod
+    def cancel(self, job_id):
+        ...
+
+    @abstractmethod
+    def stats(self):
+        ...
+
+
+class SqliteBroker(Broker):
+    def __init__(self, path=QUEUE_PATH, max_attempts=MAX_ATTEMPTS, job_ttl=JOB_TTL):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.job_ttl = job_ttl
+        self.last_sweep = 0.0
+        self.local = threading.local()  # sqlite3 connections can't be shared across threads
+        with self.connection() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                audio BLOB,
+                state TEXT NOT NULL DEFAULT 'queued',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                result TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def publish(self, payload, audio=None):
+        db = self.connection()
+        cursor = db.execute("INSERT INTO jobs (payload, audio, created) VALUES (?, ?, ?)",
+                            (json.dumps(payload), audio, time.time()))
+        return cursor.lastrowid
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        db = self.connection()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")  # Take the write lock so two workers can't lease the same job
+        try:
+            # Drop jobs nobody can collect any more: results left by a publisher that timed out or
+            # restarted, and queued jobs it has long stopped waiting for
+            if now - self.last_sweep >= SWEEP_INTERVAL:
+                self.last_sweep = now
+                db.execute("DELETE FROM jobs WHERE state != 'leased' AND created < ?", (now - self.job_ttl,))
+            # Redeliver jobs whose worker stopped renewing its lease, failing those out of attempts
+            db.execute("UPDATE jobs SET state = 'failed', audio = NULL, result = ? "
+                       "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                       (json.dumps({"error": "Job failed on every delivery attempt"}), now, self.max_attempts))
+            db.execute("UPDATE jobs SET state = 'queued', worker = NULL "
+                       "WHERE state = 'leased' AND lease_until < ?", (now,))
+            row = db.execute("SELECT id, payload, audio, attempts FROM jobs WHERE state = 'queued' "
+                             "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            job_id, payload, audio, attempts = row
+            db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (worker_id, now + lease_seconds, job_id))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return Job(job_id, json.loads(payload), audio, attempts + 1)
+
+    def extend_lease(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        cursor = self.connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def ack(self, job_id, worker_id, result):
+        # Only the current lease holder may complete a job, a redelivered job's old worker is ignored
+        cursor = self.connection().execute(
+            "UPDATE jobs SET state = 'done', audio = NULL, result = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (json.dumps(result), job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def nack(self, job_id, worker_id):
+        cursor = self.connection().execute(
+            "UPDATE jobs SET state = 'queued', worker = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+            (job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def collect(self, job_id):
+        db = self.connection()
+        row = db.execute("SELECT result FROM jobs WHERE id = ? AND state IN ('done', 'failed')", (job_id,)).fetchone()
+        if row is None:
+            return None
+        db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return json.loads(row[0])
+
+    def cancel(self, job_id):
+        # A worker still transcribing it finds its ack rejected
+        self.connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def stats(self):
+        rows = self.connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return dict(rows)
+
+
+# Publisher side, used by the WebSocket server. Broker calls run off the event loop.
+class QueueTranscriptionClient:
+    def __init__(self, broker=None, result_timeout=RESULT_TIMEOUT):
+        self.broker = broker or SqliteBroker()
+        self.result_timeout = result_timeout
+
+    async def transcribe(self, payload, audio_data=None):
+        job_id = await asyncio.to_thread(self.broker.publish, payload, bytes(audio_data) if audio_data else None)
+        deadline = time.time() + self.result_timeout
+        interval = POLL_INTERVAL
+        try:
+            while time.time() < deadline:
+                result = await asyncio.to_thread(self.broker.collect, job_id)
+                if result is not None:
+                    return result
+                await asyncio.sleep(interval)
+                interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.broker.cancel, job_id)
+            raise
+        await asyncio.to_thread(self.broker.cancel, job_id)
+        raise TimeoutError(f"No result for transcription job {job_id} after {self.result_timeout}s")
+
+
+# Forward a job to a transcription HTTP endpoint, for workers in front of an existing backend
+def http_handler(url):
+    def handle(job):
+        request = urllib.request.Request(url, data=json.dumps(job.payload).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=LEASE_SECONDS * MAX_ATTEMPTS) as response:
+            return json.loads(response.read())
+    return handle
+
+
+# Transcribe a job in this process with the shared model, using the PCM sent with the job
+def local_handler():
+    import numpy as np
+    from shm_transport import pcm_to_model_audio
+    from transcribeshort import transcribe_array
+
+    def handle(job):
+        if job.audio is None:
+            raise ValueError("Job has no audio attached")
+        audio = pcm_to_model_audio(np.frombuffer(job.audio, dtype=np.int16), job.payload["sample_rate"])
+        return transcribe_array(audio, job.payload)
+    return handle
+
+
+# Pull jobs until stopped. Setting stop drains the worker: the current job finishes and is
+# acknowledged, then the loop exits without claiming more.
+def run_worker(broker, handler, worker_id=None, stop=None, lease_seconds=LEASE_SECONDS):
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    stop = stop or threading.Event()
+    interval = POLL_INTERVAL
+    logger.info("Worker %s pulling from %s", worker_id, getattr(broker, 'path', broker), extra={"category": "queue"})
+    while not stop.is_set():
+        job = broker.claim(worker_id, lease_seconds)
+        if job is None:
+            stop.wait(interval)
+            interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+            continue
+        interval = POLL_INTERVAL
+
+        # Renew the lease while the job runs, so long transcriptions aren't redelivered
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(lease_seconds / 3):
+                broker.extend_lease(job.id, worker_id, lease_seconds)
+        threading.Thread(target=renew, daemon=True).start()
+        try:
+            result = handler(job)
+        except Exception as e:
+            logger.warning("Job %s failed on attempt %s: %s", job.id, job.attempts, e, extra={"category": "queue"})
+            done.set()
+            if job.attempts >= broker.max_attempts:
+                broker.ack(job.id, worker_id, {"error": "An error occurred during transcription", "details": str(e)})
+            else:
+                broker.nack(job.id, worker_id)
+            continue
+        done.set()
+        if not broker.ack(job.id, worker_id, result):
+            logger.warning("Job %s was redelivered or cancelled before it finished, result discarded", job.id,
+                           extra={"category": "queue"})
+    logger.info("Worker %s drained", worker_id, extra={"category": "queue"})
+
+
+# SIGTERM or Ctrl-C drains the worker instead of dropping its in-flight job
+def drain_on_signals(stop):
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Transcription worker pulling from the local work queue")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="SQLite queue file")
+    parser.add_argument("--backend", default="local",
+                        help="'local' to transcribe in this process, or a /transcribe URL to forward to")
+    parser.add_argument("--worker-id")
+    args = parser.parse_args()
+
+    setup_logging()
+    handler = local_handler() if args.backend == "local" else http_handler(args.backend)
+    stop = threading.Event()
+    drain_on_signals(stop)
+    run_worker(SqliteBroker(args.queue), handler, args.worker_id, stop)